@@ -3,8 +3,10 @@
 import moderngl
 import pyglet as pg
 import numpy as np
+from Modules.FrameClock import FrameClock
 
 window = pg.window.Window(640, 480, 'Hello Triangle', resizable=False)
+clock = FrameClock()
 
 ctx = moderngl.create_context()
 prog = ctx.program(
@@ -47,7 +49,9 @@ vbo = ctx.buffer(vertices.astype('f4').tobytes())
 ibo = ctx.buffer(indices.astype('i4').tobytes())
 vao = ctx.simple_vertex_array(prog, vbo, 'in_vert', 'in_color', index_buffer=ibo)
 
-ctx.clear(.1, .1, .1)
-vao.render()
+def update(dt):
+    ctx.clear(.1, .1, .1)
+    vao.render()
 
+clock.schedule(update, window=window)
 pg.app.run()
\ No newline at end of file
@@ -4,9 +4,10 @@
 import moderngl
 import numpy as np
 import pyglet as pg
-import time
+from Modules.FrameClock import FrameClock
 
 window = pg.window.Window(640, 480, 'Shaders', resizable=False)
+clock = FrameClock()
 
 ctx = moderngl.create_context()
 prog = ctx.program(
@@ -43,7 +44,7 @@ vbo = ctx.buffer(vertices.astype('f4').tobytes())
 vao = ctx.simple_vertex_array(prog, vbo, 'in_vert')
 
 def changeColour(prog):
-    col = np.sin(time.clock())
+    col = np.sin(clock.time)
     prog['ourColour'].value = (.9, col, .1, 1.0)
 
 def update(dt):
@@ -51,5 +52,5 @@ def update(dt):
     ctx.clear(.1, .1, .1)
     vao.render()
     
-pg.clock.schedule_interval(update, 1.0 / 60.0)
+clock.schedule(update, window=window)
 pg.app.run()
\ No newline at end of file
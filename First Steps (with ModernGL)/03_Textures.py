@@ -1,14 +1,15 @@
 # "rotating" rectangle with a repeating texture (2 image composite)
 
-from OpenGL.GL import *
 import moderngl
 import pyglet as pg
 import numpy as np
 from PIL import Image
 import os
-import time
+from Modules.FrameClock import FrameClock
+from Modules.RawGL import RawGL
 
 window = pg.window.Window(1000, 1000, 'Textures', resizable=False)
+clock = FrameClock()
 
 ctx = moderngl.create_context()
 prog = ctx.program(
@@ -65,15 +66,13 @@ img2 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Bulb.jpg'))
 tex1 = ctx.texture(img1.size, 3, img1.tobytes()) # 3 for RGB
 tex2 = ctx.texture(img2.size, 3, img2.tobytes())
 
-tex1.use(0) # bind texture to 0 texture unit
-
-# set texture wrapping
-glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_MIRRORED_REPEAT)
-glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_MIRRORED_REPEAT)
+# set texture wrapping (moderngl only has repeat on/off)
+RawGL.parameter(tex1, RawGL.TEXTURE_WRAP_S, RawGL.MIRRORED_REPEAT)
+RawGL.parameter(tex1, RawGL.TEXTURE_WRAP_T, RawGL.MIRRORED_REPEAT)
 # set texture filtering
-glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR) # test for artifacts with low resolution textures
+tex1.filter = (moderngl.NEAREST, moderngl.LINEAR) # test for artifacts with low resolution textures
 
+tex1.use(0) # bind texture to 0 texture unit
 tex2.use(1) # bind texture to 1 texture unit
 
 # assign texture unit indexes
@@ -81,9 +80,9 @@ prog['myTexture1'].value = 0
 prog['myTexture2'].value = 1
 
 def update(dt):
-    prog['scale'].value = np.sin(time.clock())
+    prog['scale'].value = np.sin(clock.time)
     ctx.clear(.1, .1, .1)
     vao.render()
     
-pg.clock.schedule_interval(update, 1.0 / 60.0)
+clock.schedule(update, window=window)
 pg.app.run()
\ No newline at end of file
@@ -6,11 +6,12 @@ import numpy as np
 from PIL import Image
 from pyrr import Matrix44, Vector4
 import os
-import time
+from Modules.FrameClock import FrameClock
 
 width = 640
 height = 640
 window = pg.window.Window(width, height, 'Transformations', resizable=False)
+clock = FrameClock()
 
 ctx = moderngl.create_context()
 prog = ctx.program(
@@ -75,14 +76,14 @@ prog['myTexture2'].value = 1
 def update(dt):
     proj = Matrix44.perspective_projection(50, width / height, 0.1, 1000.0)
     rotX = Matrix44.from_x_rotation(0)
-    rotY = Matrix44.from_y_rotation(time.clock()*1.5)
+    rotY = Matrix44.from_y_rotation(clock.time*1.5)
     rotZ = Matrix44.from_z_rotation(180 * np.pi / 180) # rotate 180 degrees. Convert degrees to radians
-    trans = Matrix44.from_translation( [ np.sin(time.clock())/4, np.sin(time.clock())/4, -1.3 ] ) # bounce diagonally from corner to corner, move back by -1.3
+    trans = Matrix44.from_translation( [ np.sin(clock.time)/4, np.sin(clock.time)/4, -1.3 ] ) # bounce diagonally from corner to corner, move back by -1.3
     scale = Matrix44.from_scale([.5,.5,.5]) # uniformly scale by 0.5
     tMatrix = proj * trans * scale * rotX * rotY * rotZ
     prog['transform'].write(tMatrix.astype('f4').tobytes())
     ctx.clear(.1, .1, .1)
     vao.render()
     
-pg.clock.schedule_interval(update, 1.0 / 60.0)
+clock.schedule(update, window=window)
 pg.app.run()
\ No newline at end of file
@@ -1,46 +1,62 @@
 # create multiple 3D primitives scattered in world space
+# all cubes are drawn with a single instanced render call, the per-cube transforms are built in the vertex shader
+# cubes outside the view frustum are culled on the CPU, only the visible ones are copied into the instance buffer
 
 import moderngl
-from OpenGL.GL import *
 import pyglet as pg
 import numpy as np
-from PIL import Image
 from pyrr import Matrix44, Vector4
+from Modules.TextureArray import TextureArray
+from Modules.Frustum import Frustum, InstanceCuller
+from Modules.FrameClock import FrameClock
 import os
-import time
 
 width = 640
 height = 640
 window = pg.window.Window(width, height, 'Transformations', resizable=False)
+clock = FrameClock()
 
 ctx = moderngl.create_context()
 prog = ctx.program(
     vertex_shader = '''
     # version 330 core
     
-    uniform mat4 transform;
+    uniform mat4 projection;
+    uniform float time;
     in vec3 in_vert;
     in vec2 in_UVs;
+    in vec3 in_offset; // per instance: world position
+    in float in_phase; // per instance: rotation offset
+    in vec2 in_layers; // per instance: base and decal layer of the texture array
     out vec2 v_UVs;
+    flat out vec2 v_layers;
     
     void main()
     {
-        gl_Position = transform * vec4(in_vert, 1.0);
+        float r = time + in_phase;
+        float c = cos(r);
+        float s = sin(r);
+        mat3 rotX = mat3(1.0, 0.0, 0.0,  0.0, c, -s,  0.0, s, c); // same element order as pyrr's from_x_rotation etc.
+        mat3 rotY = mat3(c, 0.0, s,  0.0, 1.0, 0.0,  -s, 0.0, c);
+        mat3 rotZ = mat3(c, -s, 0.0,  s, c, 0.0,  0.0, 0.0, 1.0);
+        vec3 position = in_offset + 0.5 * (rotX * rotY * rotZ * in_vert); // translate * scale * rotX * rotY * rotZ
+        gl_Position = projection * vec4(position, 1.0);
         v_UVs = in_UVs;
+        v_layers = in_layers;
     }
     ''',
     fragment_shader = '''
     # version 330 core
     
-    uniform sampler2D myTexture1;
-    uniform sampler2D myTexture2;
+    uniform sampler2DArray materials; // every image of the scene, see TextureArray
     
     in vec2 v_UVs;
+    flat in vec2 v_layers;
     out vec4 f_colour;
     
     void main()
     {
-        f_colour = texture(myTexture1, v_UVs) * texture(myTexture2, v_UVs); // combine 2 textures
+        f_colour = texture(materials, vec3(v_UVs, v_layers.x)) * texture(materials, vec3(v_UVs, v_layers.y)); // combine 2 layers
     }
     ''',
     )
@@ -91,38 +107,43 @@ vertices = np.array([
     -0.5,  0.5, -0.5,  0.0, 1.0,
     ])
 
-cubePositions = [np.random.uniform(-2,2,size=3) for i in range(1,30)] # scatter 30 boxes with a random coordinate between -2 and 2
+cubeCount = 29 # the per-frame cost does not depend on this, try 100000
+cubePositions = np.random.uniform(-2, 2, size=(cubeCount, 3)) # scatter boxes with a random coordinate between -2 and 2
+
+# all images in one texture array, a material is a (base, decal) pair of layers
+textures = TextureArray(ctx, {
+    'brick': os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=512)), # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
+    'bulb': os.path.join(os.path.dirname(__file__), 'images', 'Bulb.jpg'),
+    }, cache=True)
+cubeMaterials = textures.lookup([('brick', 'bulb')] * cubeCount) # every cube is brick * bulb, other pairs need no extra bind
+
+# per-instance data: offset (position moved back by -5), rotation phase based on the position's 1st component and material layers
+instances = np.hstack([cubePositions + [1, 1, -5], cubePositions[:, :1] * 10, cubeMaterials])
+
+# a rotating cube of size 0.5 stays within a sphere of radius 0.5 * sqrt(3) / 2 around its offset
+culler = InstanceCuller(ctx, instances, instances[:, :3], 0.25 * np.sqrt(3))
 
 vbo = ctx.buffer(vertices.astype('f4').tobytes())
-vao = ctx.simple_vertex_array(prog, vbo, 'in_vert', 'in_UVs')
-img1 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=512))) # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
-img2 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Bulb.jpg'))
-tex1 = ctx.texture(img1.size, 3, img1.tobytes()) # 3 for RGB
-tex2 = ctx.texture(img2.size, 3, img2.tobytes())
-tex1.use(0) # bind texture to 0 texture unit
-tex2.use(1) # bind texture to 1 texture unit
-# assign texture unit indexes
-prog['myTexture1'].value = 0
-prog['myTexture2'].value = 1
-
-glEnable(GL_DEPTH_TEST)
-
-def applyTransforms(vector, projectionMat):
-    r = time.clock() + vector[0] * 10 # rotation offset based on vector's 1st component
-    rotX = Matrix44.from_x_rotation(r)
-    rotY = Matrix44.from_y_rotation(r)
-    rotZ = Matrix44.from_z_rotation(r)
-    trans = Matrix44.from_translation(vector) * Matrix44.from_translation([1,1,-5]) # move view back by -5
-    scale = Matrix44.from_scale([.5,.5,.5]) # uniformly scale by 0.5
-    tMatrix = projectionMat * trans * scale * rotX * rotY * rotZ
-    prog['transform'].write(tMatrix.astype('f4').tobytes())
+vao = ctx.vertex_array(prog, [
+    (vbo, '3f 2f', 'in_vert', 'in_UVs'),
+    (culler.buffer, '3f 1f 2f/i', 'in_offset', 'in_phase', 'in_layers'), # /i - advance once per instance, visible ones first
+    ])
+textures.use(0) # one bind for every cube and material
+prog['materials'].value = 0
+
+proj = Matrix44.perspective_projection(45, width / height, 0.1, 1000.0)
+prog['projection'].write(proj.astype('f4').tobytes()) # set once, only time changes per frame
+frustum = Frustum(proj) # the camera does not move, world space is view space
+
+ctx.enable(moderngl.DEPTH_TEST)
 
 def update(dt):
-    proj = Matrix44.perspective_projection(45, width / height, 0.1, 1000.0)
     ctx.clear(.1, .1, .1) # also clears depth buffer
-    for vec in cubePositions: # render multiple cubes
-        applyTransforms(vec, proj)
-        vao.render()
+    prog['time'].value = clock.time
+    visible = culler.update(frustum)
+    if culler.changed: # only when the visible set changes
+        print('{} cubes tested, {} culled'.format(culler.tested, culler.culled))
+    vao.render(instances=visible) # render all visible cubes at once
     
-pg.clock.schedule_interval(update, 1.0 / 60.0)
+clock.schedule(update, window=window)
 pg.app.run()
\ No newline at end of file
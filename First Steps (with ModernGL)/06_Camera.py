@@ -3,7 +3,6 @@
 # check module Viewport.py for more details
 
 import moderngl
-from OpenGL.GL import *
 import pyglet as pg
 from pyglet.window import key
 import numpy as np
@@ -11,24 +10,29 @@ from PIL import Image
 from pyrr import Matrix33, Matrix44, Vector4, Vector3
 import pyrr
 import os
-import time
 from Modules.ViewportFP import ViewportFP
+from Modules.FrameClock import FrameClock
+from Modules.Frustum import Frustum
+from Modules.BVH import BVH
+from Modules.functions import Math
 
 window = ViewportFP() # First-Person-type viewport
+clock = FrameClock()
 
 ctx = moderngl.create_context()
 prog = ctx.program(
     vertex_shader = '''
     # version 330 core
     
-    uniform mat4 transform;
+    uniform mat4 viewProjection;
     in vec3 in_vert;
     in vec2 in_UVs;
+    in mat4 in_model; // per instance: the cube's model matrix
     out vec2 v_UVs;
     
     void main()
     {
-        gl_Position = transform * vec4(in_vert, 1.0);
+        gl_Position = viewProjection * in_model * vec4(in_vert, 1.0);
         v_UVs = in_UVs;
     }
     ''',
@@ -96,8 +100,19 @@ vertices = np.array([
 
 cubePositions = [np.random.uniform(-2.0,2.0,size=3) for i in range(1,30)] # scatter 30 boxes with a random coordinate between -2 and 2
 
+# cubes of size 0.5 fit in a box of half size 0.25*sqrt(3) whatever their rotation, a BVH over those boxes
+# culls them when the camera moves and picks the one in the middle of the screen on a mouse click
+centres = np.array(cubePositions) + [1.0,1.0,-5.0]
+bvh = BVH(centres - 0.25*np.sqrt(3), centres + 0.25*np.sqrt(3))
+frustum = Frustum()
+visibleCubes = None
+
+# the visible cubes are drawn with one instanced render call, their model matrices built in one batch
+phases = np.array(cubePositions)[:, 0] * 10.0 # cube rotation offset based on the position's 1st component
+models = np.empty((len(cubePositions), 4, 4), dtype='f4')
 vbo = ctx.buffer(vertices.astype('f4').tobytes())
-vao = ctx.simple_vertex_array(prog, vbo, 'in_vert', 'in_UVs')
+instanceBuffer = ctx.buffer(reserve=models.nbytes)
+vao = ctx.vertex_array(prog, [(vbo, '3f 2f', 'in_vert', 'in_UVs'), (instanceBuffer, '16f/i', 'in_model')])
 img1 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=512))) # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
 img2 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Bulb.jpg'))
 tex1 = ctx.texture(img1.size, 3, img1.tobytes()) # 3 for RGB
@@ -110,25 +125,32 @@ tex2.use(1) # bind texture to 1 texture unit
 prog['myTexture1'].value = 0
 prog['myTexture2'].value = 1
 
-glEnable(GL_DEPTH_TEST)
+ctx.enable(moderngl.DEPTH_TEST)
+
+def scatterCubes(ids):
+    '''Model matrices of the cubes ids into the instance buffer, returns how many'''
+    r = phases[ids]
+    rot = np.degrees(np.stack([r*clock.time/10.0, r, r], axis=1)) # rotate cubes over time around x
+    Math.buildTransMatrices(centres[ids], rot, [.5,.5,.5], out=models[:len(ids)]) # uniformly scale by 0.5
+    instanceBuffer.write(models[:len(ids)])
+    return len(ids)
 
-def scatterCubes(vector, projectionMat):
-    view = window.getViewMatrix()
-    r = vector[0] * 10.0 # cube rotation offset based on vector's 1st component
-    rotX = Matrix44.from_x_rotation(r*time.clock()/10.0) # rotate cubes over time
-    rotY = Matrix44.from_y_rotation(r)
-    rotZ = Matrix44.from_z_rotation(r)
-    trans = Matrix44.from_translation(vector) * Matrix44.from_translation([1.0,1.0,-5.0])
-    scale = Matrix44.from_scale([.5,.5,.5]) # uniformly scale by 0.5
-    tMatrix = projectionMat * view * trans * scale * rotX * rotY * rotZ
-    prog['transform'].write(tMatrix.astype('f4').tobytes())
+@window.event
+def on_mouse_press(x, y, button, modifiers):
+    camera = window.camera
+    cube, distance = bvh.raycast(camera.eye, camera.front) # the mouse is captured, aim with the centre of the screen
+    print('no cube hit' if cube < 0 else 'cube {} hit at a distance of {:.2f}'.format(cube, distance))
 
 def update(dt):
-    window.update()
+    global visibleCubes
+    window.update(clock) # camera moves in fixed steps
+    if window.viewChanged or visibleCubes is None:
+        frustum.update(window.getViewProjectionMatrix())
+        visibleCubes = np.sort(bvh.cull(frustum))
+        prog['viewProjection'].write(window.getViewProjectionMatrix().astype('f4').tobytes()) # only recomputed when the camera moves
     ctx.clear(.1, .1, .1) # also clears depth buffer
-    for vec in cubePositions: # render multiple cubes
-        scatterCubes(vec, window.getProjectionMatrix())
-        vao.render()
+    if len(visibleCubes):
+        vao.render(instances=scatterCubes(visibleCubes)) # render the cubes in view at once
     
-pg.clock.schedule_interval(update, 1.0 / 60.0)
+clock.schedule(update, window=window)
 pg.app.run()
\ No newline at end of file
@@ -6,41 +6,67 @@ import os
 import moderngl
 import numpy as np
 import pyglet as pg
-from pyglet.gl import *
 from pyglet.window import key, mouse
 import pyrr
 from pyrr import Matrix44, Vector3
-from PIL import Image
-import time
+from Modules.MeshQuantizer import MeshQuantizer
+from Modules.ResourceRegistry import ResourceRegistry
+from Modules.RenderQueue import RenderQueue
+from Modules.UniformBlock import UniformBlock
+from Modules.TextureLoader import TextureLoader
+from Modules.Profiler import Profiler
+from Modules.FrameClock import FrameClock
 
 width = 1280
 height = 720
 window = pg.window.Window(width, height, 'Light Casters', resizable=False)
+clock = FrameClock()
 
 ctx = moderngl.create_context()
+resources = ResourceRegistry(ctx) # VBOs/VAOs are built on first use and reused every frame
+textures = TextureLoader(ctx) # images are decoded on worker threads and streamed in over the first frames
+profiler = Profiler(ctx)
+window.push_handlers(profiler)
+queue = RenderQueue(ctx) # draws sorted by program and textures, redundant binds skipped
 
 vs_box = '''
     # version 330 core
     
-    uniform mat4 projection;
-    uniform mat4 view;
+    layout (std140) uniform Camera // shared by all programs, see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
     uniform mat4 model;
+    uniform vec3 quantOffset; // dequantization, see MeshQuantizer
+    uniform vec3 quantScale;
+    uniform float octScale;
     
-    layout (location = 0) in vec3 in_vert;
-    layout (location = 1) in vec3 in_norm;
-    layout (location = 2) in vec2 in_UVs;
+    layout (location = 0) in vec3 in_vert; // int16, relative to the cube's AABB
+    layout (location = 1) in vec2 in_norm; // octahedral encoded
+    layout (location = 2) in vec2 in_UVs; // half floats
     
     out vec3 fragPos;
     out vec3 fragNorm;
     out vec2 texCoords;
     
+    vec3 octDecode(vec2 e)
+    {
+        vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+        float t = max(-n.z, 0.0);
+        n.xy += vec2(n.x >= 0.0 ? -t : t, n.y >= 0.0 ? -t : t);
+        return normalize(n);
+    }
+    
     void main()
     {
-        fragPos = vec3(model * vec4(in_vert, 1.0));
-        vec3 normal = mat3(transpose(inverse(model))) * in_norm; // due to cube's rotation, we need to transform the normal
+        vec3 position = quantOffset + in_vert * quantScale;
+        fragPos = vec3(model * vec4(position, 1.0));
+        vec3 normal = mat3(transpose(inverse(model))) * octDecode(in_norm * octScale); // due to cube's rotation, we need to transform the normal
         fragNorm = normal;
         texCoords = in_UVs;
-        gl_Position = projection * view * model * vec4(in_vert, 1.0);
+        gl_Position = projection * view * model * vec4(position, 1.0);
     }
     '''
     
@@ -54,18 +80,21 @@ fs_box = '''
         float shininess;
     };
     
-    struct Light
+    uniform Material material;
+    layout (std140) uniform Camera // shared by all programs, see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
+    layout (std140) uniform Light
     {
         vec3 position;
         
         vec3 ambient;
         vec3 diffuse;
         vec3 specular;
-    };
-    
-    uniform Material material;
-    uniform Light light;
-    uniform vec3 viewPos;
+    } light;
     
     in vec3 fragPos;
     in vec3 fragNorm;
@@ -107,14 +136,20 @@ fs_box = '''
 vs_light = '''
     # version 330 core
     
-    uniform mat4 projection;
-    uniform mat4 view;
+    layout (std140) uniform Camera // shared by all programs, see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
     uniform mat4 model;
+    uniform vec3 quantOffset;
+    uniform vec3 quantScale;
     layout (location = 0) in vec3 in_vert;
     
     void main()
     {
-        gl_Position = projection * view * model * vec4(in_vert, 1.0);
+        gl_Position = projection * view * model * vec4(quantOffset + in_vert * quantScale, 1.0);
     }
     '''
     
@@ -177,8 +212,11 @@ vertices = np.array([
     -0.5,  0.5,  0.5,  0.0,  1.0,  0.0,  0.0, 0.0,
     -0.5,  0.5, -0.5,  0.0,  1.0,  0.0,  0.0, 1.0
     ])
+cube, cubeBounds = MeshQuantizer.quantize(vertices) # 16 instead of 32 bytes per vertex
+MeshQuantizer.writeUniforms(box_prog, cubeBounds)
+MeshQuantizer.writeUniforms(light_prog, cubeBounds)
 
-glEnable(GL_DEPTH_TEST)
+ctx.enable(moderngl.DEPTH_TEST)
 
 cameraSpeed = 0.2
 cameraPos = Vector3([1.0, 2.0, -3.0])
@@ -190,6 +228,19 @@ proj = Matrix44.perspective_projection(45.0, width / height, 0.1, 1000.0)
 # light parameters 
 lightPos = Vector3([-0.8, -0.4, -0.3])
 lightCol = Vector3([1.0, 1.0, 1.0])
+
+# uniform blocks, uploaded at most once per frame: the camera for both programs, the light for the box only
+cameraBlock = UniformBlock(ctx, 'Camera', [('projection', 'mat4'), ('view', 'mat4'), ('viewPos', 'vec3')], binding=0)
+lightBlock = UniformBlock(ctx, 'Light', [('position', 'vec3'), ('ambient', 'vec3'), ('diffuse', 'vec3'), ('specular', 'vec3')], binding=1)
+for prog in (box_prog, light_prog):
+    cameraBlock.attach(prog)
+lightBlock.attach(box_prog)
+cameraBlock.write('projection', proj)
+cameraBlock.write('view', view)
+cameraBlock.write('viewPos', cameraPos)
+lightBlock.write('ambient', [0.2, 0.2, 0.2])
+lightBlock.write('diffuse', [0.7, 0.7, 0.7])
+lightBlock.write('specular', lightCol)
         
 @window.event
 def on_mouse_drag(x, y, dx, dy, buttons, modifiers):
@@ -210,63 +261,48 @@ def buildTransMatrix(pos=[0,0,0], rot=[0,0,0], scale=[1,1,1]):
     return tMatrix
 
 def loadTextures():
-    img1 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=512))) # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
-    tex1 = ctx.texture(img1.size, 3, img1.tobytes()) # 3 for RGB
-    tex1.use(0) # bind texture to 0 texture unit
-    img2 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Brick_Spec.jpg'))
-    tex2 = ctx.texture(img2.size, 3, img2.tobytes()) # 3 for RGB
-    tex2.use(1) # bind texture to 1 texture unit
+    tex1 = textures.load(os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=512)), mipmaps=False, cache=True) # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
+    tex2 = textures.load(os.path.join(os.path.dirname(__file__), 'images', 'Brick_Spec.jpg'), mipmaps=False, cache=True)
+    return tex1, tex2
 
 def drawBox():
-    vbo = ctx.buffer(vertices.astype('f4').tobytes())
-    vao = ctx.simple_vertex_array(box_prog, vbo, 'in_vert', 'in_norm', 'in_UVs')
-    
-    model = buildTransMatrix(rot=[0, time.clock() * 25, 0]) # slowly rotate the cube
-    box_prog['projection'].write(proj.astype('f4').tobytes())
-    box_prog['view'].write(view.astype('f4').tobytes())
-    box_prog['model'].write(model.astype('f4').tobytes())
-    box_prog['viewPos'].write(cameraPos.astype('f4').tobytes())
-    
-    # light properties
-    pos = lightPos
-    amb = Vector3([0.2, 0.2, 0.2])
-    diff = Vector3([0.7, 0.7, 0.7])
-    spec = lightCol
-    box_prog['light.position'].write(pos.astype('f4').tobytes())
-    box_prog['light.ambient'].write(amb.astype('f4').tobytes())
-    box_prog['light.diffuse'].write(diff.astype('f4').tobytes())
-    box_prog['light.specular'].write(spec.astype('f4').tobytes())
-    
-    # material properties
-    diff = Vector3([1.0, 0.5, 0.31])
-    spec = Vector3([0.5, 0.5, 0.5])
-    shine = 32.0
-    box_prog['material.diffuse'].value = 0 # texture unit 0
-    box_prog['material.specular'].value = 1 # texture unit 1
-    box_prog['material.shininess'].value = shine
-    
-    vao.render()
+    model = buildTransMatrix(rot=[0, clock.time * 25, 0]) # slowly rotate the cube
+    queue.submit(boxMesh, boxMaterial, depth=np.linalg.norm(cameraPos), uniforms={'model': model})
     
 def drawLight():
-    vbo = ctx.buffer(vertices.astype('f4').tobytes())
-    vao = ctx.simple_vertex_array(light_prog, vbo, 'in_vert')
-    # skip normal vector and texture coordinates data
-    # each position value is a 32-bit float (4 bytes)
-    # 8 data values per vertex
-    vao.bind(0, 'f', vbo, '4f', stride = 4*8)
     model = buildTransMatrix(pos=lightPos, scale=[0.1, 0.1, 0.1])
-    light_prog['projection'].write(proj.astype('f4').tobytes())
-    light_prog['view'].write(view.astype('f4').tobytes())
-    light_prog['model'].write(model.astype('f4').tobytes())
-    objCol = Vector3([1.0, 1.0, 1.0])
-    light_prog['lightColour'].write(lightCol.astype('f4').tobytes())
-    vao.render()
+    queue.submit(lightMesh, lightMaterial, depth=np.linalg.norm(lightPos - cameraPos), uniforms={'model': model})
 
 def update(dt):
-    ctx.clear(.1, .1, .1)
-    drawBox()
-    drawLight()
+    textures.update()
+    with profiler.span('clear'):
+        ctx.clear(.1, .1, .1)
+    lightBlock.write('position', lightPos)
+    cameraBlock.update()
+    lightBlock.update()
+    with profiler.span('submit'):
+        drawBox()
+        drawLight()
+    with profiler.span('draw'):
+        queue.flush()
+    profiler.endFrame()
+    if profiler.overlay and profiler.frames % 30 == 0:
+        window.set_caption('Light Casters - {} | {}'.format(profiler.text(), queue.text()))
+    allocations = resources.endFrame()
+    if allocations:
+        print('{} GPU allocations this frame, {} in total'.format(allocations, resources.allocations)) # silent once everything is cached
 
-loadTextures()
-pg.clock.schedule_interval(update, 1.0 / 60.0)
-pg.app.run()
\ No newline at end of file
+tex1, tex2 = loadTextures()
+boxMesh = queue.mesh(resources.vertexArray(box_prog, 'cube', cube, MeshQuantizer.format(normals='oct16'), 'in_vert', 'in_norm', 'in_UVs'))
+lightMesh = queue.mesh(resources.vertexArray(light_prog, 'cube', cube, MeshQuantizer.format(normals='oct16', skip=('nx ny nz', 'tx ty')), 'in_vert')) # skip normal vector and texture coordinates data
+# material properties: diffuse map on texture unit 0, specular map on unit 1
+boxMaterial = queue.material(box_prog, textures=[(0, tex1), (1, tex2)], uniforms={'material.diffuse': 0, 'material.specular': 1, 'material.shininess': 32.0})
+lightMaterial = queue.material(light_prog, uniforms={'lightColour': lightCol})
+clock.schedule(update, window=window)
+pg.app.run()
+resources.release()
+textures.release()
+cameraBlock.release()
+lightBlock.release()
+print('render queue:', queue.text())
+profiler.release()
\ No newline at end of file
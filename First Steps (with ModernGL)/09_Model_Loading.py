@@ -3,45 +3,71 @@ Loading OBJ models
 '''
 
 import os
-import time
 import moderngl
 import numpy as np
 import pyglet as pg
-from pyglet.gl import *
-from PIL import Image
 from pyrr import Matrix33, Matrix44, Vector3
-from objloader import Obj
 from Modules.ViewportFP import ViewportFP
+from Modules.MeshCache import MeshCache
+from Modules.MeshQuantizer import MeshQuantizer
+from Modules.UniformCache import UniformCache
+from Modules.UniformBlock import UniformBlock
+from Modules.TextureManager import TextureManager
+from Modules.TextureLOD import TextureLOD
+from Modules.Profiler import Profiler
+from Modules.Frustum import Frustum
+from Modules.Picking import MeshBVH, Picker
 from Modules.functions import Math, Path
+from Modules.FrameClock import FrameClock
 
 # light parameters 
 lightPos = Vector3([5.0, 4.0, -5.0])
 lightCol = Vector3([1.0, 1.0, 1.0])
 
 window = ViewportFP()
+clock = FrameClock()
 ctx = moderngl.create_context()
+profiler = Profiler(ctx)
+window.profiler = profiler
 
 vs = '''
     # version 330 core
     
-    uniform mat4 MVP;
+    layout (std140) uniform Camera // see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
     uniform mat4 model;
+    uniform vec3 quantOffset; // dequantization, see MeshQuantizer
+    uniform vec3 quantScale;
+    uniform float octScale;
     
-    layout (location = 0) in vec3 in_vert;
-    layout (location = 1) in vec3 in_norm;
-    layout (location = 2) in vec2 in_UVs;
+    layout (location = 0) in vec3 in_vert; // int16, relative to the mesh AABB
+    layout (location = 1) in vec2 in_norm; // octahedral encoded
+    layout (location = 2) in vec2 in_UVs; // half floats
     
     out vec3 fragPos;
     out vec3 fragNorm;
     out vec2 texCoords;
     
+    vec3 octDecode(vec2 e)
+    {
+        vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+        float t = max(-n.z, 0.0);
+        n.xy += vec2(n.x >= 0.0 ? -t : t, n.y >= 0.0 ? -t : t);
+        return normalize(n);
+    }
+    
     void main()
     {
-        fragPos = vec3(model * vec4(in_vert, 1.0));
-        vec3 normal = mat3(transpose(inverse(model))) * in_norm;
+        vec3 position = quantOffset + in_vert * quantScale;
+        fragPos = vec3(model * vec4(position, 1.0));
+        vec3 normal = mat3(transpose(inverse(model))) * octDecode(in_norm * octScale);
         fragNorm = normal;
         texCoords = in_UVs;
-        gl_Position = MVP * vec4(in_vert, 1.0);
+        gl_Position = projection * view * model * vec4(position, 1.0);
     }
     '''
     
@@ -55,18 +81,21 @@ fs = '''
         float shininess;
     };
     
-    struct Light
+    uniform Material material;
+    layout (std140) uniform Camera // see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
+    layout (std140) uniform Light
     {
         vec3 position;
         
         vec3 ambient;
         vec3 diffuse;
         vec3 specular;
-    };
-    
-    uniform Material material;
-    uniform Light light;
-    uniform vec3 viewPos;
+    } light;
     
     in vec3 fragPos;
     in vec3 fragNorm;
@@ -96,52 +125,90 @@ fs = '''
     '''
 
 prog = ctx.program(vertex_shader=vs, fragment_shader=fs)
-glShadeModel(GL_SMOOTH)
-glEnable(GL_DEPTH_TEST)
+uniforms = UniformCache(prog) # skip uploads of unchanged values
+ctx.enable(moderngl.DEPTH_TEST)
 
-obj = Obj.open(Path.local('models', 'teapot.obj'))
-vbo = ctx.buffer(obj.pack('vx vy vz nx ny nz tx ty'))
-vao = ctx.simple_vertex_array(prog, vbo, 'in_vert', 'in_norm', 'in_UVs')
+mesh = MeshCache.load(Path.local('models', 'teapot.obj'), 'vx vy vz nx ny nz tx ty', indexed=True, optimize=True, quantize='oct16') # parsed, cache-optimised and quantized once, memory-mapped afterwards
+vbo = ctx.buffer(mesh.vertices) # deduplicated 16 byte vertices
+ibo = ctx.buffer(mesh.indices) # 16-bit indices when the vertex count allows it
+vao = ctx.vertex_array(prog, [(vbo, mesh.format(), 'in_vert', 'in_norm', 'in_UVs')], index_buffer=ibo, index_element_size=mesh.indices.itemsize)
+MeshQuantizer.writeUniforms(prog, mesh.bounds, mesh.quantize)
 
-# light properties
-pos = lightPos
-amb = Vector3([0.2, 0.2, 0.2])
-diff = Vector3([0.7, 0.7, 0.7])
-spec = lightCol
-prog['light.position'].write(pos.astype('f4').tobytes())
-prog['light.ambient'].write(amb.astype('f4').tobytes())
-prog['light.diffuse'].write(diff.astype('f4').tobytes())
-prog['light.specular'].write(spec.astype('f4').tobytes())
+# camera and light properties, std140 blocks uploaded at most once per frame
+cameraBlock = UniformBlock(ctx, 'Camera', [('projection', 'mat4'), ('view', 'mat4'), ('viewPos', 'vec3')], binding=0)
+lightBlock = UniformBlock(ctx, 'Light', [('position', 'vec3'), ('ambient', 'vec3'), ('diffuse', 'vec3'), ('specular', 'vec3')], binding=1)
+cameraBlock.attach(prog)
+cameraBlock.write('projection', window.getProjectionMatrix())
+lightBlock.attach(prog)
+lightBlock.write('position', lightPos)
+lightBlock.write('ambient', [0.2, 0.2, 0.2])
+lightBlock.write('diffuse', [0.7, 0.7, 0.7])
+lightBlock.write('specular', lightCol)
 
 # material properties
-img1 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=2048))) # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
-tex1 = ctx.texture(img1.size, 3, img1.tobytes()) # 3 for RGB
-tex1.build_mipmaps()
-tex1.use(0) # bind texture to 0 texture unit
-img2 = Image.open(os.path.join(os.path.dirname(__file__), 'images', 'Brick_Spec.jpg'))
-tex2 = ctx.texture(img2.size, 3, img2.tobytes()) # 3 for RGB
-tex2.build_mipmaps()
-tex2.use(1) # bind texture to 1 texture unit
+textures = TextureManager(ctx, budget=64 * 1024 * 1024) # streamed in on worker threads, least recently used textures are released over budget
+tex1 = TextureLOD(textures, os.path.join(os.path.dirname(__file__), 'images', 'Brick_2048x2048.jpg'), mesh.bounds, cache=True, compress='bc1') # Brick_8x8 ... Brick_4096x4096, picked from the teapot's size on screen
+tex2 = textures.load(os.path.join(os.path.dirname(__file__), 'images', 'Brick_Spec.jpg'), cache=True)
 diff = Vector3([1.0, 0.5, 0.31])
 spec = Vector3([0.5, 0.5, 0.5])
 shine = 32.0
-prog['material.diffuse'].value = 0 # texture unit 0
-prog['material.specular'].value = 1 # texture unit 1
-prog['material.shininess'].value = shine
+uniforms.write('material.diffuse', 0) # texture unit 0
+uniforms.write('material.specular', 1) # texture unit 1
+uniforms.write('material.shininess', shine)
+
+frustum = Frustum(window.getViewProjectionMatrix()) # planes only change when the camera does
+culled = 0 # frames the teapot was outside the view
+
+# picking: a triangle BVH of the positions the vertex shader sees, in the index buffer's triangle order
+picker = Picker()
+teapot = picker.add(MeshBVH(MeshQuantizer.dequantize(mesh.vertices, mesh.bounds, 'vx vy vz nx ny nz tx ty', mesh.quantize)[:, :3], mesh.indices))
+
+def teapotModel():
+    return Math.buildTransMatrix(pos=[0, -1.0, -4.0], rot=[0, clock.time * 25, 0], scale=[0.01, 0.01, 0.01]) # slowly rotate the model
+
+@window.event
+def on_mouse_press(x, y, button, modifiers):
+    picker.setModel(teapot, teapotModel())
+    objectId, triangle, barycentrics, distance = picker.pick(window.width / 2, window.height / 2, window) # the mouse is captured, pick under the centre of the screen
+    if objectId < 0:
+        print('nothing picked ({:.2f} ms)'.format(picker.lastTime * 1000))
+    else:
+        print('object {} triangle {} at a distance of {:.2f}, barycentrics {} ({:.2f} ms)'.format(objectId, triangle, distance, np.round(barycentrics, 3), picker.lastTime * 1000))
 
 def updateMesh():
-    model = Math.buildTransMatrix(pos=[0, -1.0, -4.0], rot=[0, time.clock() * 25, 0], scale=[0.01, 0.01, 0.01]) # slowly rotate the model
-    prog['model'].write(model.astype('f4').tobytes())
-    mvp = window.getProjectionMatrix() * window.getViewMatrix() * model
-    prog['MVP'].write(mvp.astype('f4').tobytes())
-    camPos = window.getCameraPosition()
-    prog['viewPos'].write(camPos.astype('f4').tobytes())
+    global culled
+    model = teapotModel()
+    centre, radius = Frustum.transformSphere(mesh.sphere, model) # bounding sphere stored with the mesh cache
+    if not frustum.spheres(centre, radius)[0]:
+        culled += 1
+        return # no uniforms, texture selection or draw call when it is off screen
+    uniforms.write('model', model)
+    tex1.select(model, window.getViewMatrix(), window.getProjectionMatrix(), window.height)
+    tex1.use(0) # bind texture to 0 texture unit (Brick_256x256 until the selected one is resident)
+    tex2.use(1) # bind texture to 1 texture unit
     vao.render()
 
 def update(dt):
-    window.update()
-    ctx.clear(.1, .1, .1)
-    updateMesh()
+    window.update(clock) # camera moves in fixed steps
+    textures.update()
+    if window.viewChanged: # the camera moved or turned
+        cameraBlock.write('view', window.getViewMatrix())
+        cameraBlock.write('viewPos', window.getCameraPosition())
+        frustum.update(window.getViewProjectionMatrix())
+    cameraBlock.update()
+    lightBlock.update()
+    with profiler.span('clear'):
+        ctx.clear(.1, .1, .1)
+    with profiler.span('mesh'):
+        updateMesh()
+    profiler.endFrame()
 
-pg.clock.schedule_interval(update, 1.0 / 60.0)
-pg.app.run()
\ No newline at end of file
+clock.schedule(update, window=window)
+pg.app.run()
+cameraBlock.release()
+lightBlock.release()
+print('textures:', textures.stats())
+print('profile:', profiler.text())
+print('teapot culled in {} of {} frames'.format(culled, clock.frames))
+profiler.release()
+textures.release()
\ No newline at end of file
@@ -0,0 +1,190 @@
+'''
+Multiple lights: the teapot scene lit by hundreds of moving point and spot lights (clustered forward shading)
+run with --lights N for another number of lights (1000 by default)
+'''
+
+import os
+import sys
+import moderngl
+import numpy as np
+import pyglet as pg
+from Modules.ViewportFP import ViewportFP
+from Modules.MeshCache import MeshCache
+from Modules.MeshQuantizer import MeshQuantizer
+from Modules.UniformBlock import UniformBlock
+from Modules.TextureLoader import TextureLoader
+from Modules.RenderQueue import RenderQueue
+from Modules.ClusteredLights import ClusteredLights
+from Modules.Profiler import Profiler
+from Modules.functions import Math, Path
+from Modules.FrameClock import FrameClock
+
+lightCount = int(sys.argv[sys.argv.index('--lights') + 1]) if '--lights' in sys.argv else 1000
+
+window = ViewportFP(name='Multiple Lights')
+clock = FrameClock()
+ctx = moderngl.create_context()
+profiler = Profiler(ctx)
+window.profiler = profiler
+textures = TextureLoader(ctx) # images are decoded on worker threads and streamed in over the first frames
+queue = RenderQueue(ctx) # teapot and floor share the program and textures
+lights = ClusteredLights(ctx, near=0.1, far=1000.0, clusterFar=50.0) # same near/far as ViewportFP's projection
+
+vs = '''
+    # version 330 core
+
+    layout (std140) uniform Camera // see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
+    uniform mat4 model;
+    uniform vec3 quantOffset; // dequantization, see MeshQuantizer
+    uniform vec3 quantScale;
+    uniform float octScale;
+
+    layout (location = 0) in vec3 in_vert; // int16, relative to the mesh AABB
+    layout (location = 1) in vec2 in_norm; // octahedral encoded
+    layout (location = 2) in vec2 in_UVs; // half floats
+
+    out vec3 fragPos;
+    out vec3 fragNorm;
+    out vec2 texCoords;
+
+    vec3 octDecode(vec2 e)
+    {
+        vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+        float t = max(-n.z, 0.0);
+        n.xy += vec2(n.x >= 0.0 ? -t : t, n.y >= 0.0 ? -t : t);
+        return normalize(n);
+    }
+
+    void main()
+    {
+        vec3 position = quantOffset + in_vert * quantScale;
+        fragPos = vec3(model * vec4(position, 1.0));
+        fragNorm = mat3(transpose(inverse(model))) * octDecode(in_norm * octScale);
+        texCoords = in_UVs;
+        gl_Position = projection * view * model * vec4(position, 1.0);
+    }
+    '''
+
+fs = '''
+    # version 330 core
+    ''' + ClusteredLights.GLSL + '''
+    struct Material
+    {
+        sampler2D diffuse; // unit 0
+        sampler2D specular; // unit 1
+        float shininess;
+        vec2 tiling; // UV repeats
+    };
+
+    uniform Material material;
+    layout (std140) uniform Camera // see UniformBlock
+    {
+        mat4 projection;
+        mat4 view;
+        vec3 viewPos;
+    };
+
+    in vec3 fragPos;
+    in vec3 fragNorm;
+    in vec2 texCoords;
+    out vec4 fragColour;
+
+    void main()
+    {
+        vec3 diffuse = vec3(texture(material.diffuse, texCoords * material.tiling));
+        vec3 specular = vec3(texture(material.specular, texCoords * material.tiling));
+        vec3 norm = normalize(fragNorm);
+        vec3 viewDir = normalize(viewPos - fragPos);
+
+        // a dim ambient term, then only the lights of this fragment's cluster
+        vec3 result = 0.05 * diffuse + clusteredLighting(fragPos, norm, viewDir, diffuse, specular, material.shininess);
+        fragColour = vec4(result, 1.0);
+    }
+    '''
+
+prog = ctx.program(vertex_shader=vs, fragment_shader=fs)
+ctx.enable(moderngl.DEPTH_TEST)
+
+teapot = MeshCache.load(Path.local('models', 'teapot.obj'), 'vx vy vz nx ny nz tx ty', indexed=True, optimize=True, quantize='oct16') # as in 09
+teapotVao = ctx.vertex_array(prog, [(ctx.buffer(teapot.vertices), teapot.format(), 'in_vert', 'in_norm', 'in_UVs')],
+                             index_buffer=ctx.buffer(teapot.indices), index_element_size=teapot.indices.itemsize)
+floor, floorBounds = MeshQuantizer.quantize(np.array([
+    # positions          # normals        # texture coords
+    -15.0, 0.0, -15.0,   0.0, 1.0, 0.0,   0.0, 0.0,
+     15.0, 0.0, -15.0,   0.0, 1.0, 0.0,   1.0, 0.0,
+     15.0, 0.0,  15.0,   0.0, 1.0, 0.0,   1.0, 1.0,
+     15.0, 0.0,  15.0,   0.0, 1.0, 0.0,   1.0, 1.0,
+    -15.0, 0.0,  15.0,   0.0, 1.0, 0.0,   0.0, 1.0,
+    -15.0, 0.0, -15.0,   0.0, 1.0, 0.0,   0.0, 0.0,
+    ]))
+floorVao = ctx.vertex_array(prog, [(ctx.buffer(floor), MeshQuantizer.format(normals='oct16'), 'in_vert', 'in_norm', 'in_UVs')])
+
+# camera block, written when the view changes
+cameraBlock = UniformBlock(ctx, 'Camera', [('projection', 'mat4'), ('view', 'mat4'), ('viewPos', 'vec3')], binding=0)
+cameraBlock.attach(prog)
+cameraBlock.write('projection', window.getProjectionMatrix())
+
+# material properties: both meshes use the brick maps, they differ in dequantization and tiling
+tex1 = textures.load(os.path.join(os.path.dirname(__file__), 'images', 'Brick_{size}x{size}.jpg'.format(size=512)), cache=True) # texture sizes: 8,16,32,64,128,256,512,1024,2048,4096
+tex2 = textures.load(os.path.join(os.path.dirname(__file__), 'images', 'Brick_Spec.jpg'), cache=True)
+def material(bounds, tiling):
+    offset, scale = MeshQuantizer.dequantization(bounds)
+    return queue.material(prog, textures=[(0, tex1), (1, tex2)], uniforms={'material.diffuse': 0, 'material.specular': 1, 'material.shininess': 32.0,
+        'material.tiling': tiling, 'quantOffset': offset, 'quantScale': scale, 'octScale': 1.0 / MeshQuantizer.NORMALS['oct16'][1]})
+teapotMaterial = material(teapot.bounds, [1.0, 1.0])
+floorMaterial = material(floorBounds, [15.0, 15.0])
+teapotMesh = queue.mesh(teapotVao)
+floorMesh = queue.mesh(floorVao)
+
+# lights circle the teapot at different distances, heights and speeds; about a third are spot lights pointing down
+centre = np.array([0.0, -1.0, -4.0])
+np.random.seed(1)
+orbit = np.random.uniform(1.8, 12.0, lightCount)
+phase = np.random.uniform(0.0, 2 * np.pi, lightCount)
+speed = np.random.uniform(-0.6, 0.6, lightCount)
+height = np.random.uniform(0.1, 1.5, lightCount)
+colours = np.random.uniform(0.0, 1.0, (lightCount, 3)) ** 2 * 2.0 # saturated colours
+radii = np.random.uniform(0.6, 1.6, lightCount)
+spot = np.random.rand(lightCount) < 0.3
+angles = np.where(spot[:, None], [20.0, 40.0], [180.0, 180.0])
+directions = np.tile([0.0, -1.0, 0.0], (lightCount, 1))
+positions = np.empty((lightCount, 3))
+
+def moveLights():
+    angle = phase + speed * clock.time
+    positions[:, 0] = centre[0] + orbit * np.cos(angle)
+    positions[:, 1] = centre[1] + height
+    positions[:, 2] = centre[2] + orbit * np.sin(angle)
+    lights.set(positions, colours, radii, directions, angles)
+
+def update(dt):
+    window.update(clock) # camera moves in fixed steps
+    textures.update()
+    if window.viewChanged: # the camera moved or turned
+        cameraBlock.write('view', window.getViewMatrix())
+        cameraBlock.write('viewPos', window.getCameraPosition())
+    cameraBlock.update()
+    with profiler.span('lights'):
+        moveLights()
+        lights.update(window.getViewMatrix(), window.getProjectionMatrix(), (window.width, window.height))
+        lights.use(prog) # texture units 2-4
+    with profiler.span('clear'):
+        ctx.clear(.02, .02, .02)
+    with profiler.span('draw'):
+        queue.submit(teapotMesh, teapotMaterial, depth=4.0, uniforms={'model': Math.buildTransMatrix(pos=centre, scale=[0.01, 0.01, 0.01])})
+        queue.submit(floorMesh, floorMaterial, depth=0.0, uniforms={'model': Math.buildTransMatrix(pos=centre)})
+        queue.flush()
+    profiler.endFrame()
+
+clock.schedule(update, window=window)
+pg.app.run()
+print('lights: {} of {} in view, {} (light, cluster) pairs'.format(lights.visible, lightCount, lights.pairs))
+print('profile:', profiler.text())
+cameraBlock.release()
+lights.release()
+profiler.release()
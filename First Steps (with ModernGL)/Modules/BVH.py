@@ -0,0 +1,235 @@
+import os
+import sys
+import numpy as np
+if __name__ == '__main__': # python Modules/BVH.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.Frustum import Frustum
+
+class BVH():
+    '''
+    Bounding volume hierarchy over the AABBs of a static (or slowly moving) scene, as flat arrays:
+        bvh = BVH(mins, maxs) - (N, 3) object boxes, e.g. position -/+ half size
+        ids = bvh.cull(frustum) - object ids at least partly inside a Frustum
+        id, t = bvh.raycast(origin, direction) - nearest box hit, (-1, inf) for none
+        bvh.refit(ids, mins, maxs) - objects moved: new boxes, the ancestors' bounds follow
+    Objects are sorted along a Morton curve through their centres, then the sorted list is split in
+    halves down to leafSize objects (a median split, every node covers a contiguous range of order).
+    The tree is complete, stored heap style:
+        lower, upper - (M, 3) node bounds, node 0 is the root
+        child - (M,) first child, the second is child + 1, -1 for leaves
+        start, count - (M,) range of the node's objects in order (internal nodes too)
+        empty - (M,) nodes without objects (small trees), skipped by the traversals, their bounds mean nothing
+        order - (N,) object ids in leaf order
+    Traversals handle a whole tree level per step with NumPy. Refitting keeps the topology, rebuild when
+    objects have moved far from where they were built.
+    '''
+    def __init__(self, mins, maxs, leafSize=8):
+        self.mins = np.array(mins, dtype='f4').reshape(-1, 3)
+        self.maxs = np.array(maxs, dtype='f4').reshape(-1, 3)
+        self.leafSize = leafSize
+        count = len(self.mins)
+        leaves = 1 << max(int(np.ceil(np.log2(max(count / leafSize, 1)))), 0)
+        self.depth = leaves.bit_length() - 1 # levels below the root
+        self.firstLeaf = leaves - 1
+        nodes = 2 * leaves - 1
+        self.order = BVH.mortonOrder((self.mins + self.maxs) * 0.5)
+        self.leafOf = np.empty(count, dtype='i4') # object id -> leaf node
+
+        # leaf ranges split the sorted objects evenly, internal nodes cover both children's
+        self.start = np.zeros(nodes, dtype='i4')
+        self.count = np.zeros(nodes, dtype='i4')
+        bounds = (np.arange(leaves + 1, dtype='i8') * count // leaves).astype('i4')
+        self.start[self.firstLeaf:] = bounds[:-1]
+        self.count[self.firstLeaf:] = np.diff(bounds)
+        self.leafOf[self.order] = np.repeat(np.arange(self.firstLeaf, nodes, dtype='i4'), self.count[self.firstLeaf:])
+        for level in range(self.depth - 1, -1, -1):
+            nodesAt = np.arange((1 << level) - 1, (2 << level) - 1)
+            self.start[nodesAt] = self.start[2 * nodesAt + 1]
+            self.count[nodesAt] = self.count[2 * nodesAt + 1] + self.count[2 * nodesAt + 2]
+        self.empty = self.count == 0
+        self.child = np.where(np.arange(nodes) < self.firstLeaf, 2 * np.arange(nodes, dtype='i4') + 1, -1).astype('i4')
+
+        self.lower = np.empty((nodes, 3), dtype='f4')
+        self.upper = np.empty((nodes, 3), dtype='f4')
+        self.refit()
+
+    @staticmethod
+    def mortonOrder(centres):
+        '''Object ids sorted by the 30 bit Morton code of their centres'''
+        low, high = centres.min(axis=0), centres.max(axis=0)
+        cells = ((centres - low) / np.maximum(high - low, 1e-20) * 1023).astype('u4')
+        code = np.zeros(len(centres), dtype='u4')
+        for axis in range(3):
+            v = cells[:, axis]
+            v = (v | (v << 16)) & 0x030000FF # spread 10 bits to every third bit
+            v = (v | (v << 8)) & 0x0300F00F
+            v = (v | (v << 4)) & 0x030C30C3
+            v = (v | (v << 2)) & 0x09249249
+            code |= v << (2 - axis)
+        return np.argsort(code, kind='stable').astype('i4')
+
+    def refit(self, ids=None, mins=None, maxs=None):
+        '''Set new boxes for objects ids (all if None) and recompute the bounds of their leaves and ancestors'''
+        if ids is not None:
+            self.mins[ids] = mins
+            self.maxs[ids] = maxs
+            nodes = np.unique(self.leafOf[ids])
+        else:
+            nodes = np.arange(self.firstLeaf, len(self.child))
+        self._leafBounds(nodes)
+        while len(nodes) and nodes[0] > 0:
+            nodes = np.unique((nodes - 1) // 2)
+            left, right = 2 * nodes + 1, 2 * nodes + 2
+            left, right = np.where(self.empty[left], right, left), np.where(self.empty[right], left, right) # an empty child adds nothing
+            self.lower[nodes] = np.minimum(self.lower[left], self.lower[right])
+            self.upper[nodes] = np.maximum(self.upper[left], self.upper[right])
+
+    def _leafBounds(self, leaves):
+        counts = self.count[leaves]
+        full = leaves[counts > 0]
+        self.lower[leaves[counts == 0]] = 0.0 # a finite placeholder, see empty
+        self.upper[leaves[counts == 0]] = 0.0
+        if not len(full):
+            return
+        ids = self.order[BVH._ranges(self.start[full], self.count[full])]
+        offsets = np.concatenate([[0], np.cumsum(self.count[full])[:-1]])
+        self.lower[full] = np.minimum.reduceat(self.mins[ids], offsets)
+        self.upper[full] = np.maximum.reduceat(self.maxs[ids], offsets)
+
+    @staticmethod
+    def _ranges(starts, counts):
+        '''Concatenated np.arange(start, start + count) for every pair, without a Python loop'''
+        total = int(counts.sum())
+        offsets = np.cumsum(counts) - counts
+        return np.repeat(starts - offsets, counts) + np.arange(total, dtype=starts.dtype)
+
+    def cull(self, frustum):
+        '''Ids of the objects at least partly inside the frustum (the same set as testing every box)'''
+        accepted = []
+        frontier = np.zeros(1, dtype='i4')
+        self.tested = 0 # nodes and objects tested by the last cull()
+        for level in range(self.depth + 1): # a level at a time, the tree is complete so the frontier never mixes levels
+            self.tested += len(frontier)
+            visible, inside = frustum.classifyBoxes(Frustum.packBoxes(self.lower[frontier], self.upper[frontier]))
+            whole = frontier[inside]
+            accepted.append(self.order[BVH._ranges(self.start[whole], self.count[whole])])
+            crossing = frontier[visible & ~inside]
+            if not len(crossing) or level == self.depth:
+                break
+            frontier = np.concatenate([2 * crossing + 1, 2 * crossing + 2])
+            frontier = frontier[~self.empty[frontier]]
+        if len(crossing): # leaves crossing a plane: test their objects
+            ids = self.order[BVH._ranges(self.start[crossing], self.count[crossing])]
+            self.tested += len(ids)
+            accepted.append(ids[frustum.testBoxes(Frustum.packBoxes(self.mins[ids], self.maxs[ids]))])
+        return np.concatenate(accepted) if accepted else np.zeros(0, dtype='i4')
+
+    @staticmethod
+    def inverseDirection(direction):
+        '''1 / direction for slabs(), zero components are nudged to 1e-12 so rays along an axis need no special case'''
+        direction = np.asarray(direction, dtype='f4').reshape(3)
+        return 1.0 / np.where(np.abs(direction) < 1e-12, np.copysign(1e-12, direction), direction).astype('f4')
+
+    @staticmethod
+    def slabs(origin, inverse, lower, upper):
+        '''Entry and exit distances of a ray (origin, inverseDirection()) through (N, 3) boxes, a hit where entry <= exit'''
+        a = (lower - origin) * inverse
+        b = (upper - origin) * inverse
+        near, far = np.minimum(a, b), np.maximum(a, b)
+        entry = np.maximum(np.maximum(near[:, 0], near[:, 1]), np.maximum(near[:, 2], 0.0)) # columns, reductions over rows of 3 are slow
+        exit = np.minimum(np.minimum(far[:, 0], far[:, 1]), far[:, 2])
+        return entry, exit
+
+    def rayCandidates(self, origin, inverse, maxDistance=np.inf):
+        '''Ids of the objects in every leaf the ray (origin, inverseDirection()) passes through closer than maxDistance'''
+        frontier = np.zeros(1, dtype='i4')
+        for level in range(self.depth + 1):
+            entry, exit = BVH.slabs(origin, inverse, self.lower[frontier], self.upper[frontier])
+            frontier = frontier[(entry <= exit) & (entry <= maxDistance)]
+            if level < self.depth:
+                frontier = np.concatenate([2 * frontier + 1, 2 * frontier + 2])
+                frontier = frontier[~self.empty[frontier]]
+        return self.order[BVH._ranges(self.start[frontier], self.count[frontier])]
+
+    def raycast(self, origin, direction, maxDistance=np.inf):
+        '''(object id, distance along direction) of the nearest box the ray enters, (-1, inf) if none'''
+        origin = np.asarray(origin, dtype='f4').reshape(3)
+        inverse = BVH.inverseDirection(direction)
+        ids = self.rayCandidates(origin, inverse, maxDistance)
+        if not len(ids):
+            return -1, np.inf
+        entry, exit = BVH.slabs(origin, inverse, self.mins[ids], self.maxs[ids])
+        entry[(entry > exit) | (entry > maxDistance)] = np.inf
+        nearest = int(entry.argmin())
+        return (int(ids[nearest]), float(entry[nearest])) if np.isfinite(entry[nearest]) else (-1, np.inf)
+
+if __name__ == '__main__':
+    import time
+    from pyrr import Matrix44
+
+    count = 1000000
+    np.random.seed(0)
+    centres = np.random.uniform(-500, 500, (count, 3)).astype('f4')
+    sizes = np.random.uniform(0.2, 2.0, (count, 3)).astype('f4')
+    mins, maxs = centres - sizes / 2, centres + sizes / 2
+
+    start = time.perf_counter()
+    bvh = BVH(mins, maxs)
+    print('build: {} boxes in {:.0f} ms, {} nodes, depth {}'.format(count, (time.perf_counter() - start) * 1000, len(bvh.child), bvh.depth))
+
+    projection = Matrix44.perspective_projection(45.0, 16 / 9, 0.1, 300.0)
+    frustum = Frustum()
+    packed = Frustum.packBoxes(mins, maxs)
+    for target in ([1.0, 0.0, 0.0], [0.3, 0.2, -1.0], [0.0, -1.0, 0.01]):
+        frustum.update(projection * Matrix44.look_at([0.0, 0.0, 0.0], target, [0.0, 1.0, 0.0]))
+        start = time.perf_counter()
+        ids = bvh.cull(frustum)
+        hierarchical = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        brute = np.flatnonzero(frustum.testBoxes(packed))
+        flat = (time.perf_counter() - start) * 1000
+        print('cull towards {}: {} visible in {:.2f} ms ({} tests), every box {:.2f} ms, same set: {}'.format(
+            target, len(ids), hierarchical, bvh.tested, flat, np.array_equal(np.sort(ids), brute)))
+
+    origins = np.random.uniform(-400, 400, (200, 3)).astype('f4')
+    directions = np.random.normal(size=(200, 3)).astype('f4')
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    start = time.perf_counter()
+    hits = [bvh.raycast(o, d) for o, d in zip(origins, directions)]
+    rays = (time.perf_counter() - start) * 1000 / len(origins)
+    start = time.perf_counter()
+    agree = 0
+    for (o, d), (id, t) in zip(zip(origins[:20], directions[:20]), hits[:20]):
+        entry, exit = BVH.slabs(o, BVH.inverseDirection(d), mins, maxs)
+        entry[entry > exit] = np.inf
+        agree += id == int(entry.argmin()) or entry.min() == t
+    brute = (time.perf_counter() - start) * 1000 / 20
+    print('raycast: {:.2f} ms per ray, every box {:.1f} ms per ray, nearest hit agrees for {} of 20'.format(rays, brute, agree))
+
+    moved = np.random.choice(count, count // 100, replace=False)
+    offset = np.random.uniform(-1, 1, (len(moved), 3)).astype('f4')
+    start = time.perf_counter()
+    bvh.refit(moved, mins[moved] + offset, maxs[moved] + offset)
+    partial = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    bvh.refit()
+    full = (time.perf_counter() - start) * 1000
+    frustum.update(projection * Matrix44.look_at([0.0, 0.0, 0.0], [0.3, 0.2, -1.0], [0.0, 1.0, 0.0]))
+    print('refit: 1% moved {:.0f} ms, everything {:.0f} ms, cull still exact: {}'.format(partial, full,
+        np.array_equal(np.sort(bvh.cull(frustum)), np.flatnonzero(frustum.testBoxes(Frustum.packBoxes(bvh.mins, bvh.maxs))))))
+
+    # fewer objects than leaves: the empty leaves must never reach a test (inf - inf warned and gave NaN)
+    centres = np.random.uniform((-60, -40, -150), (60, 40, -5), (1000, 3)).astype('f4') # in and around the view
+    mins, maxs = centres - 20, centres + 20 # large, most cross a plane
+    frustum.update(projection * Matrix44.look_at([0.0, 0.0, 0.0], [0.0, 0.0, -1.0], [0.0, 1.0, 0.0]))
+    with np.errstate(all='raise'):
+        small = BVH(mins, maxs, leafSize=1)
+        exact = np.array_equal(np.sort(small.cull(frustum)), np.flatnonzero(frustum.testBoxes(Frustum.packBoxes(mins, maxs))))
+        agree = 0
+        for target in centres[:20]:
+            d = target / np.linalg.norm(target)
+            entry, exit = BVH.slabs(np.zeros(3, dtype='f4'), BVH.inverseDirection(d), mins, maxs)
+            entry[entry > exit] = np.inf
+            agree += small.raycast([0.0, 0.0, 0.0], d)[1] == entry.min()
+    print('{} empty leaves of {}: cull exact {}, nearest hit agrees for {} of 20'.format(
+        int(small.empty[small.firstLeaf:].sum()), len(small.child) - small.firstLeaf, exact, agree))
\ No newline at end of file
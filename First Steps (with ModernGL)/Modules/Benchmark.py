@@ -0,0 +1,202 @@
+import io
+import os
+import sys
+import json
+import glob
+import time
+import random
+import platform
+import contextlib
+import numpy as np
+import moderngl
+if __name__ == '__main__': # python Modules/Benchmark.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.Headless import Headless
+
+class Benchmark(Headless):
+    '''
+    Deterministic offscreen benchmark of a demo script: it runs headless (see Headless) for a fixed number of
+    frames on a virtual clock with seeded random numbers, and the CPU time of every frame is split into phases:
+        uniform - Uniform.value / Uniform.write and writes to buffers bound as uniform blocks
+        draw - ctx.clear() and VertexArray.render()
+        update - the rest of update(dt): pyrr maths, Python logic, texture uploads
+        cpu - the whole frame (update + uniform + draw)
+        gpu - ctx.finish() after the frame, the wait for the GPU (not part of cpu)
+    allocations counts the moderngl objects created per frame. The warmup frames are left out of the statistics.
+        results = Benchmark.measure(script, frames=300)
+        regressions = Benchmark.compare(results, baseline)
+    '''
+    PHASES = ('update', 'uniform', 'draw', 'cpu', 'gpu')
+    ALLOCATORS = ('buffer', 'texture', 'texture_array', 'texture3d', 'texture_cube', 'depth_texture', 'vertex_array',
+                  'program', 'framebuffer', 'renderbuffer', 'depth_renderbuffer', 'query', 'sampler', 'scope')
+
+    def __init__(self, frames=300, warmup=10, dt=1 / 60, size=None, backend=None):
+        super().__init__(frames + warmup, dt, size, backend, capture=False)
+        self.warmup = warmup
+        self.samples = [] # per frame: update, uniform, draw, cpu, gpu (seconds), allocations
+        self.inFrame = False
+        self.depth = 0 # nested instrumented calls are only timed once
+        self.phase = {}
+        self.allocations = 0
+        self.uniformBuffers = set()
+
+    @staticmethod
+    def measure(script, frames=300, warmup=10, dt=1 / 60, size=None, seed=0):
+        '''Benchmark one demo, returns a dict of statistics (milliseconds), see summary()'''
+        np.random.seed(seed)
+        random.seed(seed)
+        benchmark = Benchmark(frames, warmup, dt, size)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()): # the demos' own per-frame prints
+                benchmark.execute(script)
+            return benchmark.summary()
+        finally:
+            benchmark.ctx.release()
+
+    def execute(self, script):
+        saved = []
+        def patch(owner, name, value):
+            saved.append((owner, name, owner.__dict__[name]))
+            setattr(owner, name, value)
+
+        uniformValue = moderngl.Uniform.value
+        patch(moderngl.Uniform, 'value', property(uniformValue.fget, Benchmark._timed('uniform', uniformValue.fset)))
+        patch(moderngl.Uniform, 'write', Benchmark._timed('uniform', moderngl.Uniform.write))
+        patch(moderngl.Buffer, 'write', Benchmark._bufferWrite(moderngl.Buffer.write))
+        patch(moderngl.Buffer, 'bind_to_uniform_block', Benchmark._uniformBinding(moderngl.Buffer.bind_to_uniform_block))
+        patch(moderngl.Context, 'clear', Benchmark._timed('draw', moderngl.Context.clear))
+        patch(moderngl.VertexArray, 'render', Benchmark._timed('draw', moderngl.VertexArray.render))
+        patch(moderngl.VertexArray, 'render_indirect', Benchmark._timed('draw', moderngl.VertexArray.render_indirect))
+        for name in Benchmark.ALLOCATORS:
+            patch(moderngl.Context, name, Benchmark._counted(getattr(moderngl.Context, name)))
+        try:
+            super().execute(script)
+        finally:
+            for owner, name, value in reversed(saved):
+                setattr(owner, name, value)
+
+    def step(self):
+        self.phase = {'uniform': 0.0, 'draw': 0.0}
+        self.allocations = 0
+        self.inFrame = True
+        start = time.perf_counter()
+        super().step()
+        cpu = time.perf_counter() - start
+        self.inFrame = False
+        start = time.perf_counter()
+        self.ctx.finish()
+        gpu = time.perf_counter() - start
+        uniform, draw = self.phase['uniform'], self.phase['draw']
+        self.samples.append((cpu - uniform - draw, uniform, draw, cpu, gpu, self.allocations))
+
+    def summary(self):
+        samples = np.array(self.samples[self.warmup:], dtype='f8')
+        results = {'frames': len(samples), 'warmup': self.warmup, 'size': list(self.size)}
+        for i, phase in enumerate(Benchmark.PHASES):
+            ms = samples[:, i] * 1000
+            results[phase] = {'min': ms.min(), 'median': float(np.median(ms)), 'p99': float(np.percentile(ms, 99)), 'mean': ms.mean()}
+        results['fps'] = 1000 / (results['cpu']['mean'] + results['gpu']['mean'])
+        results['allocationsPerFrame'] = samples[:, 5].mean()
+        results['warmupAllocations'] = int(sum(sample[5] for sample in self.samples[:self.warmup]))
+        return json.loads(json.dumps(results, default=float)) # plain floats for the JSON file
+
+    @staticmethod
+    def compare(results, baseline, tolerance=0.15):
+        '''
+        Regressions of results against baseline ({demo: summary()} both):
+        median or p99 CPU time more than tolerance slower, or more allocations per frame
+        '''
+        regressions = []
+        for demo, result in results.items():
+            base = baseline.get(demo)
+            if base is None:
+                continue
+            for statistic in ('median', 'p99'):
+                now, before = result['cpu'][statistic], base['cpu'][statistic]
+                if now > before * (1 + tolerance):
+                    regressions.append('{}: cpu {} {:.2f} ms, baseline {:.2f} ms (+{:.0%})'.format(demo, statistic, now, before, now / before - 1))
+            if result['allocationsPerFrame'] > base['allocationsPerFrame'] + 0.01:
+                regressions.append('{}: {:.2f} allocations per frame, baseline {:.2f}'.format(demo, result['allocationsPerFrame'], base['allocationsPerFrame']))
+        return regressions
+
+    @staticmethod
+    def environment(ctx=None):
+        ctx = ctx or Headless.standaloneContext()
+        return {'renderer': ctx.info['GL_RENDERER'], 'version': ctx.info['GL_VERSION'], 'python': platform.python_version(),
+                'moderngl': moderngl.__version__, 'numpy': np.__version__, 'machine': platform.machine()}
+
+    @staticmethod
+    def _timed(phase, function):
+        def timed(*args, **kwargs):
+            benchmark = Headless.active
+            if benchmark is None or not benchmark.inFrame or benchmark.depth:
+                return function(*args, **kwargs)
+            benchmark.depth += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                benchmark.phase[phase] += time.perf_counter() - start
+                benchmark.depth -= 1
+        return timed
+
+    @staticmethod
+    def _bufferWrite(function):
+        uniform = Benchmark._timed('uniform', function)
+        def write(buffer, *args, **kwargs):
+            benchmark = Headless.active
+            if benchmark is not None and buffer.glo in benchmark.uniformBuffers:
+                return uniform(buffer, *args, **kwargs)
+            return function(buffer, *args, **kwargs)
+        return write
+
+    @staticmethod
+    def _uniformBinding(function):
+        def bind(buffer, *args, **kwargs):
+            if Headless.active is not None:
+                Headless.active.uniformBuffers.add(buffer.glo)
+            return function(buffer, *args, **kwargs)
+        return bind
+
+    @staticmethod
+    def _counted(function):
+        def allocate(*args, **kwargs):
+            benchmark = Headless.active
+            if benchmark is not None and benchmark.inFrame:
+                benchmark.allocations += 1
+            return function(*args, **kwargs)
+        return allocate
+
+if __name__ == '__main__':
+    import argparse
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Benchmark the demos offscreen, optionally against a stored baseline')
+    parser.add_argument('scripts', nargs='*', help='demo scripts, all demos by default')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with, exits with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    scripts = args.scripts or sorted(glob.glob(os.path.join(root, '[0-9][0-9]_*.py')))
+    results = {}
+    print('{:<40} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+        'demo', 'update', 'uniform', 'draw', 'cpu min', 'cpu med', 'cpu p99', 'fps', 'allocs'))
+    for script in scripts:
+        demo = os.path.splitext(os.path.basename(script))[0]
+        result = results[demo] = Benchmark.measure(script, args.frames, args.warmup)
+        print('{:<40} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.0f} {:>7.2f}'.format(
+            demo[:40], result['update']['median'], result['uniform']['median'], result['draw']['median'],
+            result['cpu']['min'], result['cpu']['median'], result['cpu']['p99'], result['fps'], result['allocationsPerFrame']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'environment': Benchmark.environment(), 'frames': args.frames, 'demos': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = Benchmark.compare(results, baseline['demos'], args.tolerance)
+        print('\n'.join(regressions) if regressions else 'no regressions against {}'.format(args.baseline))
+        sys.exit(1 if regressions else 0)
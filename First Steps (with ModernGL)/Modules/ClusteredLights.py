@@ -0,0 +1,331 @@
+import os
+import sys
+import numpy as np
+import moderngl
+if __name__ == '__main__': # python Modules/ClusteredLights.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class ClusteredLights():
+    '''
+    Hundreds of point and spot lights in a forward renderer, each fragment only shading the lights of its cluster:
+        lights = ClusteredLights(ctx) - grid of 16 x 9 screen tiles by 24 depth slices
+        lights.set(positions, colours, radii, directions, angles) - world space (N, 3) arrays, (N,) radii,
+                                                                    spot lights where angles (N, 2) inner/outer degrees
+        lights.update(view, projection, viewport) - once per frame: assigns lights to clusters, uploads the lists
+        lights.use(prog, unit=2) - binds the textures to units unit..unit + 2 and writes the uniforms below
+    The fragment shader pastes ClusteredLights.GLSL after its #version line and adds
+        clusteredLighting(fragPos, normal, viewDir, diffuseColour, specularColour, shininess)
+    to its ambient term. Depth slices are exponential between near and clusterFar (the last one runs on to the far
+    plane), so clusters stay roughly cube shaped. Assignment runs on the CPU with NumPy: every light's view space
+    bounding box gives a block of clusters, each (light, cluster) pair of the block is then kept only if the sphere
+    touches the cluster's box. A light's influence ends at its radius (windowed inverse square falloff), so the
+    culling is exact: the result is the same as shading every light, see the self-check.
+    Light data, the per cluster (offset, count) grid and the light index lists live in float / uint textures read
+    with texelFetch, which GLSL 3.30 has (SSBOs would need GL 4.3).
+    '''
+    INDEX_WIDTH = 4096 # texels per row of the index list texture
+    GLSL = '''
+    uniform sampler2D lightData; // per light (row): position, radius | colour, cos outer | direction, cos inner
+    uniform usampler2D lightGrid; // per cluster: offset, count into lightIndices
+    uniform usampler2D lightIndices;
+    uniform ivec3 clusterGrid; // tiles x, tiles y, depth slices
+    uniform vec2 clusterTile; // tile size in pixels
+    uniform vec3 clusterDepth; // projection near, far, slices / log(clusterFar / near)
+
+    vec3 lightContribution(int light, vec3 fragPos, vec3 norm, vec3 viewDir, vec3 diffuseColour, vec3 specularColour, float shininess)
+    {
+        vec4 positionRadius = texelFetch(lightData, ivec2(0, light), 0);
+        vec4 colourOuter = texelFetch(lightData, ivec2(1, light), 0);
+        vec4 directionInner = texelFetch(lightData, ivec2(2, light), 0);
+        vec3 toLight = positionRadius.xyz - fragPos;
+        float distance = length(toLight);
+        vec3 lightDir = toLight / max(distance, 1e-6);
+        float fade = clamp(1.0 - pow(distance / positionRadius.w, 4.0), 0.0, 1.0); // 0 from the radius on
+        float attenuation = fade * fade / (1.0 + distance * distance);
+        float spot = clamp((dot(-lightDir, directionInner.xyz) - colourOuter.w) / max(directionInner.w - colourOuter.w, 1e-4), 0.0, 1.0);
+        float diff = max(dot(norm, lightDir), 0.0);
+        float spec = pow(max(dot(viewDir, reflect(-lightDir, norm)), 0.0), shininess);
+        return colourOuter.rgb * (diff * diffuseColour + spec * specularColour) * (attenuation * spot);
+    }
+
+    vec3 clusteredLighting(vec3 fragPos, vec3 norm, vec3 viewDir, vec3 diffuseColour, vec3 specularColour, float shininess)
+    {
+        ivec2 tile = min(ivec2(gl_FragCoord.xy / clusterTile), clusterGrid.xy - 1);
+        float ndcZ = gl_FragCoord.z * 2.0 - 1.0;
+        float depth = 2.0 * clusterDepth.x * clusterDepth.y / (clusterDepth.y + clusterDepth.x - ndcZ * (clusterDepth.y - clusterDepth.x));
+        int slice = clamp(int(log(depth / clusterDepth.x) * clusterDepth.z), 0, clusterGrid.z - 1);
+        uvec2 range = texelFetch(lightGrid, ivec2(tile.y * clusterGrid.x + tile.x, slice), 0).xy;
+        vec3 result = vec3(0.0);
+        for (int i = int(range.x); i < int(range.x + range.y); i++)
+        {
+            int light = int(texelFetch(lightIndices, ivec2(i %% %d, i / %d), 0).r);
+            result += lightContribution(light, fragPos, norm, viewDir, diffuseColour, specularColour, shininess);
+        }
+        return result;
+    }
+    ''' % (INDEX_WIDTH, INDEX_WIDTH)
+
+    def __init__(self, ctx, grid=(16, 9, 24), near=0.1, far=1000.0, clusterFar=100.0, capacity=1024):
+        self.ctx = ctx
+        self.grid = grid
+        self.near = near
+        self.far = far
+        self.clusterFar = clusterFar
+        self.sliceScale = grid[2] / np.log(clusterFar / near)
+        self.count = 0
+        self.data = np.zeros((0, 3, 4), dtype='f4') # per light: position radius, colour cos outer, direction cos inner
+        self.dataTexture = None
+        self.dataDirty = False
+        self.grid2D = np.zeros((grid[2], grid[0] * grid[1], 2), dtype='u4') # rows are slices
+        self.gridTexture = ctx.texture((grid[0] * grid[1], grid[2]), 2, dtype='u4')
+        self.gridTexture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+        self.indexTexture = None
+        self.indexRows = 0
+        self.indexUpload = np.zeros(0, dtype='u4')
+        self.tile = (1.0, 1.0) # pixels per tile, from the viewport given to update()
+        self._allocateData(capacity)
+        self._allocateIndices(1)
+        self.boxes = None # per cluster view space AABBs, for the projection in boxesFor
+        self.boxesFor = None
+        self.pairs = 0 # (light, cluster) pairs of the last update
+        self.visible = 0 # lights touching at least one cluster
+
+    def _allocateData(self, capacity):
+        if self.dataTexture is not None:
+            self.dataTexture.release()
+        self.dataTexture = self.ctx.texture((3, capacity), 4, dtype='f4')
+        self.dataTexture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+        self.dataCapacity = capacity
+        self.dataDirty = True
+
+    def _allocateIndices(self, rows):
+        if self.indexTexture is not None:
+            self.indexTexture.release()
+        self.indexTexture = self.ctx.texture((ClusteredLights.INDEX_WIDTH, rows), 1, dtype='u4')
+        self.indexTexture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+        self.indexUpload = np.zeros(rows * ClusteredLights.INDEX_WIDTH, dtype='u4')
+        self.indexRows = rows
+
+    def set(self, positions, colours, radii, directions=None, angles=None):
+        '''Replace the lights, call again whenever they move or change'''
+        positions = np.asarray(positions, dtype='f4').reshape(-1, 3)
+        count = len(positions)
+        data = np.zeros((count, 3, 4), dtype='f4')
+        data[:, 0, :3] = positions
+        data[:, 0, 3] = radii
+        data[:, 1, :3] = np.asarray(colours, dtype='f4').reshape(-1, 3)
+        data[:, 1, 3] = -2.0 # point lights: every direction is inside the cone
+        data[:, 2, 3] = -1.0
+        if angles is not None:
+            angles = np.radians(np.asarray(angles, dtype='f4').reshape(-1, 2))
+            direction = np.asarray(directions, dtype='f4').reshape(-1, 3)
+            data[:, 2, :3] = direction / np.linalg.norm(direction, axis=1)[:, None]
+            data[:, 1, 3] = np.cos(angles[:, 1]) # outer
+            data[:, 2, 3] = np.cos(angles[:, 0]) # inner
+        self.data = data
+        self.count = count
+        if count > self.dataCapacity:
+            self._allocateData(1 << int(np.ceil(np.log2(count))))
+        self.dataDirty = True
+
+    def clusterBoxes(self, projection):
+        '''(X * Y * Z, 2, 3) view space AABBs of the clusters, cluster id = (slice * Y + tile y) * X + tile x'''
+        projection = np.asarray(projection, dtype='f8')
+        if self.boxesFor is not None and np.array_equal(self.boxesFor, projection):
+            return self.boxes
+        X, Y, Z = self.grid
+        depths = self.near * (self.clusterFar / self.near) ** (np.arange(Z + 1) / Z)
+        depths[-1] = self.far # the last slice runs on to the far plane
+        sx, sy = projection[0, 0], projection[1, 1]
+        ndcX, ndcY = np.linspace(-1, 1, X + 1), np.linspace(-1, 1, Y + 1)
+        z, y, x = np.meshgrid(np.arange(Z), np.arange(Y), np.arange(X), indexing='ij')
+        d0, d1 = depths[z], depths[z + 1]
+        boxes = np.empty((Z, Y, X, 2, 3), dtype='f4')
+        for axis, ndc, scale, index in ((0, ndcX, sx, x), (1, ndcY, sy, y)): # view x = ndc * depth / scale, widest at d1
+            low, high = ndc[index], ndc[index + 1]
+            boxes[..., 0, axis] = np.minimum(low * d0, low * d1) / scale
+            boxes[..., 1, axis] = np.maximum(high * d0, high * d1) / scale
+        boxes[..., 0, 2], boxes[..., 1, 2] = -d1, -d0
+        self.boxes = boxes.reshape(-1, 2, 3)
+        self.boxesFor = projection
+        return self.boxes
+
+    def assign(self, view, projection):
+        '''(offsets, counts) per cluster and the concatenated light index lists, for pyrr row-major matrices'''
+        X, Y, Z = self.grid
+        projection = np.asarray(projection, dtype='f8')
+        boxes = self.clusterBoxes(projection)
+        centres = np.hstack([self.data[:, 0, :3], np.ones((self.count, 1), dtype='f4')]) @ np.asarray(view, dtype='f4')
+        radii = self.data[:, 0, 3]
+        depth = -centres[:, 2]
+        nearest, farthest = np.maximum(depth - radii, self.near), depth + radii
+
+        # block of clusters covered by the view space AABB of each sphere
+        sx, sy = projection[0, 0], projection[1, 1]
+        inView = (farthest > self.near) & (depth - radii < self.far)
+        tiles = []
+        for axis, scale, count in ((0, sx, X), (1, sy, Y)):
+            low, high = centres[:, axis] - radii, centres[:, axis] + radii
+            ndcLow = np.minimum(low / nearest, low / farthest) * scale # x / depth is extreme at one end of the depth range
+            ndcHigh = np.maximum(high / nearest, high / farthest) * scale
+            inView &= (ndcHigh >= -1) & (ndcLow <= 1)
+            tiles.append(np.clip(np.floor((ndcLow + 1) / 2 * count), 0, count - 1).astype('i4'))
+            tiles.append(np.clip(np.floor((ndcHigh + 1) / 2 * count), 0, count - 1).astype('i4'))
+        tiles.append(np.clip(np.floor(np.log(nearest / self.near) * self.sliceScale), 0, Z - 1).astype('i4'))
+        tiles.append(np.clip(np.floor(np.log(np.maximum(farthest, self.near) / self.near) * self.sliceScale), 0, Z - 1).astype('i4'))
+        ids = np.flatnonzero(inView).astype('i4')
+        x0, x1, y0, y1, z0, z1 = (first[ids] for first in tiles)
+        nx, ny, nz = x1 - x0 + 1, y1 - y0 + 1, z1 - z0 + 1
+        counts = nx * ny * nz
+
+        # every (light, cluster) pair of the blocks, kept where the sphere touches the cluster's box
+        light = np.repeat(np.arange(len(ids)), counts)
+        local = np.arange(int(counts.sum()), dtype='i4') - np.repeat(np.cumsum(counts) - counts, counts)
+        nxPairs, nyPairs = nx[light], ny[light]
+        cluster = ((z0[light] + local // (nxPairs * nyPairs)) * Y + y0[light] + (local // nxPairs) % nyPairs) * X + x0[light] + local % nxPairs
+        box = boxes[cluster]
+        centre = centres[ids[light], :3]
+        offset = centre - np.clip(centre, box[:, 0], box[:, 1])
+        keep = (offset * offset).sum(axis=1) <= radii[ids[light]] ** 2
+        cluster, light = cluster[keep], ids[light[keep]]
+
+        order = np.argsort(cluster, kind='stable')
+        perCluster = np.bincount(cluster, minlength=X * Y * Z)
+        self.pairs = len(cluster)
+        self.visible = len(np.unique(light)) if len(light) else 0
+        return np.cumsum(perCluster) - perCluster, perCluster, light[order].astype('u4')
+
+    def update(self, view, projection, viewport):
+        '''Assign the lights to the clusters of this view and upload everything that changed, viewport: (width, height)'''
+        if self.dataDirty:
+            upload = np.zeros((self.dataCapacity, 3, 4), dtype='f4')
+            upload[:self.count] = self.data
+            self.dataTexture.write(upload)
+            self.dataDirty = False
+        offsets, counts, indices = self.assign(view, projection)
+        X, Y, Z = self.grid
+        self.grid2D[..., 0] = offsets.reshape(Z, X * Y)
+        self.grid2D[..., 1] = counts.reshape(Z, X * Y)
+        self.gridTexture.write(self.grid2D)
+        rows = max(1, -(-len(indices) // ClusteredLights.INDEX_WIDTH))
+        if rows > self.indexRows:
+            self._allocateIndices(1 << int(np.ceil(np.log2(rows))))
+        self.indexUpload[:len(indices)] = indices
+        self.indexTexture.write(self.indexUpload[:rows * ClusteredLights.INDEX_WIDTH], viewport=(0, 0, ClusteredLights.INDEX_WIDTH, rows))
+        self.tile = (viewport[0] / X, viewport[1] / Y)
+
+    def use(self, prog, unit=2):
+        '''Bind the light textures to units unit, unit + 1 and unit + 2 and set the cluster uniforms of prog'''
+        for offset, (name, texture) in enumerate((('lightData', self.dataTexture), ('lightGrid', self.gridTexture), ('lightIndices', self.indexTexture))):
+            texture.use(unit + offset)
+            if name in prog:
+                prog[name].value = unit + offset
+        for name, value in (('clusterGrid', tuple(self.grid)), ('clusterTile', self.tile), ('clusterDepth', (self.near, self.far, self.sliceScale))):
+            if name in prog: # unused uniforms are optimised out
+                prog[name].value = value
+
+    def release(self):
+        for texture in (self.dataTexture, self.gridTexture, self.indexTexture):
+            texture.release()
+
+if __name__ == '__main__':
+    import time
+    from pyrr import Matrix44
+    from Modules.Headless import Headless
+
+    width, height = 320, 180
+    projection = Matrix44.perspective_projection(45.0, width / height, 0.1, 1000.0)
+    view = Matrix44.look_at([0.0, 2.0, 6.0], [0.0, 0.0, -4.0], [0.0, 1.0, 0.0])
+    ctx = Headless.standaloneContext()
+    lights = ClusteredLights(ctx)
+
+    # every light whose sphere holds a point must be listed in the point's cluster, found as the shader finds it
+    np.random.seed(0)
+    count = 1000
+    positions = np.random.uniform([-8, -1, -14], [8, 3, 2], (count, 3))
+    lights.set(positions, np.random.uniform(0.2, 1.0, (count, 3)), np.random.uniform(0.5, 2.5, count))
+    offsets, counts, indices = lights.assign(view, projection)
+    points = np.random.uniform([-8, -1, -14], [8, 3, 2], (20000, 3))
+    clip = np.hstack([points, np.ones((len(points), 1))]) @ np.asarray(projection * view, dtype='f8')
+    onScreen = (np.abs(clip[:, :3]) < clip[:, 3:]).all(axis=1)
+    points, clip = points[onScreen], clip[onScreen]
+    ndc = clip[:, :3] / clip[:, 3:]
+    depth = clip[:, 3]
+    X, Y, Z = lights.grid
+    tile = np.minimum(((ndc[:, :2] + 1) / 2 * [X, Y]).astype(int), [X - 1, Y - 1])
+    slices = np.clip(np.floor(np.log(depth / lights.near) * lights.sliceScale), 0, Z - 1).astype(int)
+    clusters = (slices * Y + tile[:, 1]) * X + tile[:, 0]
+    missing = 0
+    for point, cluster in zip(points, clusters):
+        touching = np.flatnonzero(((positions - point) ** 2).sum(axis=1) <= lights.data[:, 0, 3] ** 2)
+        missing += len(np.setdiff1d(touching, indices[offsets[cluster]:offsets[cluster] + counts[cluster]]))
+    print('{} points in view: {} lights missing from their clusters, {} (light, cluster) pairs, {:.1f} lights per cluster in use'.format(
+        len(points), missing, lights.pairs, counts[counts > 0].mean()))
+
+    for count in (100, 1000, 10000):
+        lights.set(np.random.uniform([-20, -1, -40], [20, 5, 2], (count, 3)), np.random.uniform(0.2, 1.0, (count, 3)), np.random.uniform(0.5, 2.5, count))
+        lights.update(view, projection, (width, height))
+        start = time.perf_counter()
+        for _ in range(10):
+            lights.update(view, projection, (width, height))
+        print('{:>6} lights: assignment and upload {:.2f} ms, {} visible, {} pairs'.format(count, (time.perf_counter() - start) * 100, lights.visible, lights.pairs))
+
+    # shading only the cluster's lights gives the same image as shading every light
+    fbo = ctx.simple_framebuffer((width, height))
+    fbo.use()
+    ctx.enable(moderngl.DEPTH_TEST)
+    shaders = {}
+    for name, loop in (('clustered', 'clusteredLighting(fragPos, norm, viewDir, vec3(0.8), vec3(0.3), 16.0)'),
+                       ('every light', 'everyLight(fragPos, norm, viewDir)')):
+        shaders[name] = ctx.program(vertex_shader='''
+            # version 330 core
+            uniform mat4 viewProjection;
+            in vec3 in_vert;
+            out vec3 fragPos;
+            void main() { fragPos = in_vert; gl_Position = viewProjection * vec4(in_vert, 1.0); }
+            ''', fragment_shader='''
+            # version 330 core
+            ''' + ClusteredLights.GLSL + '''
+            uniform int lightCount;
+            uniform vec3 viewPos;
+            in vec3 fragPos;
+            out vec4 fragColour;
+            vec3 everyLight(vec3 fragPos, vec3 norm, vec3 viewDir)
+            {
+                vec3 result = vec3(0.0);
+                for (int i = 0; i < lightCount; i++)
+                    result += lightContribution(i, fragPos, norm, viewDir, vec3(0.8), vec3(0.3), 16.0);
+                return result;
+            }
+            void main()
+            {
+                vec3 norm = vec3(0.0, 1.0, 0.0);
+                vec3 viewDir = normalize(viewPos - fragPos);
+                fragColour = vec4(0.05 + %s, 1.0);
+            }
+            ''' % loop)
+    floor = ctx.buffer(np.array([[-20, -1, -40], [20, -1, -40], [-20, -1, 4], [20, -1, 4]], dtype='f4'))
+    count = 1000
+    angles = np.column_stack([np.full(count, 20.0), np.full(count, 35.0)])
+    spot = np.random.rand(count) < 0.3 # spot lights point down, the rest shine every way
+    angles[~spot] = 180.0
+    lights.set(np.random.uniform([-20, -0.5, -40], [20, 2, 2], (count, 3)), np.random.uniform(0.2, 1.0, (count, 3)) * 4,
+               np.random.uniform(1.0, 4.0, count), np.tile([0.0, -1.0, 0.0], (count, 1)), angles)
+    lights.update(view, projection, (width, height))
+    images = {}
+    for name, prog in shaders.items():
+        prog['viewProjection'].write((projection * view).astype('f4'))
+        prog['viewPos'].value = (0.0, 2.0, 6.0)
+        if 'lightCount' in prog:
+            prog['lightCount'].value = count
+        lights.use(prog)
+        vao = ctx.vertex_array(prog, [(floor, '3f', 'in_vert')])
+        ctx.clear()
+        ctx.finish()
+        start = time.perf_counter()
+        vao.render(moderngl.TRIANGLE_STRIP)
+        ctx.finish()
+        images[name] = np.frombuffer(fbo.read(), dtype='u1').astype(int)
+        print('{:<12} floor with {} lights drawn in {:.1f} ms, mean brightness {:.1f}'.format(name, count, (time.perf_counter() - start) * 1000, images[name].mean()))
+    print('same image: {} (max difference {})'.format(np.abs(images['clustered'] - images['every light']).max() <= 1,
+                                                      np.abs(images['clustered'] - images['every light']).max()))
@@ -0,0 +1,92 @@
+import sys
+import time
+
+class FrameClock():
+    '''
+    Monotonic frame timing with a fixed simulation step:
+        clock = FrameClock(step=1 / 60)
+        clock.schedule(update) - instead of pyglet.clock.schedule_interval(update, 1 / 60), ticks before each update(dt)
+        clock.steps - fixed steps due this frame, run the simulation (e.g. ViewportFP.update(clock)) that many times
+        clock.alpha - how far between the last two steps the frame is, to interpolate what is drawn
+        clock.time - seconds of simulated time at that point, for animations (replaces time.clock())
+    Real time comes from perf_counter() (FrameClock.timer, Headless swaps in its virtual clock), so the simulation
+    advances at the same speed whatever the frame rate. Long frames are capped at maxSteps steps, the simulation
+    slows down instead of spiralling. Run a demo with --unlocked (or schedule(update, fps=None)) to render as
+    fast as possible, without vsync, e.g. for throughput tests.
+    '''
+    timer = time.perf_counter
+    UNLOCKED = '--unlocked' in sys.argv
+
+    def __init__(self, step=1 / 60, maxSteps=8):
+        self.step = step
+        self.maxSteps = maxSteps
+        self.start = FrameClock.timer()
+        self.last = self.start
+        self.accumulator = 0.0
+        self.steps = 0 # this frame
+        self.totalSteps = 0
+        self.alpha = 0.0
+        self.frameTime = 0.0 # real seconds since the previous tick
+        self.frames = 0
+        self.fps = 0.0 # smoothed
+
+    def tick(self):
+        '''Start a frame, returns the number of fixed steps to simulate'''
+        now = FrameClock.timer()
+        self.frameTime = now - self.last
+        self.last = now
+        self.accumulator = min(self.accumulator + self.frameTime, self.maxSteps * self.step)
+        self.steps = int(self.accumulator / self.step)
+        self.accumulator -= self.steps * self.step
+        self.totalSteps += self.steps
+        self.alpha = self.accumulator / self.step
+        if self.frameTime > 0:
+            self.fps = 1 / self.frameTime if self.frames == 0 else self.fps * 0.95 + 0.05 / self.frameTime
+        self.frames += 1
+        return self.steps
+
+    @property
+    def time(self):
+        '''Simulated time of the interpolated frame, one step behind the last simulated state'''
+        return max((self.totalSteps - 1 + self.alpha) * self.step, 0.0)
+
+    @property
+    def elapsed(self):
+        '''Real seconds since the clock was created'''
+        return FrameClock.timer() - self.start
+
+    @staticmethod
+    def lerp(previous, current, alpha):
+        return previous + (current - previous) * alpha
+
+    def schedule(self, callback, fps=60, window=None):
+        '''Call callback(dt) fps times a second, or every loop iteration when unlocked, ticking first'''
+        import pyglet
+        def frame(dt, *args, **kwargs):
+            self.tick()
+            callback(dt, *args, **kwargs)
+        if fps is None or FrameClock.UNLOCKED:
+            if window is not None:
+                window.set_vsync(False)
+            pyglet.clock.schedule(frame)
+        else:
+            pyglet.clock.schedule_interval(frame, 1.0 / fps)
+        return frame
+
+if __name__ == '__main__':
+    import random
+
+    # a virtual timer: 60, 144 and 30 fps, then a jittery frame rate, then a one second hitch
+    now = [0.0]
+    FrameClock.timer = lambda: now[0]
+    for label, frameTimes in (('60 fps', [1 / 60] * 120), ('144 fps', [1 / 144] * 288), ('30 fps', [1 / 30] * 60),
+                              ('jitter', [random.uniform(0.004, 0.03) for _ in range(120)]), ('hitch', [1.0])):
+        clock = FrameClock(step=1 / 60)
+        times = []
+        for frameTime in frameTimes:
+            now[0] += frameTime
+            clock.tick()
+            times.append(clock.time)
+        monotonic = all(b >= a for a, b in zip(times, times[1:]))
+        print('{:<8} {:4d} frames over {:.3f} s: {:4d} steps, animation time {:.3f} s, monotonic {}'.format(
+            label, len(frameTimes), sum(frameTimes), clock.totalSteps, clock.time, monotonic))
@@ -0,0 +1,179 @@
+import numpy as np
+
+class Frustum():
+    '''
+    The six planes of a view frustum, tested against many bounding volumes at once:
+        frustum = Frustum(window.getViewProjectionMatrix()) - pyrr's projection * view (or just a projection)
+        visible = frustum.spheres(centres, radii) - (N,) bool, centres (N, 3)
+        visible = frustum.boxes(mins, maxs) - (N,) bool, AABBs as (N, 3) corners
+    Planes are extracted from the matrix (Gribb & Hartmann) and normalised, pointing inwards.
+    Bounds that are tested every frame are better packed once (packSpheres, packBoxes) and tested with
+    testSpheres / testBoxes: the packed layout turns the whole test into one matrix product and a minimum.
+    Tests are conservative: a volume crossing two planes outside a corner of the frustum counts as visible.
+    '''
+    def __init__(self, viewProjection=None):
+        self.planes = np.zeros((6, 4), dtype='f4') # a, b, c, d with a*x + b*y + c*z + d >= 0 inside
+        self.sphereRows = np.ones((6, 5), dtype='f4') # a b c d 1 against packed x y z 1 r
+        self.boxRows = np.zeros((6, 7), dtype='f4') # a b c d |a| |b| |c| against packed x y z 1 ex ey ez
+        self.insideRows = np.zeros((6, 7), dtype='f4') # a b c d -|a| -|b| -|c|: the far side of the box
+        if viewProjection is not None:
+            self.update(viewProjection)
+
+    def update(self, viewProjection):
+        '''New camera, pyrr matrices are row-major: clip = position @ matrix, the planes come from its columns'''
+        m = np.asarray(viewProjection, dtype='f8')
+        w = m[:, 3]
+        planes = np.array([w + m[:, 0], w - m[:, 0], w + m[:, 1], w - m[:, 1], w + m[:, 2], w - m[:, 2]]) # left right bottom top near far
+        planes /= np.linalg.norm(planes[:, :3], axis=1)[:, None]
+        self.planes[:] = planes
+        self.sphereRows[:, :4] = planes
+        self.boxRows[:, :4] = planes
+        self.boxRows[:, 4:] = np.abs(planes[:, :3])
+        self.insideRows[:, :4] = planes
+        self.insideRows[:, 4:] = -np.abs(planes[:, :3])
+
+    @staticmethod
+    def packSpheres(centres, radii):
+        '''(5, N) float32 rows x, y, z, 1, radius'''
+        centres = np.asarray(centres, dtype='f4').reshape(-1, 3)
+        packed = np.ones((5, len(centres)), dtype='f4')
+        packed[:3] = centres.T
+        packed[4] = radii
+        return packed
+
+    @staticmethod
+    def packBoxes(mins, maxs):
+        '''(7, N) float32 rows centre x, y, z, 1, half extent x, y, z'''
+        mins, maxs = np.asarray(mins, dtype='f4').reshape(-1, 3), np.asarray(maxs, dtype='f4').reshape(-1, 3)
+        packed = np.ones((7, len(mins)), dtype='f4')
+        packed[:3] = ((mins + maxs) * 0.5).T
+        packed[4:] = ((maxs - mins) * 0.5).T
+        return packed
+
+    def testSpheres(self, packed, scratch=None):
+        '''True where the sphere is at least partly inside, scratch: optional (6, N) float32 to reuse'''
+        distances = np.matmul(self.sphereRows, packed, out=scratch) # (6, N) plane distance + radius
+        return distances.min(axis=0) >= 0
+
+    def testBoxes(self, packed, scratch=None):
+        '''True where the box is at least partly inside, scratch: optional (6, N) float32 to reuse'''
+        distances = np.matmul(self.boxRows, packed, out=scratch) # (6, N) centre distance + extent towards the plane
+        return distances.min(axis=0) >= 0
+
+    def classifyBoxes(self, packed):
+        '''(visible, inside): at least partly inside, and entirely inside the frustum'''
+        visible = np.matmul(self.boxRows, packed).min(axis=0) >= 0
+        inside = np.matmul(self.insideRows, packed).min(axis=0) >= 0
+        return visible, inside
+
+    def spheres(self, centres, radii):
+        '''centres (N, 3), radii (N,) or a single radius'''
+        return self.testSpheres(Frustum.packSpheres(centres, radii))
+
+    def boxes(self, mins, maxs):
+        return self.testBoxes(Frustum.packBoxes(mins, maxs))
+
+    @staticmethod
+    def boundingSphere(positions):
+        '''(4,) float32 centre xyz and radius: the AABB centre and the farthest position from it'''
+        positions = np.asarray(positions, dtype='f4').reshape(-1, 3)
+        if not len(positions):
+            return np.zeros(4, dtype='f4')
+        centre = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        radius = np.sqrt(((positions - centre) ** 2).sum(axis=1).max())
+        return np.append(centre, radius).astype('f4')
+
+    @staticmethod
+    def transformSphere(sphere, model):
+        '''Bounding sphere in world space for a pyrr model matrix, the radius grows with the largest axis scale'''
+        model = np.asarray(model, dtype='f4')
+        centre = np.append(sphere[:3], 1.0) @ model
+        return centre[:3], sphere[3] * np.linalg.norm(model[:3, :3], axis=1).max()
+
+class InstanceCuller():
+    '''
+    Draws only the instances of an instanced draw that are inside the view frustum:
+        culler = InstanceCuller(ctx, instances, centres, radii) - instances: (N, k) float32 rows, one per instance
+        vao = ctx.vertex_array(prog, [..., (culler.buffer, '3f 1f 2f/i', ...)])
+        count = culler.update(frustum) - once per frame, the visible rows are compacted to the front of the buffer
+        vao.render(instances=count)
+    The buffer is only rewritten when the visible set changes (changed is True after such an update).
+    tested and culled count the last update(), totalTested and totalCulled every update so far.
+    '''
+    def __init__(self, ctx, instances, centres, radii):
+        self.instances = np.ascontiguousarray(instances, dtype='f4')
+        self.bounds = Frustum.packSpheres(centres, radii)
+        self.scratch = np.empty((6, len(self.instances)), dtype='f4')
+        self.buffer = ctx.buffer(reserve=max(self.instances.nbytes, 4))
+        self.compacted = np.empty_like(self.instances)
+        self.visible = None # mask of the last update
+        self.count = 0
+        self.changed = False
+        self.tested = 0
+        self.culled = 0
+        self.totalTested = 0
+        self.totalCulled = 0
+
+    def update(self, frustum):
+        '''Returns the number of visible instances, the first count rows of the buffer'''
+        visible = frustum.testSpheres(self.bounds, self.scratch)
+        self.tested = len(visible)
+        self.count = int(np.count_nonzero(visible))
+        self.culled = self.tested - self.count
+        self.totalTested += self.tested
+        self.totalCulled += self.culled
+        self.changed = self.visible is None or not np.array_equal(visible, self.visible)
+        if self.changed:
+            np.compress(visible, self.instances, axis=0, out=self.compacted[:self.count])
+            self.buffer.write(self.compacted[:self.count])
+            self.visible = visible
+        return self.count
+
+    def release(self):
+        self.buffer.release()
+
+if __name__ == '__main__':
+    import time
+    from pyrr import Matrix44
+
+    projection = Matrix44.perspective_projection(45.0, 16 / 9, 0.1, 100.0)
+    view = Matrix44.look_at([0.0, 0.0, 0.0], [0.3, 0.1, -1.0], [0.0, 1.0, 0.0])
+    frustum = Frustum(projection * view)
+
+    # against the clip space test of the points themselves: radius 0 spheres and empty boxes must agree exactly
+    points = np.random.uniform(-60, 60, (100000, 3)).astype('f4')
+    clip = np.hstack([points, np.ones((len(points), 1), dtype='f4')]) @ np.asarray(projection * view, dtype='f4')
+    inside = (np.abs(clip[:, :3]) <= clip[:, 3:]).all(axis=1)
+    margin = np.abs(np.abs(clip[:, :3]) - clip[:, 3:]).min(axis=1) > 1e-3 * np.abs(clip[:, 3]) # away from the planes
+    print('points: {} inside, spheres agree {}, boxes agree {}'.format(inside.sum(),
+        np.array_equal(frustum.spheres(points, 0)[margin], inside[margin]), np.array_equal(frustum.boxes(points, points)[margin], inside[margin])))
+
+    # a sphere is visible if any of its points is: sample surfaces of spheres just outside and just inside the planes
+    centres = np.random.uniform(-60, 60, (20000, 3)).astype('f4')
+    radii = np.random.uniform(0.1, 5, len(centres)).astype('f4')
+    directions = np.random.normal(size=(len(centres), 64, 3))
+    directions /= np.linalg.norm(directions, axis=2)[..., None]
+    surface = (centres[:, None] + directions * radii[:, None, None]).reshape(-1, 3)
+    clip = np.hstack([surface, np.ones((len(surface), 1))]) @ np.asarray(projection * view)
+    sampled = (np.abs(clip[:, :3]) <= clip[:, 3:]).all(axis=1).reshape(len(centres), -1).any(axis=1)
+    visible = frustum.spheres(centres, radii)
+    print('spheres: {} visible, never culled when a surface point is inside: {}, conservative extra: {}'.format(
+        visible.sum(), not (sampled & ~visible).any(), (visible & ~sampled).sum()))
+
+    for count in (10000, 100000, 1000000):
+        centres = np.random.uniform(-100, 100, (count, 3)).astype('f4')
+        radii = np.random.uniform(0.1, 2, count).astype('f4')
+        spheres = Frustum.packSpheres(centres, radii)
+        boxes = Frustum.packBoxes(centres - radii[:, None], centres + radii[:, None])
+        instances = np.hstack([centres, radii[:, None]])
+        scratch = np.empty((6, count), dtype='f4')
+        visible = frustum.testSpheres(spheres)
+        timings = []
+        for test in (lambda: frustum.testSpheres(spheres, scratch), lambda: frustum.testBoxes(boxes, scratch),
+                     lambda: frustum.spheres(centres, radii), lambda: np.compress(visible, instances, axis=0)):
+            start = time.perf_counter()
+            for _ in range(10):
+                test()
+            timings.append((time.perf_counter() - start) * 100)
+        print('{:>8} bounds: packed spheres {:5.2f} ms, packed boxes {:5.2f} ms, unpacked spheres {:5.2f} ms, compaction of {} visible {:5.2f} ms'.format(
+            count, *timings[:3], visible.sum(), timings[3]))
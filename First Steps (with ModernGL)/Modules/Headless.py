@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import runpy
+import numpy as np
+import moderngl
+if __name__ == '__main__': # python Modules/Headless.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.FrameClock import FrameClock
+
+class HeadlessWindow():
+    '''
+    Stands in for pyglet.window.Window (and so for ViewportFP's base class) while a demo runs headless.
+    Keeps the size, accepts event handlers and ignores cursor and display calls.
+    '''
+    def __init__(self, width=640, height=480, caption='', resizable=False, vsync=True, **kwargs):
+        self.width = width
+        self.height = height
+        self.caption = caption
+        self.handlers = {}
+        Headless.active._windowCreated(self)
+
+    def event(self, handler):
+        self.handlers[handler.__name__] = handler
+        return handler
+
+    def push_handlers(self, *objects, **handlers):
+        '''As pyglet: the on_* methods of each object, then handlers given by event name'''
+        for obj in objects:
+            self.handlers.update({name: getattr(obj, name) for name in dir(obj) if name.startswith('on_')})
+        self.handlers.update(handlers)
+
+    def dispatch_event(self, name, *args):
+        '''Feed an input event, e.g. dispatch_event('on_key_press', key.W, 0)'''
+        handler = self.handlers.get(name, getattr(self, name, None))
+        if handler is not None:
+            handler(*args)
+
+    def get_size(self):
+        return self.width, self.height
+
+    def set_mouse_visible(self, visible=True):
+        pass
+
+    def set_exclusive_mouse(self, exclusive=True):
+        pass
+
+    def set_vsync(self, vsync):
+        pass
+
+    def set_caption(self, caption):
+        self.caption = caption
+
+    def close(self):
+        pass
+
+class Headless():
+    '''
+    Runs an unmodified demo script offscreen, e.g. on a render node without a display:
+        frames = Headless.run('05_Coordinate_Systems_(3D_Primitives).py', frames=60) - list of (height, width, 3) uint8
+    A standalone context (EGL on Linux without $DISPLAY) renders into a framebuffer the size of the demo's window,
+    or size if given. While the script runs:
+        pyglet.window.Window - HeadlessWindow, ViewportFP is re-imported on top of it
+        moderngl.create_context() - returns the standalone context with the framebuffer bound
+        pyglet.clock.schedule_interval() / schedule() - collect the update functions
+        pyglet.app.run() - calls them frames times with a fixed dt and reads the framebuffer after each frame
+        FrameClock.timer - a virtual clock advanced by dt per frame, so runs are deterministic
+    Everything is restored afterwards. onFrame(index, headless) is called after each frame, e.g. to feed input
+    through headless.window.dispatch_event().
+    '''
+    active = None
+    PATCHED_MODULES = ('Modules.ViewportFP',) # modules that bind pyglet.window.Window at import time
+
+    def __init__(self, frames=60, dt=1 / 60, size=None, backend=None, onFrame=None, capture=True):
+        self.frames = frames
+        self.dt = dt
+        self.size = size
+        self.onFrame = onFrame
+        self.capture = capture
+        self.backend = backend
+        self.ctx = Headless.standaloneContext(backend)
+        self.fbo = None
+        self.window = None
+        self.callbacks = []
+        self.time = 0.0
+        self.images = []
+
+    @staticmethod
+    def standaloneContext(backend=None):
+        '''moderngl.create_standalone_context(), on EGL if no backend is given and Linux has no $DISPLAY'''
+        if backend is None and sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+            backend = 'egl'
+        return moderngl.create_standalone_context(**({'backend': backend} if backend else {}))
+
+    @staticmethod
+    def run(script, frames=60, dt=1 / 60, size=None, backend=None, onFrame=None, capture=True):
+        '''Run script for frames frames, returns the rendered frames (top row first)'''
+        headless = Headless(frames, dt, size, backend, onFrame, capture)
+        headless.execute(script)
+        return headless.images
+
+    def execute(self, script):
+        import pyglet
+        pyglet.options['shadow_window'] = False # no hidden window on import of pyglet.gl
+        pyglet.options['headless'] = True # EGL instead of X for whatever pyglet itself sets up
+        import pyglet.window
+        import pyglet.clock
+        import pyglet.app
+
+        saved = [(moderngl, 'create_context'), (pyglet.window, 'Window'), (pyglet.clock, 'schedule_interval'),
+                 (pyglet.clock, 'schedule'), (pyglet.app, 'run'), (pyglet.app, 'exit'), (FrameClock, 'timer')]
+        saved = [(owner, name, owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)) for owner, name in saved]
+        modules = {name: sys.modules.pop(name) for name in Headless.PATCHED_MODULES if name in sys.modules}
+        directory = os.path.dirname(os.path.abspath(script))
+        sys.path.insert(0, directory)
+        Headless.active = self
+        try:
+            moderngl.create_context = self._createContext
+            pyglet.window.Window = HeadlessWindow
+            pyglet.clock.schedule_interval = lambda callback, interval, *args, **kwargs: self.callbacks.append((callback, args, kwargs))
+            pyglet.clock.schedule = lambda callback, *args, **kwargs: self.callbacks.append((callback, args, kwargs))
+            pyglet.app.run = self._loop
+            pyglet.app.exit = lambda: None
+            FrameClock.timer = lambda: self.time
+            runpy.run_path(script, run_name='__main__')
+        finally:
+            Headless.active = None
+            sys.path.remove(directory)
+            for name in Headless.PATCHED_MODULES:
+                sys.modules.pop(name, None)
+            sys.modules.update(modules)
+            for owner, name, value in saved:
+                setattr(owner, name, value)
+
+    def _windowCreated(self, window):
+        self.window = window
+        if self.size is None:
+            self.size = (window.width, window.height)
+
+    def _createContext(self, *args, **kwargs):
+        size = self.size or (640, 480)
+        self.fbo = self.ctx.framebuffer(self.ctx.renderbuffer(size), self.ctx.depth_renderbuffer(size))
+        self.fbo.use()
+        return self.ctx
+
+    def step(self):
+        '''One frame: every scheduled callback with the fixed dt, then the virtual clock moves on'''
+        for callback, args, kwargs in self.callbacks:
+            callback(self.dt, *args, **kwargs)
+        self.time += self.dt
+
+    def _loop(self, *args, **kwargs):
+        '''pyglet.app.run() replacement: frames fixed steps of the scheduled callbacks'''
+        for frame in range(self.frames):
+            self.step()
+            if self.capture:
+                image = np.frombuffer(self.fbo.read(components=3), dtype='u1').reshape(self.fbo.height, self.fbo.width, 3)
+                self.images.append(image[::-1])
+            if self.onFrame is not None:
+                self.onFrame(frame, self)
+
+if __name__ == '__main__':
+    import argparse
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description='Render a demo offscreen and save its frames as PNG files')
+    parser.add_argument('script')
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--dt', type=float, default=1 / 60)
+    parser.add_argument('--size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--out', default=None, help='directory for the PNG files, only the last frame is saved unless --all')
+    parser.add_argument('--all', action='store_true')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    images = Headless.run(args.script, args.frames, args.dt, args.size)
+    elapsed = time.perf_counter() - start
+    print('{}: {} frames of {}x{} in {:.2f} s'.format(os.path.basename(args.script), len(images), images[-1].shape[1], images[-1].shape[0], elapsed))
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+        name = os.path.splitext(os.path.basename(args.script))[0]
+        for index in (range(len(images)) if args.all else [len(images) - 1]):
+            Image.fromarray(images[index]).save(os.path.join(args.out, '{}_{:04d}.png'.format(name, index)))
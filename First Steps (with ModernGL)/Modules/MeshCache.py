@@ -0,0 +1,216 @@
+import os
+import sys
+import struct
+import hashlib
+import zlib
+import tempfile
+import numpy as np
+if __name__ == '__main__': # python Modules/MeshCache.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.ObjMesh import ObjMesh
+from Modules.MeshOptimizer import MeshOptimizer
+from Modules.MeshQuantizer import MeshQuantizer
+from Modules.Frustum import Frustum
+
+class CompiledMesh():
+    '''Vertex and index blobs of a mesh, memory-mapped from a cache file'''
+    def __init__(self, layout, vertices, indices, bounds=None, quantize=None, sphere=None):
+        self.layout = layout
+        self.vertices = vertices # (N, stride) uint8 memmap, interleaved as described by layout
+        self.indices = indices # uint16/uint32 memmap or None for a non-indexed triangle list
+        self.bounds = bounds # (2, 3) float32 position AABB (min, max), zeros if the layout has no position
+        self.quantize = quantize # None for float32 data, else the MeshQuantizer normal encoding ('oct16', 'oct8')
+        self.sphere = sphere # (4,) float32 bounding sphere centre xyz and radius, for culling (see Frustum)
+
+    def format(self, skip=()):
+        '''moderngl buffer format matching the vertex data, see MeshQuantizer.format()'''
+        return MeshQuantizer.format(self.layout, self.quantize, skip)
+
+class MeshCache():
+    '''
+    Binary sidecar cache for OBJ assets.
+    The first load parses the OBJ and writes <name>.<layout hash>.meshcache next to it (or into cacheDir):
+        header - magic, version, source mtime/size/sha1, blob sizes and CRC32s, position AABB and bounding sphere
+        key - the pack() layout string, plus ' indexed' for deduplicated meshes, ' optimized' for reordered ones
+              and the normal encoding ('oct16', 'oct8') for quantized ones
+        vertex blob, index blob - 16-byte aligned
+    Later loads memory-map the file, the blobs can be handed to ctx.buffer() without parsing or copying.
+    Stale (different source or layout) or corrupt (truncated, bad CRC) caches are rebuilt.
+    '''
+    MAGIC = b'MESHCACH'
+    VERSION = 3
+    # magic, version, layout length, source mtime (ns), source size, source sha1,
+    # vertex count, vertex stride, index count, index size, vertex offset, index offset, vertex crc, index crc,
+    # AABB min xyz, AABB max xyz, bounding sphere centre xyz and radius
+    HEADER = struct.Struct('<8sIIqq20sIIIIQQII6f4f')
+    MTIME_OFFSET = 16
+    FLAGS = ('indexed', 'optimized') + tuple(MeshQuantizer.NORMALS) # key words that are not layout nodes
+
+    @staticmethod
+    def load(filename, layout='vx vy vz nx ny nz tx ty', cacheDir=None, indexed=False, optimize=False, quantize=None):
+        '''
+        Return a CompiledMesh for the OBJ file, building the cache if it is missing or invalid.
+        indexed=True stores deduplicated vertices plus a uint16/uint32 index blob (see ObjMesh.packIndexed)
+        optimize=True (implies indexed) also runs MeshOptimizer over it once, at build time
+        quantize='oct16' or 'oct8' stores 16 or 12 byte vertices (see MeshQuantizer), upload the
+        dequantization uniforms with MeshQuantizer.writeUniforms(prog, mesh.bounds, mesh.quantize)
+        '''
+        key = MeshCache._key(layout, indexed, optimize, quantize)
+        path = MeshCache.cachePath(filename, layout, cacheDir, indexed, optimize, quantize)
+        mesh = MeshCache._open(path, filename, key)
+        if mesh is None:
+            MeshCache._write(path, filename, key)
+            mesh = MeshCache._open(path, filename, key)
+        return mesh
+
+    @staticmethod
+    def cachePath(filename, layout, cacheDir=None, indexed=False, optimize=False, quantize=None):
+        directory = cacheDir if cacheDir is not None else os.path.dirname(os.path.abspath(filename))
+        key = '{:08x}'.format(zlib.crc32(MeshCache._key(layout, indexed, optimize, quantize).encode()))
+        return os.path.join(directory, '{}.{}.meshcache'.format(os.path.basename(filename), key))
+
+    @staticmethod
+    def _key(layout, indexed, optimize=False, quantize=None):
+        if quantize is not None and quantize not in MeshQuantizer.NORMALS:
+            raise ValueError('unknown quantization {!r}, expected one of {}'.format(quantize, tuple(MeshQuantizer.NORMALS)))
+        return ' '.join(layout.split() + ['indexed'] * (indexed or optimize) + ['optimized'] * optimize + [quantize] * (quantize is not None))
+
+    @staticmethod
+    def _build(filename, key):
+        '''Parse the source; returns (vertices as (N, stride) uint8, indices or None, (2, 3) position AABB, (4,) bounding sphere)'''
+        nodes = [n for n in key.split() if n not in MeshCache.FLAGS]
+        flags = key.split()[len(nodes):]
+        layout = ' '.join(nodes)
+        mesh = ObjMesh.open(filename)
+        indices = None
+        if 'indexed' in flags:
+            vertices, indices = mesh.packIndexed(layout)
+        else:
+            vertices = np.frombuffer(mesh.pack(layout), dtype='f4').reshape(-1, len(nodes))
+        positions = vertices[:, [nodes.index(n) for n in ('vx', 'vy', 'vz')]] if {'vx', 'vy', 'vz'} <= set(nodes) else None
+        if 'optimized' in flags:
+            vertices, indices = MeshOptimizer.optimize(vertices, indices, positions)
+            positions = None if positions is None else vertices[:, [nodes.index(n) for n in ('vx', 'vy', 'vz')]]
+        bounds = np.zeros((2, 3), dtype='f4')
+        sphere = np.zeros(4, dtype='f4')
+        if positions is not None and len(positions):
+            bounds = np.array([positions.min(axis=0), positions.max(axis=0)], dtype='f4')
+            sphere = Frustum.boundingSphere(positions)
+
+        quantize = [f for f in flags if f in MeshQuantizer.NORMALS]
+        if quantize:
+            vertices, bounds = MeshQuantizer.quantize(vertices, layout, quantize[0])
+        return np.ascontiguousarray(vertices).view('u1'), indices, bounds, sphere
+
+    @staticmethod
+    def _sourceHash(filename):
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).digest()
+
+    @staticmethod
+    def _write(path, filename, key):
+        vertices, indices, bounds, sphere = MeshCache._build(filename, key)
+        stat = os.stat(filename)
+        layoutBytes = key.encode()
+        vertexOffset = MeshCache._align(MeshCache.HEADER.size + len(layoutBytes))
+        indexOffset = MeshCache._align(vertexOffset + vertices.nbytes)
+        indexBytes = indices.tobytes() if indices is not None else b''
+        header = MeshCache.HEADER.pack(
+            MeshCache.MAGIC, MeshCache.VERSION, len(layoutBytes), stat.st_mtime_ns, stat.st_size,
+            MeshCache._sourceHash(filename), vertices.shape[0], vertices.shape[1],
+            len(indices) if indices is not None else 0, indices.itemsize if indices is not None else 0,
+            vertexOffset, indexOffset, zlib.crc32(vertices), zlib.crc32(indexBytes), *bounds.ravel(), *sphere)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a temporary file of its own, two processes may build the same mesh at once
+        temp = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False)
+        try:
+            with temp as f:
+                f.write(header + layoutBytes)
+                f.write(b'\0' * (vertexOffset - f.tell()))
+                f.write(vertices.tobytes())
+                f.write(b'\0' * (indexOffset - f.tell()))
+                f.write(indexBytes)
+            os.replace(temp.name, path) # never leave a half-written cache behind
+        finally:
+            if os.path.exists(temp.name): # the write failed
+                os.remove(temp.name)
+
+    @staticmethod
+    def _open(path, filename, key):
+        '''Memory-map a valid cache file, or return None if it is missing, stale or corrupt'''
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(MeshCache.HEADER.size)
+                (magic, version, layoutLength, mtime, size, sha1, vertexCount, stride,
+                 indexCount, indexSize, vertexOffset, indexOffset, vertexCrc, indexCrc, *bounds) = MeshCache.HEADER.unpack(header)
+                bounds, sphere = bounds[:6], bounds[6:]
+                cachedLayout = f.read(layoutLength)
+            fileSize = os.path.getsize(path)
+        except (OSError, struct.error):
+            return None
+        if magic != MeshCache.MAGIC or version != MeshCache.VERSION or cachedLayout != key.encode():
+            return None
+        if indexSize not in (0, 2, 4) or fileSize != indexOffset + indexCount * indexSize \
+                or vertexOffset + vertexCount * stride > indexOffset:
+            return None # truncated or garbage header
+
+        stat = os.stat(filename)
+        if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+            # e.g. a fresh checkout touches mtime: only rebuild if the content really changed
+            if stat.st_size != size or MeshCache._sourceHash(filename) != sha1:
+                return None
+            with open(path, 'r+b') as f:
+                f.seek(MeshCache.MTIME_OFFSET)
+                f.write(struct.pack('<q', stat.st_mtime_ns))
+
+        vertices = np.memmap(path, dtype='u1', mode='r', offset=vertexOffset, shape=(vertexCount, stride))
+        indices = None
+        if indexCount:
+            indices = np.memmap(path, dtype='u{}'.format(indexSize), mode='r', offset=indexOffset, shape=(indexCount,))
+        if zlib.crc32(vertices) != vertexCrc or zlib.crc32(indices if indices is not None else b'') != indexCrc:
+            return None
+        layout = ' '.join(n for n in key.split() if n not in MeshCache.FLAGS)
+        quantize = next((n for n in key.split() if n in MeshQuantizer.NORMALS), None)
+        return CompiledMesh(layout, vertices, indices, np.array(bounds, dtype='f4').reshape(2, 3), quantize, np.array(sphere, dtype='f4'))
+
+    @staticmethod
+    def _align(offset, alignment=16):
+        return (offset + alignment - 1) // alignment * alignment
+
+if __name__ == '__main__':
+    import tempfile
+    import timeit
+
+    source = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'teapot.obj')
+    layout = 'vx vy vz nx ny nz tx ty'
+    cacheDir = tempfile.mkdtemp()
+    path = MeshCache.cachePath(source, layout, cacheDir)
+
+    coldTime = timeit.timeit(lambda: MeshCache.load(source, layout, cacheDir), number=1)
+    warmTime = min(timeit.repeat(lambda: MeshCache.load(source, layout, cacheDir), number=1, repeat=5))
+    mesh = MeshCache.load(source, layout, cacheDir)
+    print('cold: {:.1f} ms, warm (memmap): {:.1f} ms, identical to pack(): {}'.format(
+        coldTime * 1000, warmTime * 1000, mesh.vertices.tobytes() == ObjMesh.open(source).pack(layout)))
+
+    with open(path, 'r+b') as f: # corrupt one byte of the vertex blob
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+    mesh = MeshCache.load(source, layout, cacheDir)
+    print('rebuilt after corruption:', mesh.vertices.tobytes() == ObjMesh.open(source).pack(layout))
+
+    mesh = MeshCache.load(source, layout, cacheDir, indexed=True)
+    print('indexed: {} vertices, {} {} indices, matches soup: {}'.format(
+        len(mesh.vertices), len(mesh.indices), mesh.indices.dtype,
+        np.asarray(mesh.vertices)[mesh.indices].tobytes() == ObjMesh.open(source).pack(layout)))
+
+    mesh = MeshCache.load(source, layout, cacheDir, optimize=True)
+    print('optimized: {} vertices, ACMR {:.3f}, same triangle count: {}'.format(
+        len(mesh.vertices), MeshOptimizer.analyze(mesh.indices)[0], len(mesh.indices) == len(ObjMesh.open(source).pack(layout)) // 32))
+
+    for quantize in MeshQuantizer.NORMALS:
+        mesh = MeshCache.load(source, layout, cacheDir, optimize=True, quantize=quantize)
+        vertices = MeshCache.load(source, layout, cacheDir, optimize=True).vertices.view('f4')
+        errors = MeshQuantizer.error(vertices, mesh.vertices, mesh.bounds, layout, quantize)
+        print('{}: {} byte vertices ({}), max error: position {:.2e}, normal {:.3f} deg, UV {:.2e}'.format(
+            quantize, mesh.vertices.shape[1], mesh.format(), errors['vx vy vz'], errors['nx ny nz'], errors['tx ty']))
@@ -0,0 +1,187 @@
+import os
+import sys
+import numpy as np
+if __name__ == '__main__': # python Modules/MeshOptimizer.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Forsyth's tuning constants (http://eelpi.gotdns.org/papers/fast_vert_cache_opt.html)
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+class MeshOptimizer():
+    '''
+    Offline index/vertex buffer optimisations for indexed triangle lists:
+        optimizeVertexCache - Forsyth's linear-speed triangle reordering for post-transform cache reuse
+        optimizeOverdraw - splits the result into clusters and draws outward-facing clusters first
+        optimizeVertexFetch - renumbers vertices in first-use order for linear vertex fetches
+        analyze - ACMR (misses per triangle) and ATVR (misses per vertex) of a simulated FIFO cache
+    '''
+    @staticmethod
+    def optimize(vertices, indices, positions=None, cacheSize=32, overdrawThreshold=1.05):
+        '''Run the full pipeline; positions ((N,3) array) enables the overdraw pass. Returns (vertices, indices)'''
+        indices = MeshOptimizer.optimizeVertexCache(indices, len(vertices), cacheSize)
+        if positions is not None:
+            indices = MeshOptimizer.optimizeOverdraw(indices, positions, cacheSize, overdrawThreshold)
+        return MeshOptimizer.optimizeVertexFetch(vertices, indices)
+
+    @staticmethod
+    def optimizeVertexCache(indices, vertexCount, cacheSize=32):
+        '''Reorder triangles with Tom Forsyth's algorithm, simulating an LRU cache of cacheSize entries'''
+        tris = np.asarray(indices).reshape(-1, 3).tolist()
+        adjacency = [[] for _ in range(vertexCount)]
+        for t, tri in enumerate(tris):
+            for v in tri:
+                adjacency[v].append(t)
+        remaining = [len(a) for a in adjacency]
+
+        cacheScores = [LAST_TRI_SCORE] * 3 + [
+            (1.0 - (i - 3) / (cacheSize - 3)) ** CACHE_DECAY_POWER for i in range(3, cacheSize)]
+        valenceScores = [0.0] + [
+            VALENCE_BOOST_SCALE * n ** -VALENCE_BOOST_POWER for n in range(1, max(remaining, default=0) + 1)]
+        vertexScores = [valenceScores[n] for n in remaining]
+        triScores = [vertexScores[a] + vertexScores[b] + vertexScores[c] for a, b, c in tris]
+        emitted = [False] * len(tris)
+
+        output = []
+        cache = []
+        best = max(range(len(tris)), key=triScores.__getitem__) if tris else -1
+        nextInput = 0 # dead-end fallback: next unemitted triangle in input order
+        while best >= 0:
+            tri = tris[best]
+            emitted[best] = True
+            output.append(best)
+            for v in tri:
+                remaining[v] -= 1
+                adjacency[v].remove(best)
+
+            # move the triangle's vertices to the front of the LRU cache
+            newCache = tri + [v for v in cache if v not in tri]
+            touched = set()
+            for i, v in enumerate(newCache):
+                position = i if i < cacheSize else -1
+                score = valenceScores[remaining[v]] + (cacheScores[position] if position >= 0 and remaining[v] else 0.0)
+                delta = score - vertexScores[v]
+                if delta:
+                    vertexScores[v] = score
+                    for t in adjacency[v]:
+                        triScores[t] += delta
+                touched.update(adjacency[v])
+            cache = newCache[:cacheSize]
+
+            best = max(touched, key=triScores.__getitem__) if touched else -1
+            if best < 0:
+                while nextInput < len(tris) and emitted[nextInput]:
+                    nextInput += 1
+                best = nextInput if nextInput < len(tris) else -1
+        return np.asarray(indices).reshape(-1, 3)[output].ravel()
+
+    @staticmethod
+    def optimizeOverdraw(indices, positions, cacheSize=32, threshold=1.05):
+        '''
+        Sander et al. style clustering on a cache-optimised index buffer:
+        cut at hard boundaries (all three vertices missed the cache) and at soft boundaries
+        where the cluster ACMR stays within threshold of its hard cluster, then sort clusters
+        so that the ones facing away from the mesh centre (likely occluders) are drawn first.
+        '''
+        indices = np.asarray(indices)
+        tris = indices.reshape(-1, 3)
+        misses = MeshOptimizer._fifoMisses(indices, cacheSize).reshape(-1, 3).sum(axis=1)
+        hard = np.flatnonzero(misses == 3)
+        hard = np.r_[0, hard[hard > 0], len(tris)]
+
+        clusters = []
+        triList = tris.tolist()
+        for start, end in zip(hard[:-1], hard[1:]):
+            # every cluster may be drawn after any other, so each one starts with a cold cache
+            target = threshold * MeshOptimizer._fifoMisses(indices[3 * start:3 * end], cacheSize).sum() / (end - start)
+            begin = start
+            cache = FifoCache(cacheSize)
+            clusterMisses = 0
+            for i in range(start, end):
+                clusterMisses += cache.add(triList[i])
+                if clusterMisses <= target * (i + 1 - begin) and end - i > 1:
+                    clusters.append(begin)
+                    begin = i + 1
+                    cache = FifoCache(cacheSize)
+                    clusterMisses = 0
+            clusters.append(begin)
+        clusters = sorted(set(clusters))
+
+        corners = np.asarray(positions, dtype='f8')[tris]
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]) # length = 2 * area
+        centres = corners.mean(axis=1)
+        areas = np.linalg.norm(normals, axis=1)
+        meshCentre = (centres * areas[:, None]).sum(axis=0) / max(areas.sum(), 1e-30)
+
+        starts = np.array(clusters)
+        clusterArea = np.add.reduceat(areas, starts)
+        clusterCentre = np.add.reduceat(centres * areas[:, None], starts) / np.maximum(clusterArea, 1e-30)[:, None]
+        clusterNormal = np.add.reduceat(normals, starts)
+        keys = ((clusterCentre - meshCentre) * clusterNormal).sum(axis=1)
+        order = np.argsort(-keys, kind='stable')
+        ends = np.r_[starts[1:], len(tris)]
+        return np.concatenate([tris[starts[c]:ends[c]] for c in order]).ravel()
+
+    @staticmethod
+    def optimizeVertexFetch(vertices, indices):
+        '''Renumber vertices in order of first use, dropping unreferenced ones. Returns (vertices, indices)'''
+        indices = np.asarray(indices)
+        used, first = np.unique(indices, return_index=True)
+        order = used[np.argsort(first)]
+        remap = np.empty(len(vertices), dtype=np.int64)
+        remap[order] = np.arange(len(order))
+        return np.asarray(vertices)[order], remap[indices].astype(indices.dtype)
+
+    @staticmethod
+    def analyze(indices, cacheSize=32):
+        '''Returns (ACMR, ATVR) for a FIFO post-transform cache of cacheSize entries'''
+        indices = np.asarray(indices)
+        misses = MeshOptimizer._fifoMisses(indices, cacheSize).sum()
+        return misses / (len(indices) // 3), misses / len(np.unique(indices))
+
+    @staticmethod
+    def _fifoMisses(indices, cacheSize):
+        '''Per-index cache miss flags (1/0) for a FIFO cache, as used by most GPUs'''
+        cache = FifoCache(cacheSize)
+        return np.array([cache.add((v,)) for v in np.asarray(indices).tolist()], dtype=np.int64)
+
+class FifoCache():
+    '''Post-transform vertex cache model: a FIFO of the last cacheSize vertex indices'''
+    def __init__(self, cacheSize):
+        self.slots = [-1] * cacheSize
+        self.cached = set()
+        self.head = 0
+
+    def add(self, vertices):
+        '''Push the vertices through the cache, returns the number of misses'''
+        misses = 0
+        for v in vertices:
+            if v not in self.cached:
+                misses += 1
+                self.cached.discard(self.slots[self.head])
+                self.slots[self.head] = v
+                self.cached.add(v)
+                self.head = (self.head + 1) % len(self.slots)
+        return misses
+
+if __name__ == '__main__':
+    import time
+    from Modules.ObjMesh import ObjMesh
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'teapot.obj')
+    vertices, indices = ObjMesh.open(path).packIndexed('vx vy vz nx ny nz tx ty')
+
+    start = time.perf_counter()
+    optimizedVertices, optimizedIndices = MeshOptimizer.optimize(vertices, indices, vertices[:, :3])
+    elapsed = time.perf_counter() - start
+    cacheOnly = MeshOptimizer.optimizeVertexCache(indices, len(vertices))
+
+    print('optimised {} triangles in {:.2f} s'.format(len(indices) // 3, elapsed))
+    for cacheSize in (16, 32):
+        print('FIFO {:2d}: ACMR/ATVR  original {:.3f}/{:.3f}  vertex cache {:.3f}/{:.3f}  + overdraw {:.3f}/{:.3f}'.format(
+            cacheSize, *MeshOptimizer.analyze(indices, cacheSize), *MeshOptimizer.analyze(cacheOnly, cacheSize),
+            *MeshOptimizer.analyze(optimizedIndices, cacheSize)))
+    same = np.sort(np.sort(optimizedVertices[optimizedIndices].reshape(-1, 3, 8), axis=1).reshape(-1, 24), axis=0)
+    print('same triangles:', np.array_equal(same, np.sort(np.sort(vertices[indices].reshape(-1, 3, 8), axis=1).reshape(-1, 24), axis=0)))
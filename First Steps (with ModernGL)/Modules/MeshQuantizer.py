@@ -0,0 +1,198 @@
+import os
+import sys
+import numpy as np
+if __name__ == '__main__': # python Modules/MeshQuantizer.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class MeshQuantizer():
+    '''
+    Compressed vertex formats for 'vx vy vz nx ny nz tx ty' style layouts:
+        positions - int16 against the mesh AABB, dequantized as quantOffset + in_vert * quantScale
+        normals - octahedral encoded, 2 x int16 ('oct16', 16 bytes per vertex) or 2 x int8 ('oct8', 12 bytes per vertex)
+        UVs - half floats
+    The integers are fed to float attributes unnormalised, the vertex shader scales them back. moderngl's format
+    strings only normalise unsigned bytes ('f1'), 'i2'/'i1' never are, and VertexArray.bind() rejects
+    normalize=True for float attributes, so signed integers cannot reach the shader as [-1, 1]. Even then the
+    positions would still need the AABB offset and extent, only octScale would go:
+
+        uniform vec3 quantOffset;
+        uniform vec3 quantScale;
+        uniform float octScale;
+
+        vec3 octDecode(vec2 e)
+        {
+            vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+            float t = max(-n.z, 0.0);
+            n.xy += vec2(n.x >= 0.0 ? -t : t, n.y >= 0.0 ? -t : t);
+            return normalize(n);
+        }
+
+        vec3 position = quantOffset + in_vert * quantScale;
+        vec3 normal = octDecode(in_norm * octScale);
+    '''
+    GROUPS = ('vx vy vz', 'nx ny nz', 'tx ty')
+    NORMALS = {'oct16': ('i2', 32767), 'oct8': ('i1', 127)}
+    POSITION_RANGE = 32767
+
+    @staticmethod
+    def quantize(vertices, layout='vx vy vz nx ny nz tx ty', normals='oct16'):
+        '''Returns ((N, stride) uint8 vertex data, (2, 3) float32 AABB) for float vertices laid out as layout'''
+        vertices = np.asarray(vertices, dtype='f4').reshape(-1, len(layout.split()))
+        normalType, normalRange = MeshQuantizer.NORMALS[normals]
+        bounds = np.zeros((2, 3), dtype='f4')
+        parts, column = [], 0
+        for group, node, length in MeshQuantizer._nodes(layout, normals):
+            values = vertices[:, column:column + len(group.split())]
+            column += values.shape[1]
+            if group == 'vx vy vz':
+                bounds = np.array([values.min(axis=0), values.max(axis=0)], dtype='f4')
+                offset, scale = MeshQuantizer.dequantization(bounds)
+                positions = np.rint((values - offset) / scale).clip(-MeshQuantizer.POSITION_RANGE, MeshQuantizer.POSITION_RANGE)
+                parts.append(positions.astype('i2'))
+                parts.append(np.zeros((len(values), (length - 6) // 2), dtype='i2'))
+            elif group == 'nx ny nz':
+                parts.append(MeshQuantizer.octEncode(values, normalRange).astype(normalType))
+            else:
+                parts.append(values.astype('f2'))
+        data = np.concatenate([np.ascontiguousarray(p).view('u1') for p in parts], axis=1)
+        return np.ascontiguousarray(data), bounds
+
+    @staticmethod
+    def format(layout='vx vy vz nx ny nz tx ty', normals=None, skip=()):
+        '''
+        moderngl buffer format for pack(layout) (normals=None) or quantize(layout, normals) output,
+        groups listed in skip ('nx ny nz', 'tx ty') become padding so unused attributes can be left out
+        '''
+        return ' '.join('{}x'.format(length) if group in skip else node
+                        for group, node, length in MeshQuantizer._nodes(layout, normals))
+
+    @staticmethod
+    def dequantization(bounds):
+        '''(quantOffset, quantScale) for an AABB: the box centre and half extent per int16 step'''
+        bounds = np.asarray(bounds, dtype='f4')
+        offset = (bounds[0] + bounds[1]) / 2
+        scale = (bounds[1] - bounds[0]) / 2 / MeshQuantizer.POSITION_RANGE
+        return offset, np.where(scale > 0, scale, 1.0).astype('f4') # flat axes quantize to 0
+
+    @staticmethod
+    def writeUniforms(prog, bounds, normals='oct16'):
+        '''Upload the dequantization uniforms a vertex shader declares'''
+        offset, scale = MeshQuantizer.dequantization(bounds)
+        if 'quantOffset' in prog:
+            prog['quantOffset'].write(offset.astype('f4').tobytes())
+        if 'quantScale' in prog:
+            prog['quantScale'].write(scale.astype('f4').tobytes())
+        if 'octScale' in prog:
+            prog['octScale'].value = 1.0 / MeshQuantizer.NORMALS[normals][1]
+
+    @staticmethod
+    def octEncode(normals, valueRange):
+        '''
+        Octahedral encoding to integers in [-valueRange, valueRange].
+        All four rounding candidates are tried per normal and the one that decodes closest is kept.
+        '''
+        n = np.asarray(normals, dtype='f8')
+        n = n / np.maximum(np.abs(n).sum(axis=1, keepdims=True), 1e-30)
+        folded = (1.0 - np.abs(n[:, ::-1][:, 1:])) * np.where(n[:, :2] >= 0, 1.0, -1.0)
+        e = np.where(n[:, 2:] < 0, folded, n[:, :2]) * valueRange
+
+        target = MeshQuantizer.octDecode(e / valueRange)
+        best, bestError = None, None
+        for fx in (np.floor, np.ceil):
+            for fy in (np.floor, np.ceil):
+                candidate = np.stack([fx(e[:, 0]), fy(e[:, 1])], axis=1).clip(-valueRange, valueRange)
+                error = -(MeshQuantizer.octDecode(candidate / valueRange) * target).sum(axis=1)
+                if best is None:
+                    best, bestError = candidate, error
+                else:
+                    better = error < bestError
+                    best[better], bestError[better] = candidate[better], error[better]
+        return best
+
+    @staticmethod
+    def octDecode(e):
+        '''Inverse of octEncode for values already scaled back to [-1, 1], same maths as the GLSL octDecode()'''
+        e = np.asarray(e, dtype='f8')
+        n = np.concatenate([e, 1.0 - np.abs(e).sum(axis=1, keepdims=True)], axis=1)
+        t = np.maximum(-n[:, 2:], 0.0)
+        n[:, :2] += np.where(n[:, :2] >= 0, -t, t)
+        return n / np.linalg.norm(n, axis=1, keepdims=True)
+
+    @staticmethod
+    def dequantize(data, bounds, layout='vx vy vz nx ny nz tx ty', normals='oct16'):
+        '''Back to (N, len(layout)) float32, as the vertex shader sees it'''
+        data = np.ascontiguousarray(data)
+        normalType, normalRange = MeshQuantizer.NORMALS[normals]
+        offset, scale = MeshQuantizer.dequantization(bounds)
+        columns, byte = [], 0
+        for group, node, length in MeshQuantizer._nodes(layout, normals):
+            if group == 'vx vy vz':
+                columns.append(offset + data[:, byte:byte + 6].copy().view('i2') * scale)
+            elif group == 'nx ny nz':
+                columns.append(MeshQuantizer.octDecode(data[:, byte:byte + length].copy().view(normalType) / normalRange))
+            else:
+                columns.append(data[:, byte:byte + length].copy().view('f2'))
+            byte += length
+        return np.concatenate(columns, axis=1).astype('f4')
+
+    @staticmethod
+    def error(vertices, data, bounds, layout='vx vy vz nx ny nz tx ty', normals='oct16'):
+        '''Maximum error per group: position (absolute, object units), normal (degrees), UV (absolute)'''
+        vertices = np.asarray(vertices, dtype='f8').reshape(-1, len(layout.split()))
+        decoded = MeshQuantizer.dequantize(data, bounds, layout, normals).astype('f8')
+        errors, column = {}, 0
+        for group in MeshQuantizer._groups(layout):
+            size = len(group.split())
+            a, b = vertices[:, column:column + size], decoded[:, column:column + size]
+            if group == 'nx ny nz':
+                a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-30)
+                errors[group] = np.degrees(np.arccos(np.clip((a * b).sum(axis=1), -1.0, 1.0))).max()
+            else:
+                errors[group] = np.abs(a - b).max()
+            column += size
+        return errors
+
+    @staticmethod
+    def _nodes(layout, normals):
+        '''(group, moderngl format node, byte length) per group; normals=None describes plain float32 data'''
+        groups = MeshQuantizer._groups(layout)
+        nodes = []
+        for i, group in enumerate(groups):
+            size = len(group.split())
+            if normals is None:
+                nodes.append((group, '{}f'.format(size), 4 * size))
+            elif group == 'vx vy vz':
+                # pad to 8 bytes to keep the next attribute 4-byte aligned, unless 2-byte oct8 normals fill the gap
+                packed = normals == 'oct8' and groups[i + 1:i + 2] == ['nx ny nz']
+                nodes.append((group, '3i2' if packed else '3i2 2x', 6 if packed else 8))
+            elif group == 'nx ny nz':
+                normalType = MeshQuantizer.NORMALS[normals][0]
+                nodes.append((group, '2' + normalType, 2 * int(normalType[1])))
+            else:
+                nodes.append((group, '2f2', 4))
+        return nodes
+
+    @staticmethod
+    def _groups(layout):
+        '''Split a layout into position/normal/UV groups, anything else cannot be quantized'''
+        groups, rest = [], ' '.join(layout.split())
+        while rest:
+            group = next((g for g in MeshQuantizer.GROUPS if rest == g or rest.startswith(g + ' ')), None)
+            if group is None:
+                raise ValueError('cannot quantize layout {!r}, expected groups of {}'.format(layout, MeshQuantizer.GROUPS))
+            groups.append(group)
+            rest = rest[len(group):].strip()
+        return groups
+
+if __name__ == '__main__':
+    from Modules.ObjMesh import ObjMesh
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'teapot.obj')
+    layout = 'vx vy vz nx ny nz tx ty'
+    vertices, indices = ObjMesh.open(path).packIndexed(layout)
+    for normals in MeshQuantizer.NORMALS:
+        data, bounds = MeshQuantizer.quantize(vertices, layout, normals)
+        errors = MeshQuantizer.error(vertices, data, bounds, layout, normals)
+        print('{}: {} -> {} bytes per vertex ({}), max error: position {:.2e} (AABB {:.1f}), normal {:.3f} deg, UV {:.2e}'.format(
+            normals, vertices.shape[1] * 4, data.shape[1], MeshQuantizer.format(layout, normals),
+            errors['vx vy vz'], np.abs(bounds[1] - bounds[0]).max(), errors['nx ny nz'], errors['tx ty']))
@@ -0,0 +1,250 @@
+import re
+import numpy as np
+
+RE_COMMENT = re.compile(rb'#[^\n]*')
+RE_INDENT = re.compile(rb'^[ \t]+', flags=re.M)
+
+# line types, classified by the keyword at the start of each line
+OTHER, VERT, TEXT, NORM, FACE = range(5)
+KEYWORDS = bytes.maketrans(b'vtn', b'   ') # blank out 'v', 'vt' and 'vn' so only numbers remain
+FACE_SEPARATORS = bytes.maketrans(b'f/', b'  ')
+
+class ObjMesh():
+    '''
+    Vectorised Wavefront OBJ loader (drop-in replacement for objloader.Obj).
+    The whole file is tokenised in bulk into NumPy arrays:
+        v  - (N,3) float32 positions
+        vn - (N,3) float32 normals
+        vt - (N,2) float32 texture coordinates
+        faces - (T,3,3) int32 triangles, [triangle, corner, (v, vt, vn)],
+                zero-based, -1 where the OBJ face has no vt/vn index
+    Polygons are fan-triangulated. For triangulated files pack() returns
+    exactly the same bytes as objloader.Obj.pack() for the same layout.
+    '''
+    def __init__(self, v, vt, vn, faces):
+        self.v = v
+        self.vn = vn
+        self.vt = vt[:, :2]
+        self.faces = faces
+        self._text = vt # keeps the optional 3rd (w) component for 'tz'
+
+    @staticmethod
+    def open(filename):
+        with open(filename, 'rb') as f:
+            return ObjMesh.frombytes(f.read())
+
+    @staticmethod
+    def frombytes(data):
+        buf = np.frombuffer(data, dtype=np.uint8)
+        starts = np.r_[0, np.flatnonzero(buf == 10) + 1]
+        starts = starts[starts < len(buf)]
+        if np.any((buf[starts] == 32) | (buf[starts] == 9)):
+            # indented lines, the keyword has to be at the start of the line
+            return ObjMesh.frombytes(RE_INDENT.sub(b'', data))
+
+        # classify every line by its keyword
+        first = buf[starts]
+        second = buf[np.minimum(starts + 1, len(buf) - 1)]
+        third = buf[np.minimum(starts + 2, len(buf) - 1)]
+        kinds = np.full(len(starts), OTHER, dtype=np.int8)
+        kinds[(first == 118) & ((second == 32) | (second == 9))] = VERT
+        kinds[(first == 118) & (second == 116) & ((third == 32) | (third == 9))] = TEXT
+        kinds[(first == 118) & (second == 110) & ((third == 32) | (third == 9))] = NORM
+        kinds[(first == 102) & ((second == 32) | (second == 9))] = FACE
+
+        blocks, lines = ObjMesh._blocks(data, starts, kinds)
+        if any(b'#' in block for block in blocks.values()):
+            # comments after data on the same line, strip them first
+            return ObjMesh.frombytes(RE_COMMENT.sub(b'', data))
+        v = ObjMesh._parseFloats(blocks[VERT], lines[VERT], 3)
+        vt = ObjMesh._parseFloats(blocks[TEXT], lines[TEXT], 3)
+        vn = ObjMesh._parseFloats(blocks[NORM], lines[NORM], 3)
+        faces = ObjMesh._parseFaces(blocks[FACE], lines[FACE], (len(v), len(vt), len(vn)))
+        return ObjMesh(v, vt, vn, faces)
+
+    @staticmethod
+    def _blocks(data, starts, kinds):
+        '''Concatenate the lines of each kind; consecutive lines of the same kind are sliced in one go'''
+        ends = np.r_[starts[1:], len(data)]
+        change = np.flatnonzero(np.diff(kinds)) + 1
+        runStarts = np.r_[0, change]
+        runEnds = np.r_[change, len(kinds)]
+        chunks = {kind: [] for kind in (VERT, TEXT, NORM, FACE)}
+        for a, b in zip(runStarts, runEnds):
+            if kinds[a] != OTHER:
+                chunks[kinds[a]].append(data[starts[a]:ends[b - 1]])
+        lines = np.bincount(kinds, minlength=5)
+        return {kind: b''.join(chunk) for kind, chunk in chunks.items()}, lines
+
+    @staticmethod
+    def _parseFloats(text, lines, width):
+        '''Parse "v x y z" style lines into a (N,width) float32 array, missing components are 0.0'''
+        if not lines:
+            return np.zeros((0, width), dtype='f4')
+        # parse as float64 first so rounding to float32 matches struct.pack('f', float(x))
+        flat = ObjMesh._parseFixed(text)
+        if flat is None:
+            flat = np.fromstring(text.translate(KEYWORDS), dtype='f8', sep=' ')
+        if len(flat) == lines * width:
+            return flat.reshape(-1, width).astype('f4')
+        # ragged rows (e.g. 2-component vt or 4-component v): pad or truncate each line
+        out = np.zeros((lines, width), dtype='f8')
+        for i, line in enumerate(text.splitlines()):
+            values = line.split()[1:width + 1]
+            out[i, :len(values)] = [float(x) for x in values]
+        return out.astype('f4')
+
+    @staticmethod
+    def _parseFixed(text):
+        '''
+        Fast path for exporters writing a fixed number of decimals ("%.4f"):
+        integer mantissa / 10**decimals is correctly rounded, i.e. equal to float(x).
+        Returns None when the numbers are not in that format.
+        '''
+        buf = np.frombuffer(text + b' ' * 20, dtype=np.uint8) # padded, so the lookups below stay in range
+        dots = np.flatnonzero(buf == 46)
+        if not len(dots) or b'e' in text or b'E' in text:
+            return None
+        decimals = 0
+        while 48 <= buf[dots[0] + decimals + 1] <= 57:
+            decimals += 1
+        if decimals > 18:
+            return None
+        for i in range(1, decimals + 1):
+            if not np.all(buf[dots + i] - 48 <= 9): # unsigned, anything below '0' wraps around
+                return None
+        if not np.all(buf[dots + decimals + 1] <= 32):
+            return None
+        mantissa = np.fromstring(text.translate(KEYWORDS, b'.'), dtype='i8', sep=' ')
+        if len(mantissa) != len(dots) or np.abs(mantissa).max() >= 2 ** 53:
+            return None # a number without decimals, or too many digits to be exact
+        values = mantissa / 10.0 ** decimals
+        zero = np.flatnonzero(mantissa == 0)
+        if len(zero):
+            # "-0.0000" keeps its sign bit: step back over the integer zeros to find a '-'
+            before = dots[zero] - 1
+            while True:
+                isZero = (before >= 0) & (buf[np.maximum(before, 0)] == 48)
+                if not isZero.any():
+                    break
+                before -= isZero
+            values[zero[(before >= 0) & (buf[np.maximum(before, 0)] == 45)]] = -0.0
+        return values
+
+    @staticmethod
+    def _parseFaces(text, lines, counts):
+        '''Fan-triangulate "f v/t/n ..." lines into a (T,3,3) int32 array of zero-based indices'''
+        if not lines:
+            raise ValueError('OBJ file contains no faces')
+        # the corner format (v, v/t, v//n, v/t/n) is taken from the first face, as in objloader
+        end = text.find(b'\n')
+        corner = text[:end if end >= 0 else len(text)].split()[1]
+        hasText = b'/' in corner and b'//' not in corner
+        hasNorm = corner.count(b'/') == 2
+        slots = [0] + [1] * hasText + [2] * hasNorm
+        comps = len(slots)
+
+        # unsigned parses faster, relative (negative) indices need the signed type
+        relative = b'-' in text
+        idx = np.fromstring(text.translate(FACE_SEPARATORS), dtype='i8' if relative else 'u4', sep=' ')
+        if len(idx) == lines * 3 * comps:
+            corners = np.full(lines, 3)
+        else:
+            # polygons: count the blank-separated tokens on every line, minus the 'f' keyword
+            buf = np.frombuffer(b'\n' + text, dtype=np.uint8)
+            blank = (buf == 32) | (buf == 9) | (buf == 13) | (buf == 10)
+            tokenStarts = np.flatnonzero(~blank[1:] & blank[:-1]) + 1
+            newlines = np.flatnonzero(buf == 10)
+            corners = np.bincount(np.searchsorted(newlines, tokenStarts) - 1, minlength=lines)[:lines] - 1
+            if corners.sum() * comps != len(idx):
+                raise ValueError('inconsistent face format in OBJ file')
+        # OBJ indices are 1-based, negative ones are relative to the end of the list
+        idx = ((idx.astype('i4') if relative else idx.view('i4')) - 1).reshape(-1, comps)
+        if relative:
+            idx = np.where(idx < -1, idx + 1 + np.array(counts, dtype='i4')[slots], idx)
+        if comps == 3:
+            full = idx
+        else:
+            full = np.full((len(idx), 3), -1, dtype='i4')
+            full[:, slots] = idx
+        if (corners == 3).all():
+            return full.reshape(-1, 3, 3)
+
+        # fan triangulation: (first, i, i+1) for i in 1..k-2
+        tris = np.maximum(corners - 2, 0)
+        faceStart = np.cumsum(corners) - corners
+        base = np.repeat(faceStart, tris)
+        step = np.arange(tris.sum()) - np.repeat(np.cumsum(tris) - tris, tris)
+        fan = np.stack([base, base + step + 1, base + step + 2], axis=1)
+        return full[fan]
+
+    def pack(self, layout='vx vy vz tx ty tz nx ny nz'):
+        '''Build the interleaved float32 vertex buffer described by the layout string'''
+        corners = self.faces.reshape(-1, 3)
+        sources = {'v': (self.v, 0), 't': (self._text, 1), 'n': (self.vn, 2)}
+        # group the layout into runs like 'vx vy vz', each one a field gathered as whole rows
+        runs = []
+        for node in layout.split():
+            if not (len(node) == 2 and node[0] in sources and node[1] in 'xyz'):
+                runs.append((float(node), 0, 1)) # constant padding, e.g. 'vx vy vz 0.0'
+                continue
+            source, first = node[0], 'xyz'.index(node[1])
+            if runs and runs[-1][0] == source and runs[-1][1] + runs[-1][2] == first:
+                runs[-1] = (source, runs[-1][1], runs[-1][2] + 1)
+            else:
+                runs.append((source, first, 1))
+        out = np.empty(len(corners), dtype=[('f%d' % i, 'V%d' % (4 * count)) for i, (_, _, count) in enumerate(runs)])
+        for i, (source, first, count) in enumerate(runs):
+            field = out['f%d' % i]
+            if source not in sources:
+                field.view('f4')[:] = source
+                continue
+            array, slot = sources[source]
+            index = corners[:, slot]
+            rows = np.ascontiguousarray(array[:, first:first + count])
+            if len(rows) == 0 or index.min() < 0:
+                # an extra zero row, so index -1 (missing vt/vn) reads 0.0
+                rows = np.vstack([rows, np.zeros((1, count), dtype='f4')])
+            if index.max() >= len(rows):
+                raise IndexError('OBJ face index out of range')
+            # 'wrap' lets take() write straight into the strided field, -1 picks the zero row
+            np.take(rows.view('V%d' % (4 * count)).ravel(), index, out=field, mode='wrap')
+        return out.tobytes()
+
+    def packIndexed(self, layout='vx vy vz tx ty tz nx ny nz'):
+        '''
+        Deduplicated vertex buffer plus index buffer for the layout.
+        Identical vertices (same packed bytes) are merged with one np.unique pass,
+        kept in first-use order; indices are uint16 when the vertex count allows it, otherwise uint32.
+        Returns ((N, len(layout)) float32 vertices, indices)
+        '''
+        width = len(layout.split())
+        soup = np.frombuffer(self.pack(layout), dtype='f4').reshape(-1, width)
+        rows = soup.view(np.dtype((np.void, 4 * width))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        remap = np.empty_like(order)
+        remap[order] = np.arange(len(order))
+        indexType = 'u2' if len(order) < 0xFFFF else 'u4' # 0xFFFF is left free for primitive restart
+        return soup[first[order]], remap[inverse.ravel()].astype(indexType)
+
+if __name__ == '__main__':
+    import os
+    import timeit
+    from objloader import Obj
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'teapot.obj')
+    layout = 'vx vy vz nx ny nz tx ty'
+    objloaderTime = min(timeit.repeat(lambda: Obj.open(path).pack(layout), number=1, repeat=5))
+    objMeshTime = min(timeit.repeat(lambda: ObjMesh.open(path).pack(layout), number=1, repeat=5))
+    identical = ObjMesh.open(path).pack(layout) == Obj.open(path).pack(layout)
+    print('objloader: {:.1f} ms, ObjMesh: {:.1f} ms ({:.1f}x, target 10x), identical: {}'.format(
+        objloaderTime * 1000, objMeshTime * 1000, objloaderTime / objMeshTime, identical))
+
+    mesh = ObjMesh.open(path)
+    soup = mesh.pack(layout)
+    vertices, indices = mesh.packIndexed(layout)
+    print('triangle soup: {} vertices, {} bytes; indexed: {} vertices + {} {} indices, {} bytes'.format(
+        len(soup) // (4 * len(layout.split())), len(soup), len(vertices), len(indices), indices.dtype,
+        vertices.nbytes + indices.nbytes))
+    print('indexed mesh matches soup:', vertices[indices].tobytes() == soup)
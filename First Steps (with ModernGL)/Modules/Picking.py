@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import numpy as np
+if __name__ == '__main__': # python Modules/Picking.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.BVH import BVH
+
+class MeshBVH():
+    '''
+    Ray queries against the triangles of one mesh, in object space:
+        meshBVH = MeshBVH(positions, indices) - (N, 3) positions, (T, 3) corner indices (None for a plain triangle list)
+        triangle, barycentrics, distance = meshBVH.raycast(origin, direction)
+    A BVH over the triangle AABBs gives the candidate triangles along the ray, Moller-Trumbore then tests
+    them all at once. barycentrics are the weights of the triangle's three corners, -1 / None / inf for a miss.
+    '''
+    def __init__(self, positions, indices=None, leafSize=4):
+        positions = np.asarray(positions, dtype='f4').reshape(-1, 3)
+        indices = np.arange(len(positions)) if indices is None else np.asarray(indices)
+        corners = positions[indices.reshape(-1, 3).astype('i8')] # (T, 3 corners, 3)
+        self.a = np.ascontiguousarray(corners[:, 0])
+        self.edge1 = corners[:, 1] - corners[:, 0]
+        self.edge2 = corners[:, 2] - corners[:, 0]
+        self.bvh = BVH(corners.min(axis=1), corners.max(axis=1), leafSize)
+        self.bounds = np.array([positions.min(axis=0), positions.max(axis=0)], dtype='f4')
+
+    def __len__(self):
+        return len(self.a)
+
+    def raycast(self, origin, direction, maxDistance=np.inf):
+        origin = np.asarray(origin, dtype='f4').reshape(3)
+        direction = np.asarray(direction, dtype='f4').reshape(3)
+        ids = self.bvh.rayCandidates(origin, BVH.inverseDirection(direction), maxDistance)
+        if not len(ids):
+            return -1, None, np.inf
+        t, u, v = MeshBVH.intersect(origin, direction, self.a[ids], self.edge1[ids], self.edge2[ids])
+        t[t > maxDistance] = np.inf
+        nearest = int(t.argmin())
+        if not np.isfinite(t[nearest]):
+            return -1, None, np.inf
+        return int(ids[nearest]), np.array([1.0 - u[nearest] - v[nearest], u[nearest], v[nearest]], dtype='f4'), float(t[nearest])
+
+    @staticmethod
+    def intersect(origin, direction, a, edge1, edge2, epsilon=1e-9):
+        '''
+        Moller-Trumbore for one ray and (N, 3) triangles (corner a and the edges to the other two corners).
+        Returns (t, u, v) arrays, t is inf where the ray misses; both faces are hit.
+        '''
+        dx, dy, dz = direction
+        e1x, e1y, e1z = edge1[:, 0], edge1[:, 1], edge1[:, 2]
+        e2x, e2y, e2z = edge2[:, 0], edge2[:, 1], edge2[:, 2]
+        px, py, pz = dy * e2z - dz * e2y, dz * e2x - dx * e2z, dx * e2y - dy * e2x # direction x edge2
+        det = e1x * px + e1y * py + e1z * pz
+        parallel = np.abs(det) < epsilon
+        inverse = 1.0 / np.where(parallel, 1.0, det)
+        sx, sy, sz = origin[0] - a[:, 0], origin[1] - a[:, 1], origin[2] - a[:, 2]
+        u = (sx * px + sy * py + sz * pz) * inverse
+        qx, qy, qz = sy * e1z - sz * e1y, sz * e1x - sx * e1z, sx * e1y - sy * e1x # (origin - a) x edge1
+        v = (dx * qx + dy * qy + dz * qz) * inverse
+        t = (e2x * qx + e2y * qy + e2z * qz) * inverse
+        t[parallel | (u < 0) | (v < 0) | (u + v > 1) | (t < 0)] = np.inf
+        return t, u, v
+
+class Picker():
+    '''
+    Selects what is under a screen point among meshes placed in the world:
+        picker = Picker()
+        objectId = picker.add(MeshBVH(positions, indices), model) - model: pyrr model matrix, updated with setModel()
+        objectId, triangle, barycentrics, distance = picker.pick(x, y, window) - window coordinates, origin bottom left
+    pick() unprojects the point with the inverse view-projection of a ViewportFP (or of any projection * view
+    given to unproject()) into a world ray from the near plane. The ray is tested against the world AABBs of
+    all objects in one go, then the objects it enters are cast at nearest box first, each through its MeshBVH
+    with the ray in object space (setModel() keeps the inverse model ready), so the distance is the same in
+    both spaces. Misses return (-1, -1, None, inf).
+    '''
+    def __init__(self):
+        self.meshes = []
+        self.models = []
+        self.inverses = [] # world to object space: (3, 3) linear part and translation, float32
+        self.lower = np.zeros((0, 3), dtype='f4') # world AABBs, one row per object
+        self.upper = np.zeros((0, 3), dtype='f4')
+        self.lastTime = 0.0 # seconds spent in the last raycast()
+
+    def add(self, meshBVH, model=None):
+        self.meshes.append(meshBVH)
+        self.models.append(None)
+        self.inverses.append(None)
+        self.lower = np.vstack([self.lower, np.zeros((1, 3), dtype='f4')])
+        self.upper = np.vstack([self.upper, np.zeros((1, 3), dtype='f4')])
+        self.setModel(len(self.meshes) - 1, np.identity(4) if model is None else model)
+        return len(self.meshes) - 1
+
+    def setModel(self, objectId, model):
+        model = np.asarray(model, dtype='f8')
+        lower, upper = self.meshes[objectId].bounds
+        corners = np.array([[x, y, z, 1.0] for x in (lower[0], upper[0]) for y in (lower[1], upper[1]) for z in (lower[2], upper[2])]) @ model
+        inverse = np.linalg.inv(model) # pyrr is row-major: object = world @ inverse
+        self.models[objectId] = model
+        self.inverses[objectId] = (inverse[:3, :3].astype('f4'), inverse[3, :3].astype('f4'))
+        self.lower[objectId] = corners[:, :3].min(axis=0)
+        self.upper[objectId] = corners[:, :3].max(axis=0)
+
+    @staticmethod
+    def unproject(x, y, width, height, viewProjection):
+        '''World space (origin, unit direction) of the ray through window point x, y, starting on the near plane'''
+        ndc = 2.0 * x / width - 1.0, 2.0 * y / height - 1.0
+        inverse = np.linalg.inv(np.asarray(viewProjection, dtype='f8')) # pyrr is row-major: world = clip @ inverse
+        near, far = np.array([[ndc[0], ndc[1], -1.0, 1.0], [ndc[0], ndc[1], 1.0, 1.0]]) @ inverse
+        near, far = near[:3] / near[3], far[:3] / far[3]
+        direction = far - near
+        return near, direction / np.linalg.norm(direction)
+
+    def pick(self, x, y, window):
+        origin, direction = Picker.unproject(x, y, window.width, window.height, window.getViewProjectionMatrix())
+        return self.raycast(origin, direction)
+
+    def raycast(self, origin, direction, maxDistance=np.inf):
+        '''(object id, triangle, barycentrics, distance) of the nearest triangle hit by a world space ray'''
+        start = time.perf_counter()
+        best = (-1, -1, None, np.inf)
+        origin = np.asarray(origin, dtype='f4').reshape(3)
+        direction = np.asarray(direction, dtype='f4').reshape(3)
+        entry, exit = BVH.slabs(origin, BVH.inverseDirection(direction), self.lower, self.upper)
+        entry[(entry > exit) | (entry > maxDistance)] = np.inf
+        for objectId in np.argsort(entry):
+            if not entry[objectId] < best[3]: # the boxes left start behind the nearest hit, or are missed
+                break
+            linear, translation = self.inverses[objectId]
+            triangle, barycentrics, distance = self.meshes[objectId].raycast(origin @ linear + translation,
+                direction @ linear, min(best[3], maxDistance))
+            if triangle >= 0:
+                best = (int(objectId), triangle, barycentrics, distance)
+        self.lastTime = time.perf_counter() - start
+        return best
+
+if __name__ == '__main__':
+    import tempfile
+    from pyrr import Matrix44
+    from Modules.MeshCache import MeshCache
+    from Modules.MeshQuantizer import MeshQuantizer
+    from Modules.functions import Math
+
+    layout = 'vx vy vz nx ny nz tx ty'
+    source = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'teapot.obj')
+    mesh = MeshCache.load(source, layout, cacheDir=tempfile.mkdtemp(), indexed=True, optimize=True, quantize='oct16') # as 09 loads it
+    positions = MeshQuantizer.dequantize(mesh.vertices, mesh.bounds, layout, mesh.quantize)[:, :3] # what the vertex shader sees
+    indices = np.asarray(mesh.indices).reshape(-1, 3)
+    start = time.perf_counter()
+    teapot = MeshBVH(positions, indices)
+    print('teapot: {} triangles, BVH built in {:.1f} ms'.format(len(teapot), (time.perf_counter() - start) * 1000))
+
+    # the scene of 09: the teapot in front of the camera, pick across a grid of window points
+    picker = Picker()
+    model = Math.buildTransMatrix(pos=[0, -1.0, -4.0], rot=[0, 30, 0], scale=[0.01, 0.01, 0.01])
+    picker.add(teapot, model)
+    viewProjection = Matrix44.perspective_projection(45.0, 1280 / 720, 0.1, 1000.0) * Matrix44.look_at([0.0, 0.0, 0.0], [0.0, 0.0, -1.0], [0.0, 1.0, 0.0])
+    world = np.hstack([positions, np.ones((len(positions), 1))]) @ np.asarray(model)
+    worldA, worldB, worldC = (world[indices[:, corner], :3] for corner in range(3))
+    timings, bruteTimings, hits, agree = [], [], 0, 0
+    for x in np.linspace(340, 940, 13):
+        for y in np.linspace(110, 610, 11):
+            origin, direction = Picker.unproject(x, y, 1280, 720, viewProjection)
+            pickTimes = []
+            for repeat in range(3):
+                objectId, triangle, barycentrics, distance = picker.raycast(origin, direction)
+                pickTimes.append(picker.lastTime)
+            timings.append(min(pickTimes)) # best of three, so a scheduler hiccup does not count as the worst pick
+            start = time.perf_counter() # every triangle in world space
+            t, u, v = MeshBVH.intersect(origin, direction, worldA, worldB - worldA, worldC - worldA)
+            bruteTimings.append(time.perf_counter() - start)
+            if objectId >= 0:
+                hits += 1
+                point = origin + direction * distance
+                corners = np.array([worldA[triangle], worldB[triangle], worldC[triangle]])
+                agree += abs(t.min() - distance) < 1e-3 and np.allclose(barycentrics @ corners, point, atol=1e-3)
+            else:
+                agree += not np.isfinite(t).any()
+    print('{} picks, {} hits: {:.3f} ms mean, {:.3f} ms max, target 1 ms (every triangle {:.2f} ms), agrees with every triangle: {} of {}'.format(
+        len(timings), hits, np.mean(timings) * 1000, np.max(timings) * 1000, np.mean(bruteTimings) * 1000, agree, len(timings)))
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import contextlib
+from collections import deque
+import numpy as np
+import moderngl
+if __name__ == '__main__': # python Modules/Profiler.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Profiler():
+    '''
+    CPU and GPU time of the logical passes of a frame:
+        profiler = Profiler(ctx)
+        with profiler.span('box'): - around each pass, spans cannot be nested (one GL time query at a time)
+            drawBox()
+        profiler.endFrame() - once per frame, after the last pass
+        profiler.stats() - rolling mean/max in milliseconds over the last history frames
+        profiler.writeTrace(path) - Chrome trace (chrome://tracing, ui.perfetto.dev) of the last traceFrames frames
+        window.push_handlers(profiler) - F1 toggles the overlay, F2 writes the trace to traceFile (ViewportFP does this for window.profiler)
+    CPU time is perf_counter() around the span, GPU time a ctx.query(time=True) around the same calls.
+    Queries are kept in latency sets used round robin, a frame's results are read when its set comes round
+    again (latency - 1 frames later), by then the GPU has finished with them and reading does not stall.
+    With overlay = True, endFrame() draws a bar per pass in the top left corner: CPU above, GPU below,
+    the full width is budget seconds; text() gives the same numbers as one line, e.g. for a window caption.
+    '''
+    CPU_COLOUR = (0.3, 0.6, 1.0)
+    GPU_COLOUR = (1.0, 0.6, 0.2)
+    MAX_BARS = 32
+
+    def __init__(self, ctx, history=120, latency=3, budget=1 / 60, traceFrames=600):
+        self.ctx = ctx
+        self.history = history
+        self.latency = latency
+        self.budget = budget
+        self.queries = [[] for _ in range(latency)] # per set, one query per span of the frame
+        self.pending = [None] * latency # per set: (frame start, frame end, [(name, start, cpu seconds)]) waiting for the GPU
+        self.slot = 0
+        self.spans = [] # this frame
+        self.current = None # name of the open span
+        self.frameStart = None
+        self.origin = time.perf_counter()
+        self.samples = {} # name -> deque of (cpu, gpu) seconds, 'frame' for whole frames
+        self.events = deque(maxlen=traceFrames) # per frame, Chrome trace events
+        self.frames = 0
+        self.overlay = False
+        self.traceFile = 'profile_trace.json'
+        self.prog = None # overlay program, vertex buffer and vertex array, built on first use
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if self.current is not None:
+            raise RuntimeError("Profiler span '{}' opened inside '{}'".format(name, self.current))
+        queries = self.queries[self.slot]
+        if len(queries) == len(self.spans):
+            queries.append(self.ctx.query(time=True))
+        query = queries[len(self.spans)]
+        self.current = name
+        start = time.perf_counter()
+        if self.frameStart is None:
+            self.frameStart = start
+        try:
+            with query:
+                yield
+        finally:
+            self.spans.append((name, start, time.perf_counter() - start))
+            self.current = None
+
+    def endFrame(self):
+        '''Hand this frame's queries to the GPU and collect the frame issued latency - 1 frames ago'''
+        now = time.perf_counter()
+        self.pending[self.slot] = (self.frameStart if self.frameStart is not None else now, now, self.spans)
+        self.slot = (self.slot + 1) % self.latency
+        if self.pending[self.slot] is not None:
+            self._collect(self.queries[self.slot], *self.pending[self.slot])
+            self.pending[self.slot] = None
+        self.spans = []
+        self.frameStart = now # the next frame starts where this one ended
+        if self.overlay:
+            self.drawOverlay()
+
+    def _collect(self, queries, frameStart, frameEnd, spans):
+        events = []
+        passes = {}
+        gpuTime = frameStart # GPU spans are laid out in submission order from the frame start
+        for query, (name, start, cpu) in zip(queries, spans):
+            elapsed = query.elapsed
+            gpu = elapsed / 1e9 if elapsed < 2 ** 31 else 0.0 # read as 32 bit unsigned, some drivers report slightly negative times
+            total = passes.get(name, (0.0, 0.0))
+            passes[name] = (total[0] + cpu, total[1] + gpu)
+            gpuTime = max(gpuTime, start)
+            events.append(self._event(name, start, cpu, 0))
+            events.append(self._event(name, gpuTime, gpu, 1))
+            gpuTime += gpu
+        passes['frame'] = (frameEnd - frameStart, sum(gpu for cpu, gpu in passes.values()))
+        for name, sample in passes.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.history)
+            self.samples[name].append(sample)
+        self.events.append(events)
+        self.frames += 1
+
+    def _event(self, name, start, duration, thread):
+        return {'name': name, 'cat': ('cpu', 'gpu')[thread], 'ph': 'X', 'pid': 0, 'tid': thread,
+                'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6}
+
+    def stats(self):
+        '''{pass: {'cpu', 'cpuMax', 'gpu', 'gpuMax'}} in milliseconds, 'frame' is the whole frame'''
+        stats = {}
+        for name, samples in self.samples.items():
+            ms = np.array(samples, dtype='f8') * 1000
+            stats[name] = {'cpu': ms[:, 0].mean(), 'cpuMax': ms[:, 0].max(), 'gpu': ms[:, 1].mean(), 'gpuMax': ms[:, 1].max()}
+        return stats
+
+    def text(self):
+        '''One line summary of the means, e.g. "clear 0.02/0.01 | mesh 0.40/1.90 | frame 1.20/1.91 ms cpu/gpu"'''
+        return ' | '.join('{} {:.2f}/{:.2f}'.format(name, s['cpu'], s['gpu']) for name, s in self.stats().items()) + ' ms cpu/gpu'
+
+    def writeTrace(self, path):
+        threads = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': name}} for tid, name in enumerate(('CPU', 'GPU'))]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': threads + [event for events in self.events for event in events], 'displayTimeUnit': 'ms'}, f)
+
+    def on_key_press(self, symbol, modifiers):
+        '''pyglet key handler, keys other than F1 and F2 go on to the window's own handlers'''
+        from pyglet.window import key
+        if symbol == key.F1: # PROFILER OVERLAY
+            self.overlay = not self.overlay
+        if symbol == key.F2: # PROFILER TRACE
+            self.writeTrace(self.traceFile)
+            print('trace of the last {} frames written to {}'.format(len(self.events), self.traceFile))
+
+    def drawOverlay(self):
+        '''Bars of the rolling means into the bound framebuffer, drawn at the near plane so depth testing keeps them on top'''
+        if self.prog is None:
+            self.prog = self.ctx.program(vertex_shader='''
+                # version 330 core
+                in vec2 in_vert;
+                in vec3 in_colour;
+                out vec3 colour;
+                void main() { gl_Position = vec4(in_vert, -1.0, 1.0); colour = in_colour; }
+                ''', fragment_shader='''
+                # version 330 core
+                in vec3 colour;
+                out vec4 fragColour;
+                void main() { fragColour = vec4(colour, 1.0); }
+                ''')
+            self.vbo = self.ctx.buffer(reserve=Profiler.MAX_BARS * 6 * 5 * 4)
+            self.vao = self.ctx.vertex_array(self.prog, [(self.vbo, '2f 3f', 'in_vert', 'in_colour')])
+        bars = [(-0.98 + 0.5, 0.98, 0.003, 0.04 * len(self.samples), (0.8, 0.8, 0.8))] # budget marker
+        for row, (name, s) in enumerate(self.stats().items()):
+            top = 0.98 - 0.04 * row
+            bars.append((-0.98, top, min(s['cpu'] / 1000 / self.budget * 0.5, 1.96), 0.015, Profiler.CPU_COLOUR))
+            bars.append((-0.98, top - 0.017, min(s['gpu'] / 1000 / self.budget * 0.5, 1.96), 0.015, Profiler.GPU_COLOUR))
+        bars = bars[:Profiler.MAX_BARS]
+        vertices = np.array([[[x + w * dx, y - h * dy, *colour] for dx, dy in ((0, 1), (1, 1), (1, 0), (0, 1), (1, 0), (0, 0))]
+                             for x, y, w, h, colour in bars], dtype='f4')
+        self.vbo.write(vertices)
+        self.vao.render(moderngl.TRIANGLES, vertices=6 * len(bars))
+
+    def release(self):
+        self.queries = [[] for _ in range(self.latency)] # moderngl has no Query.release(), they go with the context
+        if self.prog is not None:
+            self.vao.release()
+            self.vbo.release()
+            self.prog.release()
+
+if __name__ == '__main__':
+    import tempfile
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    fbo = ctx.simple_framebuffer((640, 360))
+    fbo.use()
+    prog = ctx.program(vertex_shader='''
+        # version 330 core
+        in vec2 in_vert;
+        void main() { gl_Position = vec4(in_vert, 0.0, 1.0); }
+        ''', fragment_shader='''
+        # version 330 core
+        uniform int iterations;
+        out vec4 fragColour;
+        void main()
+        {
+            float x = gl_FragCoord.x;
+            for (int i = 0; i < iterations; i++) x = fract(sin(x) * 43758.5);
+            fragColour = vec4(x);
+        }
+        ''')
+    quad = ctx.vertex_array(prog, [(ctx.buffer(np.array([-1, -1, 1, -1, -1, 1, -1, 1, 1, -1, 1, 1], dtype='f4')), '2f', 'in_vert')])
+    prog['iterations'].value = 16
+
+    # a GPU heavy pass and a CPU heavy pass: each shows up on its own side
+    profiler = Profiler(ctx, history=60)
+    profiler.overlay = True
+    start = time.perf_counter()
+    for frame in range(60):
+        with profiler.span('clear'):
+            ctx.clear(0.1, 0.1, 0.1)
+        with profiler.span('shader'):
+            quad.render(moderngl.TRIANGLES)
+        with profiler.span('maths'):
+            np.linalg.inv(np.random.rand(64, 64, 4, 4))
+        profiler.endFrame()
+    ctx.finish()
+    print('60 frames in {:.1f} ms, {} collected (latency {})'.format((time.perf_counter() - start) * 1000, profiler.frames, profiler.latency))
+    for name, s in profiler.stats().items():
+        print('{:<7} cpu {:6.3f} ms (max {:6.3f})  gpu {:6.3f} ms (max {:6.3f})'.format(name, s['cpu'], s['cpuMax'], s['gpu'], s['gpuMax']))
+    print(profiler.text())
+    pixels = np.frombuffer(fbo.read(), dtype='u1').reshape(360, 640, 3)[::-1]
+    print('overlay drawn:', bool((pixels[:20, :20] == [76, 153, 255]).all(axis=2).any()))
+    path = os.path.join(tempfile.gettempdir(), 'profiler_trace.json')
+    profiler.writeTrace(path)
+    with open(path) as f:
+        print('{} trace events in {}'.format(len(json.load(f)['traceEvents']), path))
+    try:
+        with profiler.span('outer'):
+            with profiler.span('inner'):
+                pass
+    except RuntimeError as error:
+        print('nested span:', error)
+    profiler.release()
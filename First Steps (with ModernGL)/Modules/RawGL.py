@@ -0,0 +1,76 @@
+import ctypes
+import numpy as np
+
+class RawGL():
+    '''
+    The texture calls moderngl 5 does not wrap: defining single mip levels, compressed uploads, other parameters.
+    They are loaded from the current context with moderngl's own function loader. The texture is bound
+    to the last texture unit first, the one moderngl itself uses for writes, so no shader binding changes.
+    '''
+    TEXTURE_2D = 0x0DE1
+    TEXTURE_MAX_LEVEL = 0x813D
+    TEXTURE_WRAP_S = 0x2802
+    TEXTURE_WRAP_T = 0x2803
+    MIRRORED_REPEAT = 0x8370
+    RGBA = 0x1908
+    RGBA8 = 0x8058
+    UNSIGNED_BYTE = 0x1401
+    functions = {}
+
+    @staticmethod
+    def function(name, *argtypes):
+        if name not in RawGL.functions:
+            from _moderngl import DefaultLoader # ships with moderngl, finds the WGL/EGL/GLX/CGL context that is current
+            address = DefaultLoader().load_opengl_function(name)
+            if not address:
+                raise RuntimeError('{} is not available in this OpenGL context'.format(name))
+            prototype = getattr(ctypes, 'WINFUNCTYPE', ctypes.CFUNCTYPE)(None, *argtypes)
+            RawGL.functions[name] = prototype(address)
+        return RawGL.functions[name]
+
+    @staticmethod
+    def bind(texture):
+        texture.use(texture.ctx.info['GL_MAX_COMBINED_TEXTURE_IMAGE_UNITS'] - 1)
+
+    @staticmethod
+    def image(texture, level, size, internalFormat=None, data=None, nbytes=0):
+        '''Define a mip level: RGBA8 pixels, or nbytes of compressed blocks for a compressed internal format; data None only allocates'''
+        RawGL.bind(texture)
+        pointer = None if data is None else data.ctypes.data
+        u, i, p = ctypes.c_uint, ctypes.c_int, ctypes.c_void_p
+        if internalFormat is None:
+            RawGL.function('glTexImage2D', u, i, i, i, i, i, u, u, p)(
+                RawGL.TEXTURE_2D, level, RawGL.RGBA8, size[0], size[1], 0, RawGL.RGBA, RawGL.UNSIGNED_BYTE, pointer)
+        else:
+            RawGL.function('glCompressedTexImage2D', u, i, u, i, i, i, i, p)(
+                RawGL.TEXTURE_2D, level, internalFormat, size[0], size[1], 0, nbytes, pointer)
+
+    @staticmethod
+    def write(texture, level, viewport, internalFormat, data):
+        '''
+        Part of a defined level (moderngl's write() refuses levels it did not allocate itself).
+        For compressed levels x, y, width and height are multiples of 4, unless they reach the edge.
+        '''
+        RawGL.bind(texture)
+        u, i, p = ctypes.c_uint, ctypes.c_int, ctypes.c_void_p
+        if internalFormat is None:
+            RawGL.function('glTexSubImage2D', u, i, i, i, i, i, u, u, p)(
+                RawGL.TEXTURE_2D, level, viewport[0], viewport[1], viewport[2], viewport[3], RawGL.RGBA, RawGL.UNSIGNED_BYTE, data.ctypes.data)
+        else:
+            RawGL.function('glCompressedTexSubImage2D', u, i, i, i, i, i, u, i, p)(
+                RawGL.TEXTURE_2D, level, viewport[0], viewport[1], viewport[2], viewport[3], internalFormat, data.nbytes, data.ctypes.data)
+
+    @staticmethod
+    def read(texture, level, size):
+        '''(height, width, 4) uint8 pixels of a level, compressed ones decoded by the driver'''
+        RawGL.bind(texture)
+        pixels = np.empty((size[1], size[0], 4), dtype='u1')
+        RawGL.function('glGetTexImage', ctypes.c_uint, ctypes.c_int, ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p)(
+            RawGL.TEXTURE_2D, level, RawGL.RGBA, RawGL.UNSIGNED_BYTE, pixels.ctypes.data)
+        return pixels
+
+    @staticmethod
+    def parameter(texture, name, value):
+        '''glTexParameteri, e.g. parameter(texture, RawGL.TEXTURE_WRAP_S, RawGL.MIRRORED_REPEAT)'''
+        RawGL.bind(texture)
+        RawGL.function('glTexParameteri', ctypes.c_uint, ctypes.c_uint, ctypes.c_int)(RawGL.TEXTURE_2D, name, value)
\ No newline at end of file
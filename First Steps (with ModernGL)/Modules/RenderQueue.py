@@ -0,0 +1,313 @@
+import os
+import sys
+import numpy as np
+import moderngl
+if __name__ == '__main__': # python Modules/RenderQueue.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.UniformCache import UniformCache
+
+class StateCache():
+    '''
+    The GL state the render queue last set, so binds that would not change anything are skipped:
+        state.useProgram(prog) - counts a switch when the program differs from the previous draw's
+        state.bindTexture(unit, texture) - moderngl textures, or handles with resolve() (ManagedTexture, TextureLOD)
+        state.invalidate() - after binding textures outside the queue
+    Programs and textures are compared as objects, not by GL name: released names are reused by new objects.
+    moderngl binds the program inside every render() call, so program switches are counted, not skipped;
+    what sorting saves there is the driver's work of changing programs.
+    '''
+    def __init__(self):
+        self.program = None
+        self.units = {} # texture unit -> the bound texture
+        self.programSwitches = 0
+        self.textureBinds = 0
+        self.bindsSkipped = 0
+
+    def useProgram(self, prog):
+        if prog is not self.program:
+            self.program = prog
+            self.programSwitches += 1
+
+    def bindTexture(self, unit, texture):
+        if hasattr(texture, 'resolve'):
+            texture = texture.resolve() # the variant/fallback bound this frame, marked as used
+        if self.units.get(unit) is texture:
+            self.bindsSkipped += 1
+            return
+        texture.use(unit)
+        self.units[unit] = texture
+        self.textureBinds += 1
+
+    def invalidate(self):
+        self.program = None
+        self.units.clear()
+
+class RenderQueue():
+    '''
+    Collects the draws of a frame, sorts them by state and merges them into as few draw calls as possible:
+        queue = RenderQueue(ctx)
+        material = queue.material(prog, textures=[(0, tex1), (1, tex2)], uniforms={'material.shininess': 32.0})
+        mesh = queue.mesh(vao) - or queue.mesh(vao, instanceBuffer, width) for a vao with per-instance attributes
+        queue.submit(mesh, material, depth=..., uniforms={'model': model}) - per draw uniforms, never batched
+        queue.submit(mesh, material, depth=..., instance=row) - width float32 per-instance values, batchable
+        queue.flush() - sorts, binds and draws everything submitted, returns this frame's stats()
+    Every item gets a 64 bit sort key, most significant first:
+        pass (4 bits) | program (12) | texture set (16) | mesh (12) | depth (20)
+    which limits a queue to 16 passes, 4096 programs, 65536 texture sets and 4096 meshes (ValueError beyond).
+    so items are grouped by program, then textures, then mesh, and drawn front to back within a group (back to
+    front in the passes listed in backToFront, e.g. a transparent pass); depth is the view distance, quantized
+    over [0, far]. One NumPy argsort orders the frame. Runs of consecutive instance items with the same mesh and
+    material become one instanced draw: their rows are gathered into the mesh's instance buffer.
+    Texture binds and program switches go through a StateCache that lives across frames, material and per draw
+    uniforms through a UniformCache per program.
+    '''
+    PASS_BITS, PROGRAM_BITS, TEXTURE_BITS, MESH_BITS, DEPTH_BITS = 4, 12, 16, 12, 20
+
+    def __init__(self, ctx, far=1000.0, backToFront=(), capacity=1024):
+        self.ctx = ctx
+        self.far = far
+        self.backToFront = set(backToFront)
+        self.state = StateCache()
+        self.programs = {} # program -> program id
+        self.textureSets = {} # ((unit, texture), ...) -> texture set id
+        self.materials = [] # (prog, textures, uniforms, key bits, back to front)
+        self.meshes = [] # (vao, mode, instance buffer, width)
+        self.instanceData = [] # per mesh: (capacity, width) float32 rows submitted this frame
+        self.instanceCount = [] # per mesh: rows used this frame
+        self.uniformCaches = {} # program -> UniformCache
+        self.count = 0
+        self._allocate(capacity)
+        self.frames = 0
+        self.last = {} # stats() of the last flush
+
+    def _allocate(self, capacity):
+        arrays = {'keys': 'u8', 'meshIds': 'i4', 'materialIds': 'i4', 'rows': 'i4', 'single': '?'} # rows: instance row or -1
+        for name, dtype in arrays.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if self.count:
+                array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+        self.uniforms = (self.uniforms[:self.count] if self.count else []) + [None] * (capacity - self.count)
+
+    def material(self, prog, textures=(), uniforms=None, renderPass=0):
+        '''textures: [(unit, texture)], uniforms: {name: value} written whenever the material is bound'''
+        textures = tuple(sorted(textures, key=lambda binding: binding[0]))
+        bindings = tuple((unit, id(texture)) for unit, texture in textures) # the material keeps the textures alive, ids stay unique
+        RenderQueue._checkField('render pass', renderPass, RenderQueue.PASS_BITS)
+        RenderQueue._checkField('program', self.programs.get(prog, len(self.programs)), RenderQueue.PROGRAM_BITS)
+        RenderQueue._checkField('texture set', self.textureSets.get(bindings, len(self.textureSets)), RenderQueue.TEXTURE_BITS)
+        programId = self.programs.setdefault(prog, len(self.programs))
+        textureSet = self.textureSets.setdefault(bindings, len(self.textureSets))
+        if prog not in self.uniformCaches:
+            self.uniformCaches[prog] = UniformCache(prog)
+        key = (renderPass << 60) | (programId << 48) | (textureSet << 32)
+        self.materials.append((prog, textures, dict(uniforms or {}), key, renderPass in self.backToFront))
+        return len(self.materials) - 1
+
+    def mesh(self, vao, instanceBuffer=None, width=0, mode=moderngl.TRIANGLES):
+        '''vao drawn with render(mode), instanceBuffer holds width float32 per instance for batched submits'''
+        RenderQueue._checkField('mesh', len(self.meshes), RenderQueue.MESH_BITS)
+        self.meshes.append((vao, mode, instanceBuffer, width))
+        self.instanceData.append(np.zeros((64 if instanceBuffer is not None else 0, width), dtype='f4'))
+        self.instanceCount.append(0)
+        return len(self.meshes) - 1
+
+    @staticmethod
+    def _checkField(name, value, bits):
+        if not 0 <= value < 1 << bits:
+            raise ValueError('{} {} does not fit the {} bits of the sort key'.format(name, value, bits))
+
+    def submit(self, mesh, material, depth=0.0, uniforms=None, instance=None):
+        if self.count == len(self.keys):
+            self._allocate(2 * len(self.keys))
+        prog, textures, materialUniforms, key, reverse = self.materials[material]
+        depth = min(max(depth / self.far, 0.0), 1.0)
+        depthBits = int((1.0 - depth if reverse else depth) * ((1 << RenderQueue.DEPTH_BITS) - 1))
+        i = self.count
+        self.keys[i] = key | (mesh << RenderQueue.DEPTH_BITS) | depthBits
+        self.meshIds[i] = mesh
+        self.materialIds[i] = material
+        self.uniforms[i] = uniforms
+        self.single[i] = instance is None or uniforms is not None # a draw of its own
+        if instance is not None:
+            data, row = self.instanceData[mesh], self.instanceCount[mesh]
+            if row == len(data):
+                data = self.instanceData[mesh] = np.concatenate([data, np.zeros_like(data)])
+            data[row] = instance
+            self.instanceCount[mesh] = row + 1
+            self.rows[i] = row
+        else:
+            self.rows[i] = -1
+        self.count += 1
+
+    def flush(self):
+        '''Draw everything submitted since the last flush, returns its stats()'''
+        state = self.state
+        switches, binds, skipped = state.programSwitches, state.textureBinds, state.bindsSkipped
+        count, drawCalls, instances = self.count, 0, 0
+        if count:
+            order = np.argsort(self.keys[:count], kind='stable')
+            meshIds, materialIds, rows, single = self.meshIds[order], self.materialIds[order], self.rows[order], self.single[order]
+            boundaries = np.flatnonzero((meshIds[1:] != meshIds[:-1]) | (materialIds[1:] != materialIds[:-1]) | single[1:] | single[:-1]) + 1
+            starts = np.concatenate([[0], boundaries])
+            ends = np.concatenate([boundaries, [count]])
+            current = None
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                material = int(materialIds[start])
+                prog, textures, materialUniforms, key, reverse = self.materials[material]
+                uniforms = self.uniformCaches[prog]
+                if material != current:
+                    current = material
+                    state.useProgram(prog)
+                    for unit, texture in textures:
+                        state.bindTexture(unit, texture)
+                    for name, value in materialUniforms.items():
+                        uniforms.write(name, value)
+                vao, mode, instanceBuffer, width = self.meshes[meshIds[start]]
+                if single[start]:
+                    for name, value in (self.uniforms[order[start]] or {}).items():
+                        uniforms.write(name, value)
+                    if rows[start] >= 0:
+                        instanceBuffer.write(self.instanceData[meshIds[start]][rows[start]])
+                        vao.render(mode, instances=1)
+                    else:
+                        vao.render(mode)
+                    instances += 1
+                else:
+                    batch = self.instanceData[meshIds[start]][rows[start:end]] # gathered in draw order
+                    instanceBuffer.orphan(max(batch.nbytes, instanceBuffer.size))
+                    instanceBuffer.write(batch)
+                    vao.render(mode, instances=end - start)
+                    instances += end - start
+                drawCalls += 1
+        self.last = {'items': count, 'drawCalls': drawCalls, 'instances': instances, 'programSwitches': state.programSwitches - switches,
+                     'textureBinds': state.textureBinds - binds, 'bindsSkipped': state.bindsSkipped - skipped}
+        self.uniforms[:count] = [None] * count
+        self.count = 0
+        self.instanceCount = [0] * len(self.meshes)
+        self.frames += 1
+        return self.last
+
+    def stats(self):
+        '''Counts of the last flush: items, drawCalls, instances, programSwitches, textureBinds, bindsSkipped'''
+        return self.last
+
+    def text(self):
+        s = self.last
+        return '{} items in {} draw calls, {} program switches, {} texture binds ({} skipped)'.format(
+            s.get('items', 0), s.get('drawCalls', 0), s.get('programSwitches', 0), s.get('textureBinds', 0), s.get('bindsSkipped', 0))
+
+if __name__ == '__main__':
+    import time
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    fbo = ctx.simple_framebuffer((320, 320))
+    fbo.use()
+    ctx.enable(moderngl.DEPTH_TEST)
+    vertex_shader = '''
+        # version 330 core
+        uniform vec3 offset;
+        in vec3 in_vert;
+        in vec4 in_instance; // offset and size
+        out vec2 v_UVs;
+        void main()
+        {
+            vec3 position = offset + in_instance.xyz + in_vert * in_instance.w;
+            gl_Position = vec4(position.xy, position.z * 0.01, 1.0);
+            v_UVs = in_vert.xy + 0.5;
+        }
+        '''
+    programs = [ctx.program(vertex_shader=vertex_shader, fragment_shader='''
+        # version 330 core
+        uniform sampler2D base;
+        uniform sampler2D detail;
+        uniform vec3 tint;
+        in vec2 v_UVs;
+        out vec4 f_colour;
+        void main() { vec4 a = texture(base, v_UVs); vec4 b = texture(detail, v_UVs); f_colour = %s; }
+        ''' % expression) for expression in ('a * b * vec4(tint, 1.0)', '(a + b) * 0.5 * vec4(tint, 1.0)', 'vec4(tint, 1.0) - a * b')]
+    np.random.seed(0)
+    textures = [ctx.texture((4, 4), 3, np.random.randint(0, 255, (4, 4, 3), dtype='u1').tobytes()) for _ in range(8)]
+    for texture in textures:
+        texture.filter = (moderngl.NEAREST, moderngl.NEAREST)
+    for prog in programs:
+        prog['base'].value, prog['detail'].value = 0, 1
+
+    queue = RenderQueue(ctx, far=100.0)
+    shapes = [] # per shape: vertex arrays (one per program, a vertex array belongs to a program), instance buffer
+    for triangles in (12, 20, 6, 40):
+        vbo, instanceBuffer = ctx.buffer(np.random.uniform(-0.5, 0.5, (3 * triangles, 3)).astype('f4')), ctx.buffer(reserve=16)
+        shapes.append(([ctx.vertex_array(prog, [(vbo, '3f', 'in_vert'), (instanceBuffer, '4f/i', 'in_instance')]) for prog in programs], instanceBuffer))
+    queueMeshes = {(s, p): queue.mesh(vaos[p], instanceBuffer, 4) for s, (vaos, instanceBuffer) in enumerate(shapes) for p in range(len(programs))}
+    materials = [] # 3 programs x 8 texture pairs: (program, base, detail, tint)
+    for p in range(len(programs)):
+        for t in range(8):
+            materials.append((p, textures[t], textures[(3 * t + 1) % 8], tuple(np.random.uniform(0.5, 1.0, 3))))
+    queueMaterials = [queue.material(programs[p], [(0, base), (1, detail)], {'tint': tint}) for p, base, detail, tint in materials]
+
+    # 4000 draws in random order, each with a shape, a material and a position
+    count = 4000
+    shapeIds, materialIds = np.random.randint(0, len(shapes), count), np.random.randint(0, len(materials), count)
+    instances = np.hstack([np.random.uniform(-0.9, 0.9, (count, 2)), np.random.uniform(1, 99, (count, 1)), np.random.uniform(0.05, 0.2, (count, 1))]).astype('f4')
+
+    def naive():
+        '''The demos' way: in submission order, every draw binds its textures, sets its uniforms and draws on its own'''
+        switches, program = 0, None
+        for shape, material, instance in zip(shapeIds.tolist(), materialIds.tolist(), instances):
+            p, base, detail, tint = materials[material]
+            switches += p != program
+            program = p
+            base.use(0)
+            detail.use(1)
+            programs[p]['tint'].value = tint
+            vaos, instanceBuffer = shapes[shape]
+            instanceBuffer.write(instance)
+            vaos[p].render(instances=1)
+        return {'items': count, 'drawCalls': count, 'programSwitches': switches, 'textureBinds': 2 * count}
+
+    def submit():
+        for shape, material, instance in zip(shapeIds.tolist(), materialIds.tolist(), instances):
+            queue.submit(queueMeshes[(shape, materials[material][0])], queueMaterials[material], depth=float(instance[2]), instance=instance)
+
+    images = []
+    for label, frame in (('in submission order', naive), ('render queue', lambda: (submit(), queue.flush())[1])):
+        timings = []
+        for _ in range(5):
+            ctx.clear(0.1, 0.1, 0.1)
+            queue.state.invalidate() # textures were bound behind the queue's back
+            start = time.perf_counter()
+            stats = frame()
+            ctx.finish()
+            timings.append((time.perf_counter() - start) * 1000)
+        images.append(np.frombuffer(fbo.read(), dtype='u1').reshape(-1, 3))
+        print('{:<20} {:6.1f} ms per frame: {} draw calls, {} program switches, {} texture binds'.format(
+            label, np.median(timings), stats['drawCalls'], stats['programSwitches'], stats['textureBinds']))
+    start = time.perf_counter()
+    submit()
+    submitted = time.perf_counter()
+    queue.flush()
+    ctx.finish()
+    print('render queue split: submit {:.1f} ms, sort and draw {:.1f} ms'.format((submitted - start) * 1000, (time.perf_counter() - submitted) * 1000))
+    print('pixels that differ from the submission order: {} of {} (equal depths drawn in another order)'.format(
+        (images[0] != images[1]).any(axis=1).sum(), len(images[0])))
+
+    keys = np.random.randint(0, 2 ** 62, 100000, dtype='u8')
+    start = time.perf_counter()
+    for _ in range(10):
+        np.argsort(keys, kind='stable')
+    print('argsort of 100000 keys: {:.2f} ms'.format((time.perf_counter() - start) * 100))
+
+    # many drivers give a released texture's GL name to the next new texture, which still has to be bound
+    state = StateCache()
+    old = ctx.texture((1, 1), 3)
+    state.bindTexture(5, old)
+    old.release()
+    state.bindTexture(5, ctx.texture((1, 1), 3))
+    print('texture created after a release is bound: {}'.format(state.textureBinds == 2))
+    small = RenderQueue(ctx)
+    try:
+        for _ in range(1 << RenderQueue.MESH_BITS + 1):
+            small.mesh(shapes[0][0][0])
+    except ValueError as error:
+        print('mesh {}: {}'.format(len(small.meshes), error))
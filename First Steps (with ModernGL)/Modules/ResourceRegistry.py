@@ -0,0 +1,68 @@
+import os
+import sys
+if __name__ == '__main__': # python Modules/ResourceRegistry.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class ResourceRegistry():
+    '''
+    Owns the GPU objects of a demo so they are created once instead of every frame:
+        buffer(name, data) - VBO uploaded on first use, cached by name
+        vertexArray(program, name, data, format, *attributes) - VAO cached by (program, buffer, format, attributes)
+    allocations counts every object created, endFrame() returns how many were created since the previous call
+    (0 in a steady-state frame). release() frees everything, call it on shutdown.
+    '''
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.buffers = {}
+        self.vertexArrays = {}
+        self.allocations = 0
+        self.frameStart = 0
+
+    def buffer(self, name, data):
+        '''data is only read the first time a name is seen'''
+        vbo = self.buffers.get(name)
+        if vbo is None:
+            vbo = self.buffers[name] = self.ctx.buffer(data)
+            self.allocations += 1
+        return vbo
+
+    def vertexArray(self, program, name, data, format, *attributes):
+        key = (program.glo, name, format, attributes)
+        vao = self.vertexArrays.get(key)
+        if vao is None:
+            vbo = self.buffer(name, data)
+            vao = self.vertexArrays[key] = self.ctx.vertex_array(program, [(vbo, format) + attributes])
+            self.allocations += 1
+        return vao
+
+    def endFrame(self):
+        '''Number of allocations since the last call'''
+        count = self.allocations - self.frameStart
+        self.frameStart = self.allocations
+        return count
+
+    def release(self):
+        for vao in self.vertexArrays.values():
+            vao.release()
+        for vbo in self.buffers.values():
+            vbo.release()
+        self.vertexArrays.clear()
+        self.buffers.clear()
+
+if __name__ == '__main__':
+    import moderngl
+    import numpy as np
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    prog = ctx.program(vertex_shader='''
+        # version 330 core
+        in vec3 in_vert;
+        void main() { gl_Position = vec4(in_vert, 1.0); }
+        ''')
+    resources = ResourceRegistry(ctx)
+    vertices = np.zeros((3, 3), dtype='f4')
+    for frame in range(5):
+        resources.vertexArray(prog, 'triangle', vertices, '3f', 'in_vert').render()
+        print('frame {}: {} allocations'.format(frame, resources.endFrame()))
+    resources.release()
@@ -0,0 +1,139 @@
+import os
+import sys
+import numpy as np
+from PIL import Image
+if __name__ == '__main__': # python Modules/TextureArray.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.TextureCache import TextureCache
+
+class TextureArray():
+    '''
+    Packs images into the layers of one ctx.texture_array, so a whole scene is drawn with a single texture bind:
+        textures = TextureArray(ctx, {'brick': path, 'bulb': path}) - names in layer order
+        textures.lookup([('brick', 'bulb'), ...]) - float32 layer indices, e.g. per-instance attribute data
+        textures.use(location)
+    The shader samples texture(sampler2DArray, vec3(uv, layer)). Every layer has the size of the first image
+    (or size), others are resized to it; all layers share one sampler state and filter.
+    moderngl cannot write single levels of an array, so the mip chain is built on the GPU; cache=True still
+    skips the image decode by reading level 0 from the TextureCache files.
+    '''
+    def __init__(self, ctx, images, size=None, mipmaps=True, flip=False, cache=False):
+        self.names = list(images)
+        self.index = {name: layer for layer, name in enumerate(self.names)}
+        pixels = []
+        for name in self.names:
+            if cache: # level 0 of the cooked mip chain, see TextureCache
+                layer = np.asarray(TextureCache.load(images[name], flip=flip).pixels(0))
+            else:
+                img = Image.open(images[name]).convert('RGBA')
+                if flip:
+                    img = img.transpose(Image.FLIP_TOP_BOTTOM)
+                layer = np.asarray(img)
+            if size is None:
+                size = layer.shape[1], layer.shape[0]
+            if (layer.shape[1], layer.shape[0]) != tuple(size):
+                layer = np.asarray(Image.fromarray(layer).resize(size, Image.LANCZOS))
+            pixels.append(layer)
+        self.size = tuple(size)
+        self.texture = ctx.texture_array((size[0], size[1], len(pixels)), 4, np.stack(pixels))
+        if mipmaps:
+            self.texture.build_mipmaps()
+
+    def layer(self, name):
+        return self.index[name]
+
+    def lookup(self, materials):
+        '''Layer indices for a list of names or of name tuples (one row per material or instance), as float32'''
+        return np.array([[self.index[n] for n in m] if isinstance(m, (tuple, list)) else self.index[m] for m in materials], dtype='f4')
+
+    def use(self, location=0):
+        self.texture.use(location)
+
+    def release(self):
+        self.texture.release()
+
+if __name__ == '__main__':
+    import time
+    import moderngl
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    images = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+    names = {'brick': 'Brick_512x512.jpg', 'bulb': 'Bulb.jpg', 'spec': 'Brick_Spec.jpg', 'brick256': 'Brick_256x256.jpg'}
+    textures = TextureArray(ctx, {name: os.path.join(images, image) for name, image in names.items()})
+    print('{} layers of {}x{}, lookup of (brick, bulb), spec: {}'.format(
+        textures.texture.layers, *textures.size, textures.lookup([('brick', 'bulb'), ('spec', 'bulb')]).tolist()))
+
+    # 2000 quads with a random (base, decal) pair of layers each: one bind for all of them vs two binds per quad
+    count = 2000
+    pairs = [('brick', 'bulb'), ('spec', 'bulb'), ('brick256', 'spec'), ('bulb', 'bulb')]
+    materials = np.random.randint(0, len(pairs), count)
+    quad = np.array([-1, -1, 1, -1, -1, 1, -1, 1, 1, -1, 1, 1], dtype='f4') * 0.01
+    arrayProg = ctx.program(vertex_shader='''
+        # version 330 core
+        in vec2 in_vert;
+        in vec2 in_offset;
+        in vec2 in_layers;
+        out vec2 uv;
+        flat out vec2 layers;
+        void main() { gl_Position = vec4(in_vert + in_offset, 0.0, 1.0); uv = in_vert * 50.0 + 0.5; layers = in_layers; }
+        ''', fragment_shader='''
+        # version 330 core
+        uniform sampler2DArray materials;
+        in vec2 uv;
+        flat in vec2 layers;
+        out vec4 fragColour;
+        void main() { fragColour = texture(materials, vec3(uv, layers.x)) * texture(materials, vec3(uv, layers.y)); }
+        ''')
+    singleProg = ctx.program(vertex_shader='''
+        # version 330 core
+        uniform vec2 offset;
+        in vec2 in_vert;
+        out vec2 uv;
+        void main() { gl_Position = vec4(in_vert + offset, 0.0, 1.0); uv = in_vert * 50.0 + 0.5; }
+        ''', fragment_shader='''
+        # version 330 core
+        uniform sampler2D base;
+        uniform sampler2D decal;
+        in vec2 uv;
+        out vec4 fragColour;
+        void main() { fragColour = texture(base, uv) * texture(decal, uv); }
+        ''')
+    singleProg['decal'].value = 1
+    offsets = np.random.uniform(-0.95, 0.95, (count, 2)).astype('f4')
+    instances = np.hstack([offsets, textures.lookup(pairs)[materials]]).astype('f4')
+    vbo = ctx.buffer(quad)
+    arrayVao = ctx.vertex_array(arrayProg, [(vbo, '2f', 'in_vert'), (ctx.buffer(instances), '2f 2f/i', 'in_offset', 'in_layers')])
+    singleVao = ctx.vertex_array(singleProg, [(vbo, '2f', 'in_vert')])
+    separate = []
+    for name in textures.names:
+        img = Image.open(os.path.join(images, names[name])).convert('RGBA').resize(textures.size, Image.LANCZOS)
+        separate.append(ctx.texture(textures.size, 4, img.tobytes()))
+        separate[-1].build_mipmaps()
+    fbo = ctx.simple_framebuffer((256, 256))
+    fbo.use()
+
+    def perQuad():
+        for offset, material in zip(offsets, materials):
+            base, decal = pairs[material]
+            separate[textures.layer(base)].use(0)
+            separate[textures.layer(decal)].use(1)
+            singleProg['offset'].value = tuple(offset)
+            singleVao.render(moderngl.TRIANGLES)
+        ctx.finish()
+
+    def instanced():
+        textures.use(0)
+        arrayVao.render(moderngl.TRIANGLES, instances=count)
+        ctx.finish()
+
+    frames = []
+    for label, draw in (('two textures + uniform per quad', perQuad), ('texture array, one instanced draw', instanced)):
+        fbo.clear()
+        draw()
+        frames.append(fbo.read())
+        start = time.perf_counter()
+        for _ in range(10):
+            draw()
+        print('{}: {:.2f} ms per frame'.format(label, (time.perf_counter() - start) * 100))
+    print('identical images:', frames[0] == frames[1])
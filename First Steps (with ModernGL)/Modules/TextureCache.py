@@ -0,0 +1,411 @@
+import os
+import sys
+import struct
+import hashlib
+import zlib
+import tempfile
+import numpy as np
+from PIL import Image
+if __name__ == '__main__': # python Modules/TextureCache.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.RawGL import RawGL
+
+class CookedTexture():
+    '''
+    Mip chain of an image, memory-mapped from a cache file.
+    Levels are uploaded as they are stored, BC1/BC3 blocks go to the GPU still compressed:
+        texture = cooked.texture(ctx) - everything at once
+        texture = cooked.allocate(ctx), then cooked.writeRows(texture, level, first, count) - in parts, see TextureLoader
+    Rows are pixel rows, or rows of 4x4 blocks for BC levels.
+    '''
+    # GL_COMPRESSED_RGBA_S3TC_DXT1_EXT / DXT5_EXT, the driver keeps the texture block compressed in VRAM
+    INTERNAL_FORMATS = {None: None, 'bc1': 0x83F1, 'bc3': 0x83F3}
+
+    def __init__(self, size, levels, compression=None):
+        self.size = size # (width, height) of level 0
+        self.levels = levels # per level: (height, width, 4) uint8 memmap, or (block rows, block columns, 8/16) uint8 BC blocks
+        self.compression = compression # None, 'bc1' or 'bc3'
+        self.internalFormat = CookedTexture.INTERNAL_FORMATS[compression]
+
+    def levelSize(self, level):
+        return max(1, self.size[0] >> level), max(1, self.size[1] >> level)
+
+    def rows(self, level):
+        return len(self.levels[level])
+
+    def rowBytes(self, level):
+        return self.levels[level][0].nbytes
+
+    def pixels(self, level):
+        '''RGBA8 pixels of a level, a memmap for uncompressed caches, decoded from the BC blocks otherwise (CPU side, for checks)'''
+        if self.compression is None:
+            return self.levels[level]
+        width, height = self.levelSize(level)
+        return TextureCache.decodeBC(self.levels[level], self.compression)[:height, :width]
+
+    def allocate(self, ctx, mipmaps=True):
+        '''A new texture with storage for level 0 and, with mipmaps, every cooked level; fill it with writeRows()'''
+        texture = ctx.texture(self.size, 4, internal_format=self.internalFormat)
+        levels = len(self.levels) if mipmaps else 1
+        for level in range(1, levels):
+            RawGL.image(texture, level, self.levelSize(level), self.internalFormat, None, self.levels[level].nbytes)
+        RawGL.parameter(texture, RawGL.TEXTURE_MAX_LEVEL, levels - 1)
+        if levels > 1:
+            texture.filter = (0x2703, 0x2601) # LINEAR_MIPMAP_LINEAR, LINEAR as build_mipmaps() sets them
+        return texture
+
+    def writeRows(self, texture, level, first, count):
+        '''Upload count rows of a level starting at row first'''
+        data = np.ascontiguousarray(self.levels[level][first:first + count])
+        width, height = self.levelSize(level)
+        if self.compression is None:
+            RawGL.write(texture, level, (0, first, width, count), None, data)
+        else:
+            RawGL.write(texture, level, (0, 4 * first, width, min(4 * count, height - 4 * first)), self.internalFormat, data)
+
+    def texture(self, ctx, mipmaps=True):
+        '''Upload to a new moderngl texture; every cooked level is written, the driver neither generates nor compresses anything'''
+        texture = self.allocate(ctx, mipmaps)
+        for level in range(len(self.levels) if mipmaps else 1):
+            self.writeRows(texture, level, 0, self.rows(level))
+        return texture
+
+    def vramBytes(self, mipmaps=True):
+        '''Estimated GPU memory: 4 bytes per pixel, or 8/16 bytes per 4x4 block for BC1/BC3'''
+        levels = range(len(self.levels) if mipmaps else 1)
+        if self.compression is None:
+            return sum(4 * w * h for w, h in map(self.levelSize, levels))
+        blockBytes = TextureCache.BLOCK_BYTES[self.compression]
+        return sum(blockBytes * ((w + 3) // 4) * ((h + 3) // 4) for w, h in map(self.levelSize, levels))
+
+class TextureCache():
+    '''
+    Texture cooker, the image counterpart of MeshCache.
+    The first load decodes the image and writes <name>.<format>.texcache next to it (or into cacheDir):
+        header - magic, version, source mtime/size/sha1, level 0 size, level count, compression, flip
+        level table - offset, byte size and CRC32 per mip level
+        level blobs - 16-byte aligned RGBA8 pixels, or BC1/BC3 blocks for compress='bc1'/'bc3'
+    The mip chain is filtered on the CPU with a box filter in linear light (sRGB decoded, exact weights for odd sizes),
+    so later loads skip the JPEG decode and the GPU mipmap generation and only memory-map the file.
+    Stale (different source) or corrupt (truncated, bad CRC) caches are rebuilt. The CRCs are checked the first
+    time a process opens a cache file, again only if the file changes.
+    '''
+    MAGIC = b'TEXCACHE'
+    VERSION = 1
+    # magic, version, source mtime (ns), source size, source sha1, width, height, level count, compression, flip
+    HEADER = struct.Struct('<8sIqq20sIIIII')
+    LEVEL = struct.Struct('<QQI') # offset, byte size, crc
+    MTIME_OFFSET = 12
+    COMPRESSION = (None, 'bc1', 'bc3')
+    BLOCK_BYTES = {'bc1': 8, 'bc3': 16}
+    CHUNK = 1 << 16 # blocks encoded per batch, bounds the temporary float arrays
+    verified = {} # cache path -> (mtime, size) of the file when its CRCs passed
+
+    @staticmethod
+    def load(filename, cacheDir=None, compress=None, flip=False):
+        '''Return a CookedTexture for the image, cooking it if the cache is missing or invalid'''
+        if compress not in TextureCache.COMPRESSION:
+            raise ValueError('unknown compression {!r}, expected one of {}'.format(compress, TextureCache.COMPRESSION))
+        path = TextureCache.cachePath(filename, cacheDir, compress, flip)
+        cooked = TextureCache._open(path, filename, compress, flip)
+        if cooked is None:
+            TextureCache._write(path, filename, compress, flip)
+            cooked = TextureCache._open(path, filename, compress, flip)
+        return cooked
+
+    @staticmethod
+    def cachePath(filename, cacheDir=None, compress=None, flip=False):
+        directory = cacheDir if cacheDir is not None else os.path.dirname(os.path.abspath(filename))
+        key = (compress or 'rgba8') + ('-flip' if flip else '')
+        return os.path.join(directory, '{}.{}.texcache'.format(os.path.basename(filename), key))
+
+    @staticmethod
+    def mipChain(pixels):
+        '''All mip levels of (height, width, 4) uint8 pixels, down to 1x1'''
+        levels = [np.ascontiguousarray(pixels)]
+        linear = TextureCache._toLinear(levels[0])
+        while linear.shape[0] > 1 or linear.shape[1] > 1:
+            linear = TextureCache._downsample(TextureCache._downsample(linear, 0), 1)
+            levels.append(TextureCache._fromLinear(linear))
+        return levels
+
+    @staticmethod
+    def encodeBC(pixels, compression):
+        '''(height, width, 4) uint8 -> (block rows, block columns, 8 or 16) uint8, edges padded by repetition'''
+        height, width = pixels.shape[:2]
+        rows, columns = (height + 3) // 4, (width + 3) // 4
+        padded = np.pad(pixels, ((0, rows * 4 - height), (0, columns * 4 - width), (0, 0)), mode='edge')
+        blocks = padded.reshape(rows, 4, columns, 4, 4).transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4)
+        encoded = []
+        for start in range(0, len(blocks), TextureCache.CHUNK):
+            chunk = blocks[start:start + TextureCache.CHUNK]
+            colour = TextureCache._encodeBC1(chunk[:, :, :3].astype('f4'))
+            encoded.append(colour if compression == 'bc1' else np.concatenate([TextureCache._encodeAlpha(chunk[:, :, 3]), colour], axis=1))
+        return np.concatenate(encoded).reshape(rows, columns, -1)
+
+    @staticmethod
+    def decodeBC(blocks, compression):
+        '''Inverse of encodeBC, returns the padded (block rows * 4, block columns * 4, 4) uint8 pixels'''
+        rows, columns = blocks.shape[:2]
+        blocks = np.ascontiguousarray(blocks).reshape(-1, TextureCache.BLOCK_BYTES[compression])
+        pixels = np.empty((len(blocks), 16, 4), dtype='u1')
+        pixels[:, :, :3] = TextureCache._decodeBC1(blocks[:, -8:])
+        pixels[:, :, 3] = 255 if compression == 'bc1' else TextureCache._decodeAlpha(blocks[:, :8])
+        return pixels.reshape(rows, columns, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(rows * 4, columns * 4, 4)
+
+    @staticmethod
+    def _encodeBC1(colours):
+        '''(N, 16, 3) float pixels -> (N, 8) BC1 blocks, endpoints along the principal axis of each block'''
+        mean = colours.mean(axis=1, keepdims=True)
+        centred = colours - mean
+        covariance = np.einsum('nki,nkj->nij', centred, centred)
+        axis = np.ones((len(colours), 3), dtype='f4')
+        for _ in range(4): # power iteration
+            axis = np.einsum('nij,nj->ni', covariance, axis)
+            axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-12)
+        projection = np.einsum('nki,ni->nk', centred, axis)
+        lo = np.take_along_axis(colours, projection.argmin(axis=1)[:, None, None], axis=1)[:, 0]
+        hi = np.take_along_axis(colours, projection.argmax(axis=1)[:, None, None], axis=1)[:, 0]
+        inset = (hi - lo) / 16 # pull the endpoints in a little, halves the error of the extreme pixels' neighbours
+        c0, c1 = TextureCache._to565(hi - inset), TextureCache._to565(lo + inset)
+        swap = c0 < c1 # c0 > c1 selects the opaque 4 colour mode
+        c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+
+        palette = TextureCache._palette(c0, c1)
+        distance = ((colours[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+        indices = distance.argmin(axis=2).astype('u4')
+        indices[c0 == c1] = 0
+        bits = (indices << (2 * np.arange(16, dtype='u4'))).sum(axis=1, dtype='u4')
+        block = np.empty((len(colours), 8), dtype='u1')
+        block[:, 0:2] = c0.astype('<u2')[:, None].view('u1')
+        block[:, 2:4] = c1.astype('<u2')[:, None].view('u1')
+        block[:, 4:8] = bits.astype('<u4')[:, None].view('u1')
+        return block
+
+    @staticmethod
+    def _decodeBC1(blocks):
+        c0 = blocks[:, 0:2].copy().view('<u2')[:, 0]
+        c1 = blocks[:, 2:4].copy().view('<u2')[:, 0]
+        bits = blocks[:, 4:8].copy().view('<u4')[:, 0]
+        indices = (bits[:, None] >> (2 * np.arange(16, dtype='u4'))) & 3
+        palette = TextureCache._palette(c0, c1)
+        return np.rint(np.take_along_axis(palette, indices[:, :, None].astype(np.intp), axis=1)).astype('u1')
+
+    @staticmethod
+    def _palette(c0, c1):
+        '''(N, 4, 3) float colours of the 4 colour mode; 3 colour + black mode blocks (c0 <= c1) are never written'''
+        p0, p1 = TextureCache._from565(c0), TextureCache._from565(c1)
+        opaque = (c0 > c1)[:, None]
+        p2 = np.where(opaque, (2 * p0 + p1) / 3, (p0 + p1) / 2)
+        p3 = np.where(opaque, (p0 + 2 * p1) / 3, 0.0)
+        return np.stack([p0, p1, p2, p3], axis=1)
+
+    @staticmethod
+    def _encodeAlpha(alpha):
+        '''(N, 16) uint8 alpha -> (N, 8) BC3 alpha blocks, 8 value mode between the block's min and max'''
+        a0 = alpha.max(axis=1).astype('u8')
+        a1 = alpha.min(axis=1).astype('u8')
+        palette = TextureCache._alphaPalette(a0, a1)
+        indices = np.abs(alpha[:, :, None].astype('f4') - palette[:, None, :]).argmin(axis=2).astype('u8')
+        bits = (indices << (3 * np.arange(16, dtype='u8'))).sum(axis=1, dtype='u8')
+        packed = a0 | (a1 << 8) | (bits << 16)
+        return packed.astype('<u8')[:, None].view('u1')
+
+    @staticmethod
+    def _decodeAlpha(blocks):
+        packed = blocks.copy().view('<u8')[:, 0]
+        a0, a1 = packed & 0xFF, (packed >> 8) & 0xFF
+        indices = (packed[:, None] >> (16 + 3 * np.arange(16, dtype='u8'))) & 7
+        return np.rint(np.take_along_axis(TextureCache._alphaPalette(a0, a1), indices.astype(np.intp), axis=1)).astype('u1')
+
+    @staticmethod
+    def _alphaPalette(a0, a1):
+        a0, a1 = a0.astype('f4')[:, None], a1.astype('f4')[:, None]
+        weights = np.array([0, 7, 1, 2, 3, 4, 5, 6], dtype='f4') / 7 # index 0 -> a0, 1 -> a1, then 6 steps in between
+        return a0 + (a1 - a0) * weights # a0 >= a1 always, flat blocks (a0 == a1) only use index 0
+
+    @staticmethod
+    def _to565(colours):
+        rgb = np.rint(np.clip(colours, 0, 255) * np.array([31, 63, 31], dtype='f4') / 255).astype('u4')
+        return (rgb[:, 0] << 11) | (rgb[:, 1] << 5) | rgb[:, 2]
+
+    @staticmethod
+    def _from565(c):
+        c = c.astype('u4')
+        r, g, b = (c >> 11) & 31, (c >> 5) & 63, c & 31
+        return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=1).astype('f4')
+
+    @staticmethod
+    def _downsample(pixels, axis):
+        '''Halve one axis (floor, like GL); odd sizes use the exact 3 tap box weights so no row is dropped'''
+        n = pixels.shape[axis]
+        if n == 1:
+            return pixels
+        k = n // 2
+        taps = lambda start, step=2: np.take(pixels, np.arange(start, start + 2 * k, step)[:k], axis=axis)
+        if n % 2 == 0:
+            return (taps(0) + taps(1)) * 0.5
+        shape = [1, 1, 1]
+        shape[axis] = k
+        i = np.arange(k, dtype='f4').reshape(shape)
+        return (taps(0) * (k - i) + taps(1) * k + taps(2) * (i + 1)) / (2 * k + 1)
+
+    @staticmethod
+    def _toLinear(pixels):
+        '''uint8 sRGB -> float32 linear light, alpha is already linear'''
+        table = np.arange(256, dtype='f8') / 255
+        table = np.where(table <= 0.04045, table / 12.92, ((table + 0.055) / 1.055) ** 2.4).astype('f4')
+        linear = table[pixels]
+        linear[:, :, 3] = pixels[:, :, 3] / np.float32(255)
+        return linear
+
+    @staticmethod
+    def _fromLinear(linear):
+        srgb = np.where(linear <= 0.0031308, linear * 12.92, 1.055 * np.power(np.maximum(linear, 0), 1 / 2.4) - 0.055)
+        srgb[:, :, 3] = linear[:, :, 3]
+        return np.rint(np.clip(srgb, 0, 1) * 255).astype('u1')
+
+    @staticmethod
+    def _sourceHash(filename):
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).digest()
+
+    @staticmethod
+    def _cook(filename, compress, flip):
+        '''Decode the source; returns ((width, height), level blobs as uint8 arrays)'''
+        img = Image.open(filename).convert('RGBA')
+        if flip:
+            img = img.transpose(Image.FLIP_TOP_BOTTOM)
+        levels = TextureCache.mipChain(np.asarray(img))
+        if compress is not None:
+            levels = [TextureCache.encodeBC(level, compress) for level in levels]
+        return img.size, levels
+
+    @staticmethod
+    def _write(path, filename, compress, flip):
+        size, levels = TextureCache._cook(filename, compress, flip)
+        stat = os.stat(filename)
+        header = TextureCache.HEADER.pack(
+            TextureCache.MAGIC, TextureCache.VERSION, stat.st_mtime_ns, stat.st_size, TextureCache._sourceHash(filename),
+            size[0], size[1], len(levels), TextureCache.COMPRESSION.index(compress), flip)
+        offset = TextureCache.HEADER.size + TextureCache.LEVEL.size * len(levels)
+        table = []
+        for level in levels:
+            offset = TextureCache._align(offset)
+            table.append(TextureCache.LEVEL.pack(offset, level.nbytes, zlib.crc32(level)))
+            offset += level.nbytes
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a temporary file of its own, two workers may cook the same image at once
+        temp = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False)
+        try:
+            with temp as f:
+                f.write(header + b''.join(table))
+                for level in levels:
+                    f.write(b'\0' * (TextureCache._align(f.tell()) - f.tell()))
+                    f.write(level.tobytes())
+            os.replace(temp.name, path) # never leave a half-written cache behind
+        finally:
+            if os.path.exists(temp.name): # the write failed
+                os.remove(temp.name)
+
+    @staticmethod
+    def _open(path, filename, compress, flip):
+        '''Memory-map a valid cache file, or return None if it is missing, stale or corrupt'''
+        try:
+            with open(path, 'rb') as f:
+                (magic, version, mtime, size, sha1, width, height,
+                 levelCount, compression, flipped) = TextureCache.HEADER.unpack(f.read(TextureCache.HEADER.size))
+                table = [TextureCache.LEVEL.unpack(f.read(TextureCache.LEVEL.size)) for _ in range(levelCount)]
+            fileSize = os.path.getsize(path)
+        except (OSError, struct.error):
+            return None
+        if magic != TextureCache.MAGIC or version != TextureCache.VERSION or not width or not height \
+                or compression != TextureCache.COMPRESSION.index(compress) or flipped != flip \
+                or levelCount != max(width, height).bit_length():
+            return None
+        cooked = CookedTexture((width, height), [], compress)
+        shapes = []
+        for level, (offset, nbytes, crc) in enumerate(table):
+            w, h = cooked.levelSize(level)
+            shape = (h, w, 4) if compress is None else ((h + 3) // 4, (w + 3) // 4, TextureCache.BLOCK_BYTES[compress])
+            if nbytes != int(np.prod(shape)) or offset + nbytes > fileSize:
+                return None # truncated or garbage header
+            shapes.append(shape)
+
+        stat = os.stat(filename)
+        if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+            # e.g. a fresh checkout touches mtime: only recook if the content really changed
+            if stat.st_size != size or TextureCache._sourceHash(filename) != sha1:
+                return None
+            with open(path, 'r+b') as f:
+                f.seek(TextureCache.MTIME_OFFSET)
+                f.write(struct.pack('<q', stat.st_mtime_ns))
+
+        cacheStat = os.stat(path)
+        checked = TextureCache.verified.get(path) == (cacheStat.st_mtime_ns, cacheStat.st_size)
+        for (offset, nbytes, crc), shape in zip(table, shapes):
+            level = np.memmap(path, dtype='u1', mode='r', offset=offset, shape=shape)
+            if not checked and zlib.crc32(level) != crc:
+                return None
+            cooked.levels.append(level)
+        TextureCache.verified[path] = (cacheStat.st_mtime_ns, cacheStat.st_size)
+        return cooked
+
+    @staticmethod
+    def _align(offset, alignment=16):
+        return (offset + alignment - 1) // alignment * alignment
+
+if __name__ == '__main__':
+    import tempfile
+    import timeit
+    import moderngl
+    from Modules.Headless import Headless
+
+    images = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+    cacheDir = tempfile.mkdtemp()
+    ctx = Headless.standaloneContext()
+
+    # odd sizes: every level halves with floor like GL, a flat image stays flat through the odd taps
+    flat = TextureCache.mipChain(np.full((7, 5, 4), 200, dtype='u1'))
+    print('7x5 chain: {}, flat: {}'.format([level.shape[:2] for level in flat], all((level == 200).all() for level in flat)))
+
+    for name in ('Brick_4096x4096.jpg', 'Brick_2048x2048.jpg', 'Brick_Spec.jpg'):
+        source = os.path.join(images, name)
+        def jpeg():
+            img = Image.open(source)
+            ctx.texture(img.size, 3, img.tobytes()).build_mipmaps()
+            ctx.finish()
+        jpegTime = min(timeit.repeat(jpeg, number=1, repeat=3))
+        for compress in TextureCache.COMPRESSION:
+            coldTime = timeit.timeit(lambda: TextureCache.load(source, cacheDir, compress), number=1)
+            def warm():
+                TextureCache.load(source, cacheDir, compress).texture(ctx)
+                ctx.finish()
+            warmTime = min(timeit.repeat(warm, number=1, repeat=3))
+            cooked = TextureCache.load(source, cacheDir, compress)
+            reference = np.asarray(Image.open(source).convert('RGBA')).astype('f4')
+            rmse = np.sqrt(((cooked.pixels(0).astype('f4') - reference) ** 2)[:, :, :3].mean())
+            print('{} {}: jpeg + GPU mips {:.0f} ms, cook {:.0f} ms, cached load + upload {:.0f} ms, '
+                  'file {:.1f} MB, VRAM {:.1f} MB, level 0 RMSE {:.2f}'.format(
+                name, compress or 'rgba8', jpegTime * 1000, coldTime * 1000, warmTime * 1000,
+                os.path.getsize(TextureCache.cachePath(source, cacheDir, compress)) / 2 ** 20,
+                cooked.vramBytes() / 2 ** 20, rmse))
+
+    # the cooked levels arrive on the GPU unchanged
+    cooked = TextureCache.load(os.path.join(images, 'Brick_512x512.jpg'), cacheDir)
+    texture = cooked.texture(ctx)
+    print('levels read back match: {}'.format(all(
+        (RawGL.read(texture, i, cooked.levelSize(i)) == cooked.pixels(i)).all() for i in range(len(cooked.levels)))))
+    blocks = TextureCache.load(os.path.join(images, 'Brick_512x512.jpg'), cacheDir, 'bc3')
+    compressed = blocks.texture(ctx) # blocks as stored, read back decoded by the driver
+    print('bc3 levels read back as decoded on the CPU, largest difference: {}'.format(max(
+        np.abs(RawGL.read(compressed, i, blocks.levelSize(i)).astype('i4') - blocks.pixels(i)).max()
+        for i in range(len(blocks.levels)))))
+
+    path = TextureCache.cachePath(os.path.join(images, 'Brick_512x512.jpg'), cacheDir)
+    last = cooked.levels[-1].tobytes()
+    with open(path, 'r+b') as f: # corrupt one byte of the last level
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\x00')
+    print('recooked after corruption:', TextureCache.load(os.path.join(images, 'Brick_512x512.jpg'), cacheDir).levels[-1].tobytes() == last)
@@ -0,0 +1,103 @@
+import os
+import sys
+import numpy as np
+if __name__ == '__main__': # python Modules/TextureLOD.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.TextureManager import TextureManager
+
+class TextureLOD():
+    '''
+    Picks the Brick_NxN style variant of a texture from the object's size on screen:
+        lod = TextureLOD(textures, path, mesh.bounds) - textures is a TextureManager, options go to its load()
+        lod.select(model, view, projection, viewportHeight) - once per frame, before drawing the object
+        lod.use(location) - binds the selected variant (the previous one until the new one is resident)
+    The object's bounding sphere is projected to a height in pixels; the smallest variant with at least
+    texelsPerPixel texels per covered pixel is chosen (raise it for UVs that repeat over the object).
+    Switching up waits until the need exceeds the current size by the hysteresis fraction, switching down
+    until the next smaller variant would be enough by the same margin, so a camera hovering around a
+    threshold does not reload textures every frame.
+    '''
+    def __init__(self, textures, path, bounds, texelsPerPixel=1.0, hysteresis=0.25, **options):
+        self.textures = textures
+        self.options = options
+        self.variants = TextureManager.variants(path) or [(0, path)]
+        bounds = np.asarray(bounds, dtype='f4').reshape(2, 3)
+        self.centre = np.append((bounds[0] + bounds[1]) / 2, 1.0)
+        self.radius = float(np.linalg.norm(bounds[1] - bounds[0]) / 2)
+        self.texelsPerPixel = texelsPerPixel
+        self.hysteresis = hysteresis
+        self.level = None # index into variants
+        self.texture = None # ManagedTexture currently bound by use()
+        self.pending = None # ManagedTexture being loaded for a switch
+        self.switches = 0
+
+    def footprint(self, model, view, projection, viewportHeight):
+        '''Height of the bounding sphere on screen in pixels (pyrr row-major matrices)'''
+        model = np.asarray(model, dtype='f4')
+        centre = self.centre @ model @ np.asarray(view, dtype='f4')
+        radius = self.radius * np.linalg.norm(model[:3, :3], axis=1).max() # largest axis scale
+        depth = -centre[2]
+        if depth <= radius:
+            return float('inf') # the camera is inside the sphere
+        return radius * float(projection[1][1]) / depth * viewportHeight
+
+    def select(self, model, view, projection, viewportHeight):
+        '''Choose the variant for this frame, returns its size'''
+        needed = self.footprint(model, view, projection, viewportHeight) * self.texelsPerPixel
+        sizes = [size for size, path in self.variants]
+        target = next((i for i, size in enumerate(sizes) if size >= needed), len(sizes) - 1)
+        if self.level is None or needed > sizes[self.level] * (1 + self.hysteresis):
+            self._switch(target)
+        elif self.level > 0 and needed < sizes[self.level - 1] * (1 - self.hysteresis):
+            self._switch(next(i for i, size in enumerate(sizes) if size * (1 - self.hysteresis) >= needed))
+        return sizes[self.level]
+
+    def _switch(self, level):
+        if level == self.level:
+            return
+        self.level = level
+        self.pending = self.textures.load(self.variants[level][1], **self.options)
+        if self.texture is None:
+            self.texture, self.pending = self.pending, None # nothing to keep showing, use the manager's fallback
+        self.switches += 1
+
+    def use(self, location=0):
+        self.resolve().use(location)
+
+    def resolve(self):
+        '''The moderngl texture use() binds, see ManagedTexture.resolve()'''
+        if self.pending is not None:
+            self.textures.touch(self.pending) # keeps a reload going after an eviction
+            if self.pending.resident:
+                self.texture, self.pending = self.pending, None
+        return self.texture.resolve()
+
+if __name__ == '__main__':
+    import moderngl
+    from pyrr import Matrix44
+    from Modules.functions import Math
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    images = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+    textures = TextureManager(ctx)
+    lod = TextureLOD(textures, os.path.join(images, 'Brick_512x512.jpg'), [[-1, -1, -1], [1, 1, 1]])
+    projection = Matrix44.perspective_projection(45.0, 16 / 9, 0.1, 1000.0)
+    view = Matrix44.look_at([0, 0, 0], [0, 0, -1], [0, 1, 0])
+
+    # dolly a 2x2x2 cube out from 1.5 to 200 units, then jitter around one distance
+    distances = list(np.geomspace(1.5, 200, 12)) + list(9.0 + 0.6 * np.sin(np.arange(60)))
+    previous = None
+    for i, distance in enumerate(distances):
+        model = Math.buildTransMatrix(pos=[0, 0, -distance])
+        size = lod.select(model, view, projection, 720)
+        lod.use(0)
+        textures.update()
+        if i < 12 or size != previous:
+            print('distance {:6.1f}: {:7.1f} px on screen -> {}x{}'.format(distance, lod.footprint(model, view, projection, 720), size, size))
+        previous = size
+        if i == 12:
+            dollySwitches = lod.switches
+    print('{} switches over {} frames, {} while jittering between {:.1f} and {:.1f} units'.format(
+        lod.switches, len(distances), lod.switches - dollySwitches, min(distances[12:]), max(distances[12:])))
+    textures.release()
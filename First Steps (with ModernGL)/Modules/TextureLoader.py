@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import weakref
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+if __name__ == '__main__': # python Modules/TextureLoader.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.TextureCache import TextureCache, CookedTexture
+
+class StreamedTexture():
+    '''
+    Handle returned by TextureLoader.load().
+    texture is a 1x1 placeholder until the decoded image has been uploaded, then the real texture.
+    The rows are written into staging over several frames, it replaces the placeholder once every level is complete.
+    use(location) works at any time, the final texture is bound to the same unit when it arrives.
+    '''
+    def __init__(self, texture, future, mipmaps):
+        self.texture = texture
+        self.staging = None # the real texture while it is being uploaded
+        self.future = future
+        self.mipmaps = mipmaps
+        self.location = None
+        self.ready = False
+        self.level = 0 # mip level being uploaded
+        self.rowsUploaded = 0 # of that level
+        self.pixels = None # CookedTexture once decoded
+        self.requested = time.perf_counter()
+        self.latency = None # seconds from load() to the last uploaded row
+        self.vramBytes = 0 # estimated GPU memory once ready, see TextureLoader.vramBytes()
+
+    def use(self, location=0):
+        self.location = location
+        self.texture.use(location)
+
+    def resolve(self):
+        '''The moderngl texture use() binds, for a bind cache (see RenderQueue)'''
+        return self.texture
+
+    def release(self):
+        self.texture.release()
+        if self.staging is not None:
+            self.staging.release()
+            self.staging = None
+
+class TextureLoader():
+    '''
+    Decodes images on a thread pool (PIL releases the GIL while decoding) and uploads them from the GL thread:
+        tex = loader.load(path) - returns a StreamedTexture right away
+        loader.update() - once per frame, uploads finished images, at most uploadBudget bytes per call
+    Large images and each of their mip levels are uploaded in horizontal strips over several frames,
+    so a frame never stalls on one upload.
+    load(path, cache=True) reads the mip chain cooked by TextureCache instead of decoding the image,
+    the precomputed levels are uploaded as they are stored (compress='bc1'/'bc3' blocks stay compressed in VRAM).
+    '''
+    def __init__(self, ctx, workers=4, uploadBudget=8 * 1024 * 1024, placeholder=(128, 128, 128)):
+        self.ctx = ctx
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.uploadBudget = uploadBudget
+        self.placeholder = bytes(placeholder)
+        self.pending = [] # in request order
+        self.loaded = weakref.WeakSet() # every StreamedTexture still referenced, release() frees their textures
+        self.uploadedBytes = 0
+
+    def load(self, path, mipmaps=True, flip=False, cache=False, compress=None):
+        if cache:
+            future = self.pool.submit(TextureLoader.decodeCached, path, flip, compress)
+        else:
+            future = self.pool.submit(TextureLoader.decode, path, flip)
+        texture = StreamedTexture(self.ctx.texture((1, 1), 3, self.placeholder), future, mipmaps)
+        self.pending.append(texture)
+        self.loaded.add(texture)
+        return texture
+
+    @staticmethod
+    def decode(path, flip=False):
+        '''Runs on a worker thread, returns the RGBA pixels as a CookedTexture of one level'''
+        img = Image.open(path).convert('RGBA')
+        if flip:
+            img = img.transpose(Image.FLIP_TOP_BOTTOM)
+        return CookedTexture(img.size, [np.asarray(img)])
+
+    @staticmethod
+    def decodeCached(path, flip=False, compress=None):
+        '''Runs on a worker thread, cooks the image on first use; returns the memory-mapped CookedTexture'''
+        return TextureCache.load(path, compress=compress, flip=flip)
+
+    def update(self):
+        '''Upload decoded pixels within the per-frame budget, returns the number of textures completed'''
+        budget = self.uploadBudget
+        completed = 0
+        for texture in list(self.pending):
+            if budget <= 0:
+                break
+            if texture.pixels is None:
+                if not texture.future.done():
+                    continue
+                texture.pixels = texture.future.result() # re-raises decode errors on the GL thread
+                texture.staging = texture.pixels.allocate(self.ctx, texture.mipmaps)
+            cooked = texture.pixels
+            levels = len(cooked.levels) if texture.mipmaps else 1
+            while budget > 0 and texture.level < levels: # every level counts, the rest carries over to the next frame
+                rowBytes = cooked.rowBytes(texture.level)
+                rows = min(cooked.rows(texture.level) - texture.rowsUploaded, max(1, budget // rowBytes))
+                cooked.writeRows(texture.staging, texture.level, texture.rowsUploaded, rows)
+                texture.rowsUploaded += rows
+                budget -= rows * rowBytes
+                self.uploadedBytes += rows * rowBytes
+                if texture.rowsUploaded == cooked.rows(texture.level):
+                    texture.level += 1
+                    texture.rowsUploaded = 0
+            if texture.level == levels:
+                if texture.mipmaps and levels == 1:
+                    texture.staging.build_mipmaps() # a decoded image, the GPU filters the chain
+                placeholder, texture.texture, texture.staging = texture.texture, texture.staging, None
+                placeholder.release()
+                if texture.location is not None:
+                    texture.texture.use(texture.location)
+                texture.vramBytes = TextureLoader.vramBytes(cooked.size, 4, cooked.internalFormat, texture.mipmaps)
+                texture.pixels = None # let the decoded bytes go
+                texture.ready = True
+                texture.latency = time.perf_counter() - texture.requested
+                self.pending.remove(texture)
+                completed += 1
+        return completed
+
+    @staticmethod
+    def vramBytes(size, components, internalFormat=None, mipmaps=True):
+        '''
+        Estimated GPU memory of an 8-bit texture: drivers pad RGB to 4 bytes per pixel,
+        BC1/BC3 internal formats take 8/16 bytes per 4x4 block, a mip chain adds a third
+        '''
+        compression = {value: key for key, value in CookedTexture.INTERNAL_FORMATS.items()}[internalFormat]
+        if compression is not None:
+            base = TextureCache.BLOCK_BYTES[compression] * ((size[0] + 3) // 4) * ((size[1] + 3) // 4)
+        else:
+            base = size[0] * size[1] * (4 if components == 3 else components)
+        return base * 4 // 3 if mipmaps else base
+
+    def wait(self):
+        '''Block until everything requested so far is uploaded, e.g. for benchmarks'''
+        while self.pending:
+            for texture in self.pending:
+                texture.future.result()
+            self.update()
+
+    def release(self):
+        '''Stop the workers and release the textures of every load() still in use'''
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for texture in list(self.loaded):
+            texture.release()
+        self.pending.clear()
+
+if __name__ == '__main__':
+    import moderngl
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    images = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+    paths = [os.path.join(images, name) for name in ('Brick_4096x4096.jpg', 'Brick_2048x2048.jpg', 'Brick_Spec.jpg', 'Brick_1024x1024.jpg')]
+
+    start = time.perf_counter()
+    for path in paths:
+        img = Image.open(path)
+        ctx.texture(img.size, 3, img.tobytes()).build_mipmaps()
+    ctx.finish()
+    print('synchronous: {:.0f} ms before the first frame'.format((time.perf_counter() - start) * 1000))
+
+    for cache in (False, True, True): # the first cached pass cooks the .texcache files, the second only maps them
+        loader = TextureLoader(ctx)
+        start = time.perf_counter()
+        textures = [loader.load(path, cache=cache) for path in paths]
+        firstFrame = time.perf_counter() - start
+        frames, largest, placeholders = 0, 0, True
+        while loader.pending:
+            frameStart = time.perf_counter()
+            uploaded = loader.uploadedBytes
+            loader.update()
+            largest = max(largest, loader.uploadedBytes - uploaded)
+            placeholders &= all(t.ready or t.texture.size == (1, 1) for t in textures) # never a half uploaded texture
+            ctx.finish()
+            frames += 1
+            time.sleep(max(0.0, 1 / 60 - (time.perf_counter() - frameStart)))
+        print('streamed{}: {:.1f} ms before the first frame, all {} textures after {} frames ({:.0f} ms), latencies {}, '
+              'largest upload in one frame {:.1f} MB (budget {:.0f} MB), placeholder until complete: {}'.format(
+            ' from the texture cache' if cache else '', firstFrame * 1000, len(textures), frames, (time.perf_counter() - start) * 1000,
+            ', '.join('{:.0f} ms'.format(t.latency * 1000) for t in textures), largest / 2 ** 20, loader.uploadBudget / 2 ** 20, placeholders))
+        loader.release()
@@ -0,0 +1,190 @@
+import os
+import sys
+import re
+import glob
+import time
+from collections import OrderedDict
+if __name__ == '__main__': # python Modules/TextureManager.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Modules.TextureLoader import TextureLoader
+
+class ManagedTexture():
+    '''
+    Handle returned by TextureManager.load(), call use(location) every frame the texture is drawn with.
+    Binds the full texture when it is resident, otherwise requests a reload and binds the fallback meanwhile.
+    '''
+    def __init__(self, manager, key, path, options, fallback=None):
+        self.manager = manager
+        self.key = key
+        self.path = path
+        self.options = options # TextureLoader.load() keyword arguments
+        self.fallback = fallback # ManagedTexture of a lower resolution variant or None
+        self.streamed = None # StreamedTexture while loading or resident
+        self.lastUsed = -1 # manager frame
+        self.reloadRequested = None # perf_counter() of a reload after an eviction
+
+    @property
+    def resident(self):
+        return self.streamed is not None and self.streamed.ready
+
+    @property
+    def vramBytes(self):
+        return self.streamed.vramBytes if self.resident else 0
+
+    def use(self, location=0):
+        self.resolve().use(location)
+
+    def resolve(self):
+        '''The moderngl texture to draw with this frame (marks it used), e.g. for a bind cache such as RenderQueue's'''
+        self.manager.touch(self)
+        if self.resident:
+            return self.streamed.texture
+        if self.fallback is not None:
+            self.manager.touch(self.fallback)
+            if self.fallback.resident:
+                return self.fallback.streamed.texture
+        return self.streamed.texture # grey placeholder until something arrives
+
+class TextureManager():
+    '''
+    Keeps the textures of a scene within a VRAM budget:
+        tex = textures.load(path) - starts streaming the image through a TextureLoader, returns a ManagedTexture
+        tex.use(location) - every frame it is drawn, marks it as recently used
+        textures.update() - once per frame, uploads arrivals and evicts least recently used textures over budget
+    GPU memory is estimated per texture (TextureLoader.vramBytes()). Evicted textures are released and reloaded
+    on their next use(); Brick_NxN style images fall back to the largest smaller variant up to fallbackSize
+    (kept resident like any other texture) until the full resolution one is back.
+    Textures used in the current frame are never evicted, the budget can be exceeded if they do not fit.
+    '''
+    VARIANT = re.compile(r'^(.*)_(\d+)x(\d+)(\.\w+)$')
+
+    def __init__(self, ctx, budget=64 * 1024 * 1024, fallbackSize=256, loader=None):
+        self.loader = loader if loader is not None else TextureLoader(ctx)
+        self.budget = budget
+        self.fallbackSize = fallbackSize
+        self.textures = OrderedDict() # key -> ManagedTexture, least recently used first
+        self.frame = 0
+        self.evictions = 0
+        self.reloads = 0
+        self.reloadLatencies = []
+
+    def load(self, path, **options):
+        '''options are passed on to TextureLoader.load() (mipmaps, flip, cache, compress)'''
+        key = (os.path.abspath(path), tuple(sorted(options.items())))
+        texture = self.textures.get(key)
+        if texture is None:
+            variant = TextureManager.fallbackVariant(path, self.fallbackSize)
+            fallback = self.load(variant, **options) if variant is not None else None
+            texture = self.textures[key] = ManagedTexture(self, key, path, options, fallback)
+            texture.streamed = self.loader.load(path, **options)
+        return texture
+
+    def touch(self, texture):
+        texture.lastUsed = self.frame
+        self.textures.move_to_end(texture.key)
+        if texture.streamed is None: # evicted, bring it back
+            texture.reloadRequested = time.perf_counter()
+            texture.streamed = self.loader.load(texture.path, **texture.options)
+            self.reloads += 1
+
+    def update(self):
+        '''Upload what has arrived, then evict down to the budget; returns the number of textures evicted'''
+        self.loader.update()
+        for texture in self.textures.values():
+            if texture.reloadRequested is not None and texture.resident:
+                self.reloadLatencies.append(time.perf_counter() - texture.reloadRequested)
+                texture.reloadRequested = None
+        evicted = 0
+        residentBytes = self.residentBytes
+        for texture in list(self.textures.values()): # oldest first
+            if residentBytes <= self.budget:
+                break
+            if texture.resident and texture.lastUsed < self.frame:
+                residentBytes -= texture.vramBytes
+                self.evict(texture)
+                evicted += 1
+        self.frame += 1
+        return evicted
+
+    def evict(self, texture):
+        texture.streamed.release()
+        texture.streamed = None
+        self.evictions += 1
+
+    @property
+    def residentBytes(self):
+        return sum(texture.vramBytes for texture in self.textures.values())
+
+    def stats(self):
+        latencies = self.reloadLatencies
+        return {
+            'residentBytes': self.residentBytes,
+            'budget': self.budget,
+            'resident': sum(texture.resident for texture in self.textures.values()),
+            'textures': len(self.textures),
+            'evictions': self.evictions,
+            'reloads': self.reloads,
+            'reloadLatency': sum(latencies) / len(latencies) if latencies else None, # mean, seconds
+            'maxReloadLatency': max(latencies) if latencies else None,
+            }
+
+    @staticmethod
+    def fallbackVariant(path, fallbackSize=256):
+        '''Largest <name>_<N>x<N> sibling no bigger than fallbackSize, None if path is no bigger itself'''
+        match = TextureManager.VARIANT.match(path)
+        if match is None or int(match.group(2)) <= fallbackSize:
+            return None
+        smaller = [variant for size, variant in TextureManager.variants(path) if size <= fallbackSize]
+        return smaller[-1] if smaller else None
+
+    @staticmethod
+    def variants(path):
+        '''[(N, path)] of every <name>_<N>x<N> sibling of path (path included), smallest first'''
+        match = TextureManager.VARIANT.match(path)
+        if match is None:
+            return []
+        prefix, extension = match.group(1), match.group(4)
+        variants = []
+        for candidate in glob.glob(glob.escape(prefix) + '_*x*' + extension):
+            variant = TextureManager.VARIANT.match(candidate)
+            if variant is not None and variant.group(1) == prefix:
+                variants.append((int(variant.group(2)), candidate))
+        return sorted(variants)
+
+    def release(self):
+        for texture in self.textures.values():
+            if texture.streamed is not None:
+                texture.streamed.release()
+                texture.streamed = None
+        self.textures.clear()
+        self.loader.release()
+
+if __name__ == '__main__':
+    import moderngl
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    images = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+    budget = 96 * 1024 * 1024
+    textures = TextureManager(ctx, budget=budget)
+    names = ('Brick_4096x4096.jpg', 'Brick_2048x2048.jpg', 'Brick_1024x1024.jpg', 'Brick_Spec.jpg')
+    scene = [textures.load(os.path.join(images, name)) for name in names]
+    print('fallback of {}: {}'.format(names[0], os.path.basename(scene[0].fallback.path)))
+
+    # one "room" per 30 frames: the 4096 texture alone, then the others together, three times over
+    peak = 0
+    for frame in range(180):
+        room = [scene[0]] if frame // 30 % 2 == 0 else scene[1:]
+        for location, texture in enumerate(room):
+            texture.use(location)
+        textures.update()
+        peak = max(peak, textures.residentBytes)
+        if frame % 30 == 29:
+            print('frame {}: {:.1f} MB resident, full resolution: {}'.format(
+                frame + 1, textures.residentBytes / 2 ** 20, ', '.join(os.path.basename(t.path) for t in scene if t.resident)))
+        time.sleep(1 / 60)
+    stats = textures.stats()
+    print('budget {:.0f} MB, peak {:.1f} MB, {} evictions, {} reloads, reload latency mean {:.0f} ms, max {:.0f} ms'.format(
+        budget / 2 ** 20, peak / 2 ** 20, stats['evictions'], stats['reloads'],
+        stats['reloadLatency'] * 1000, stats['maxReloadLatency'] * 1000))
+    textures.release()
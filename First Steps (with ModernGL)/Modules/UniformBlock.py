@@ -0,0 +1,150 @@
+import os
+import sys
+import numpy as np
+if __name__ == '__main__': # python Modules/UniformBlock.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Std140():
+    '''
+    std140 layout rules (OpenGL 4.5 spec, 7.6.2.2) for blocks of float based types:
+        float - size 4, align 4
+        vec2 - size 8, align 8
+        vec3, vec4 - size 12/16, align 16
+        matN - N vec4 columns, align 16
+        arrays (name[count]) - every element padded to a multiple of 16 bytes
+    '''
+    TYPES = {'float': (1, 1), 'vec2': (2, 1), 'vec3': (3, 1), 'vec4': (4, 1), 'mat2': (2, 2), 'mat3': (3, 3), 'mat4': (4, 4)}
+
+    @staticmethod
+    def layout(fields):
+        '''fields - [(name, glsl type)], returns ({name: (offset, components, columns, count, stride)}, block size)'''
+        members = {}
+        offset = 0
+        for name, glslType in fields:
+            count = 1
+            if '[' in name:
+                name, count = name[:-1].split('[')
+                count = int(count)
+            components, columns = Std140.TYPES[glslType]
+            if columns > 1 or count > 1:
+                align = 16
+                stride = 16 if columns > 1 else Std140._roundUp(4 * components, 16)
+            else:
+                align = 4 * (components if components != 3 else 4)
+                stride = 4 * components
+            offset = Std140._roundUp(offset, align)
+            members[name] = (offset, components, columns, count, stride)
+            offset += stride * columns * count
+        return members, Std140._roundUp(offset, 16)
+
+    @staticmethod
+    def declaration(blockName, fields, instanceName=''):
+        '''GLSL source of the block'''
+        lines = ['layout (std140) uniform {}'.format(blockName), '{']
+        lines += ['    {} {};'.format(glslType, name) for name, glslType in fields]
+        lines.append('}} {};'.format(instanceName).replace(' ;', ';'))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _roundUp(offset, alignment):
+        return (offset + alignment - 1) // alignment * alignment
+
+class UniformBlock():
+    '''
+    A std140 uniform block backed by one buffer, shared by every program that declares it:
+        block = UniformBlock(ctx, 'Camera', [('projection', 'mat4'), ('view', 'mat4'), ('viewPos', 'vec3')], binding=0)
+        block.attach(prog) - once per program
+        block.write('view', view) - updates a float32 staging copy, unchanged values are ignored
+        block.update() - once per frame, uploads the staging copy if anything changed
+    Matrices are written as given by pyrr (their bytes are already in OpenGL's column-major order).
+    '''
+    def __init__(self, ctx, name, fields, binding):
+        self.name = name
+        self.fields = fields
+        self.binding = binding
+        self.members, self.size = Std140.layout(fields)
+        self.staging = np.zeros(self.size // 4, dtype='f4')
+        self.buffer = ctx.buffer(reserve=self.size)
+        self.buffer.bind_to_uniform_block(binding)
+        self.dirty = True
+        self.uploads = 0
+
+    def attach(self, prog):
+        '''Point the program's block at this buffer's binding point'''
+        if self.name in prog:
+            block = prog[self.name]
+            if block.size != self.size:
+                raise ValueError('{} block is {} bytes in the shader but {} in std140 layout'.format(self.name, block.size, self.size))
+            block.binding = self.binding
+
+    def write(self, name, value):
+        offset, components, columns, count, stride = self.members[name]
+        start = offset // 4
+        # one row per column / array element, padded to the std140 stride
+        view = self.staging[start:start + stride // 4 * columns * count].reshape(columns * count, stride // 4)[:, :components]
+        value = np.asarray(value, dtype='f4').reshape(view.shape)
+        if not np.array_equal(view, value):
+            view[:] = value
+            self.dirty = True
+
+    def update(self):
+        if self.dirty:
+            self.buffer.write(self.staging)
+            self.dirty = False
+            self.uploads += 1
+
+    def declaration(self, instanceName=''):
+        return Std140.declaration(self.name, self.fields, instanceName)
+
+    def release(self):
+        self.buffer.release()
+
+if __name__ == '__main__':
+    import moderngl
+    from Modules.Headless import Headless
+
+    # offsets worked out by hand from the std140 rules: array elements and mat3 columns are padded to 16 bytes
+    fields = [('a', 'float'), ('b', 'vec3'), ('c', 'float'), ('d', 'mat4'), ('e', 'vec2'), ('f[3]', 'float'), ('g', 'mat3'),
+              ('h', 'vec2'), ('i', 'vec3'), ('j[2]', 'vec2'), ('k[2]', 'mat3')]
+    expected = {'a': 0, 'b': 16, 'c': 28, 'd': 32, 'e': 96, 'f': 112, 'g': 160, 'h': 208, 'i': 224, 'j': 240, 'k': 272}
+    strides = {'f': 16, 'g': 16, 'j': 16, 'k': 16} # per array element / matrix column
+    members, size = Std140.layout(fields)
+    offsets = {name: member[0] for name, member in members.items()}
+    print('offsets match the spec: {}, strides: {}, size {} (expected 368): {}'.format(
+        offsets == expected, all(members[name][4] == stride for name, stride in strides.items()), size, size == 368))
+
+    # and the driver agrees on the block size and contents, each element read adds its own bit
+    ctx = Headless.standaloneContext()
+    block = UniformBlock(ctx, 'Test', fields, binding=0)
+    prog = ctx.program(vertex_shader='''
+        # version 330 core
+        {}
+        out float result;
+        void main()
+        {{
+            result = a + b.z + c + d[3][1] + e.y + f[0] + f[1] + f[2] + g[0][0] + g[1][1] + g[2][2] + h.x + i.z
+                   + j[0].y + j[1].x + k[0][2][2] + k[1][0][0] + k[1][2][1];
+            gl_Position = vec4(0.0, 0.0, 0.0, 1.0);
+        }}
+        '''.format(block.declaration()), fragment_shader='''
+        # version 330 core
+        in float result;
+        out vec4 fragColour;
+        void main() { fragColour = vec4(result); }
+        ''')
+    block.attach(prog)
+    values = {'a': 1, 'b': [0, 0, 2], 'c': 4, 'e': [0, 16], 'f': [32, 64, 128], 'h': [2048, 0], 'i': [0, 0, 4096],
+              'j': [[0, 8192], [16384, 0]]}
+    for name, value in values.items():
+        block.write(name, value)
+    matrix = np.zeros((4, 4)); matrix[3, 1] = 8 # d[3][1]: 4th column, 2nd row
+    block.write('d', matrix)
+    block.write('g', np.diag([256, 512, 1024]))
+    matrices = np.zeros((2, 3, 3)); matrices[0, 2, 2] = 32768; matrices[1, 0, 0] = 65536; matrices[1, 2, 1] = 131072
+    block.write('k', matrices)
+    block.update()
+    fbo = ctx.framebuffer([ctx.renderbuffer((1, 1), 1, dtype='f4')])
+    fbo.use()
+    ctx.vertex_array(prog, []).render(moderngl.POINTS, vertices=1)
+    print('driver block size {}, sum of members read in GLSL: {:.0f} (expected 262143)'.format(
+        prog['Test'].size, np.frombuffer(fbo.read(components=1, dtype='f4'), dtype='f4')[0]))
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os
+import sys
+import numpy as np
+if __name__ == '__main__': # python Modules/UniformCache.py: the Modules package lives next to the demos
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class UniformCache():
+    '''
+    Wraps a moderngl program and skips uniform uploads that would not change anything.
+    write(name, value) copies value (scalar, list, numpy/pyrr array) into a float32/int32 staging array
+    preallocated for that uniform, compares it with the last upload and only calls write() on a change.
+    hits - redundant writes skipped, misses - writes sent to the driver
+    '''
+    DTYPES = {'f': 'f4', 'i': 'i4', 'u': 'u4', 'd': 'f8'}
+
+    def __init__(self, prog):
+        self.prog = prog
+        self.staging = {} # name -> (staging array, last uploaded array)
+        self.hits = 0
+        self.misses = 0
+
+    def write(self, name, value):
+        entry = self.staging.get(name)
+        if entry is None:
+            uniform = self.prog[name]
+            dtype = UniformCache.DTYPES[uniform.fmt[-1]]
+            size = uniform.dimension * uniform.array_length
+            entry = self.staging[name] = (np.zeros(size, dtype=dtype), np.zeros(size, dtype=dtype))
+            np.copyto(entry[0], np.ravel(value), casting='unsafe')
+        else:
+            np.copyto(entry[0], np.ravel(value), casting='unsafe')
+            if np.array_equal(entry[0], entry[1]):
+                self.hits += 1
+                return
+        staging, last = entry
+        self.prog[name].write(staging)
+        last[:] = staging
+        self.misses += 1
+
+    def invalidate(self):
+        '''Forget the cached values, e.g. after writing to the program directly'''
+        self.staging.clear()
+
+if __name__ == '__main__':
+    import moderngl
+    from pyrr import Matrix44
+    from Modules.Headless import Headless
+
+    ctx = Headless.standaloneContext()
+    prog = ctx.program(vertex_shader='''
+        # version 330 core
+        uniform mat4 projection;
+        uniform vec3 viewPos;
+        uniform int unit;
+        void main() { gl_Position = projection * vec4(viewPos, float(unit)); }
+        ''')
+    uniforms = UniformCache(prog)
+    projection = Matrix44.perspective_projection(45.0, 16 / 9, 0.1, 1000.0)
+    for frame in range(60):
+        uniforms.write('projection', projection)
+        uniforms.write('viewPos', [0.0, 0.0, frame // 30]) # changes once
+        uniforms.write('unit', 1)
+    print('hits: {}, misses: {}, projection round trip: {}'.format(
+        uniforms.hits, uniforms.misses, np.allclose(np.frombuffer(prog['projection'].read(), dtype='f4'), projection.ravel())))
@@ -1,105 +1,252 @@
+import math
 from pyglet.window import Window
 from pyglet.window import key
 import numpy as np
-import pyrr
-from pyrr import Matrix44, Vector3
+from pyrr import Matrix44
 
-class ViewportFP(Window):
+class CameraFP():
     '''
-    Convenience class for creating a OpenGL window.
-    Creates a First-person-type camera.
-    Generates a perspective and look_at (view) matrices.
-    Includes camera controls (W, S, A, D, SPACE, LCTRL & mouse)
+    First-person camera state of ViewportFP, float32 arrays preallocated and updated in place:
+        camera.press(symbol) / camera.release(symbol) - movement keys kept as a bitmask
+        camera.look(dx, dy) - mouse motion turns the camera
+        camera.step(dt) - moves speed * dt units along the held keys
+        camera.interpolate(alpha) - eye between the last two steps, the view (and view-projection)
+                                    matrix is only rebuilt when the camera actually changed
+    The front/side/up basis changes with the mouse only, so it is kept instead of being
+    re-normalised every frame; the world up axis is fixed to +Y.
     '''
-    def __init__(self, width=1280, height=720, name='OpenGL Window', cameraSpeed=0.1, mouseSpeed=0.3, invertMouse=False, resizable=False, vsync=False):
-        super().__init__(width, height, name, resizable=resizable, vsync=vsync)
-        self.cameraSpeed = cameraSpeed
-        self.mouseSpeed = mouseSpeed
+    KEYS = {key.W: 1, key.S: 2, key.A: 4, key.D: 8, key.SPACE: 16, key.LCTRL: 32}
+
+    def __init__(self, projection, speed=6.0, mouseSpeed=0.3, invertMouse=False):
+        self.speed = speed # units per second
+        self.mouseSpeed = mouseSpeed # degrees per pixel
         self.invertMouse = invertMouse
-        self.cameraPos = Vector3([0.0, 0.0, 0.0])
-        self.cameraTarget = Vector3([0.0, 0.0, -1.0])
-        self.cameraUp = Vector3([0.0, 1.0, 0.0])
-        self.worldUp = Vector3([0.0, 1.0, 0.0])
+        self.keys = 0
         self.yaw = -90.0
         self.pitch = 0.0
-        self.pressedKeys = []
-        
+        self.position = np.zeros(3, dtype='f4')
+        self.previous = np.zeros(3, dtype='f4') # before the last step
+        self.eye = np.zeros(3, dtype='f4') # interpolated, what the view is built from
+        self.direction = np.zeros(3, dtype='f4') # scratch
+        self.basis = np.zeros((3, 3), dtype='f4') # rows: side, up, -front
+        self.front = np.zeros(3, dtype='f4')
+        self.up = np.array([0.0, 1.0, 0.0], dtype='f4')
+        self.projection = Matrix44(projection, dtype='f4')
+        self.view = Matrix44(np.identity(4, dtype='f4'))
+        self.viewProjection = Matrix44(np.identity(4, dtype='f4'))
+        self.rotation = self.view[:3, :3] # views into the matrix, written in place
+        self.translation = self.view[3, :3]
+        self.moving = False
+        self.dirty = True
+        self.version = 0 # incremented whenever the view changes
+        self._orient()
+        self.interpolate(1.0)
+
+    def press(self, symbol):
+        self.keys |= CameraFP.KEYS.get(symbol, 0)
+
+    def release(self, symbol):
+        self.keys &= ~CameraFP.KEYS.get(symbol, 0)
+
+    def look(self, dx, dy):
+        self.yaw += dx * self.mouseSpeed
+        self.pitch += -dy * self.mouseSpeed if self.invertMouse else dy * self.mouseSpeed
+        self.pitch = min(max(self.pitch, -89.0), 89.0)
+        self._orient()
+
+    def _orient(self):
+        yaw, pitch = math.radians(self.yaw), math.radians(self.pitch)
+        fx, fy, fz = math.cos(yaw) * math.cos(pitch), math.sin(pitch), math.sin(yaw) * math.cos(pitch)
+        sx, sz = -math.sin(yaw), math.cos(yaw) # side = normalize(cross(front, +Y))
+        self.front[:] = fx, fy, fz
+        self.basis[0] = sx, 0.0, sz
+        self.basis[1] = -sz * fy, sz * fx - sx * fz, sx * fy # up = cross(side, front)
+        self.basis[2] = -fx, -fy, -fz
+        self.dirty = True
+
+    def step(self, dt):
+        '''One simulation step of dt seconds'''
+        np.copyto(self.previous, self.position)
+        keys = self.keys
+        if not keys:
+            if self.moving: # the eye still has to settle on the final position
+                self.dirty = True
+            self.moving = False
+            return
+        direction = self.direction
+        direction.fill(0.0)
+        if keys & 1: np.add(direction, self.front, out=direction)
+        if keys & 2: np.subtract(direction, self.front, out=direction)
+        if keys & 4: np.subtract(direction, self.basis[0], out=direction)
+        if keys & 8: np.add(direction, self.basis[0], out=direction)
+        if keys & 16: np.add(direction, self.up, out=direction)
+        if keys & 32: np.subtract(direction, self.up, out=direction)
+        direction *= self.speed * dt
+        self.position += direction
+        self.moving = True
+        self.dirty = True
+
+    def interpolate(self, alpha=1.0):
+        '''Place the eye alpha of the way through the last step, returns True if the view changed'''
+        if not (self.dirty or self.moving):
+            return False
+        eye = self.eye
+        np.subtract(self.position, self.previous, out=eye)
+        eye *= alpha
+        eye += self.previous
+        self.rotation[...] = self.basis.T
+        np.dot(self.basis, eye, out=self.translation) # look_at: -(side, up, -front) . eye
+        np.negative(self.translation, out=self.translation)
+        np.matmul(self.view, self.projection, out=self.viewProjection)
+        self.dirty = False
+        self.version += 1
+        return True
+
+class ViewportFP(Window):
+    '''
+    Convenience class for creating a OpenGL window.
+    Creates a First-person-type camera (CameraFP).
+    Generates a perspective and look_at (view) matrices, and their product for MVPs.
+    Includes camera controls (W, S, A, D, SPACE, LCTRL & mouse), cameraSpeed is in units per second
+    With a Profiler set as window.profiler: F1 toggles its overlay (bars, numbers in the caption), F2 writes a Chrome trace
+    '''
+    def __init__(self, width=1280, height=720, name='OpenGL Window', cameraSpeed=6.0, mouseSpeed=0.3, invertMouse=False, resizable=False, vsync=False):
+        super().__init__(width, height, name, resizable=resizable, vsync=vsync)
+        self.camera = CameraFP(Matrix44.perspective_projection(45.0, width / height, 0.1, 1000.0), cameraSpeed, mouseSpeed, invertMouse)
+        self.viewChanged = True # the view matrix changed in the last update()
+        self.viewVersion = -1 # camera version seen by the last update(), the first one always reports a change
+        self.title = name # caption without the profiler numbers
+        self.profiler = None
+
         self.set_mouse_visible(False)
         self.set_exclusive_mouse(True)
-        
-        # Matrices
-        self.projection = Matrix44.perspective_projection(45.0, width / height, 0.1, 1000.0)
-        self.view = Matrix44.look_at(self.cameraPos, self.cameraTarget, self.cameraUp)
-    
+
     def getProjectionMatrix(self):
-        return self.projection
-    
+        return self.camera.projection
+
     def getViewMatrix(self):
-        return self.view
-    
+        return self.camera.view
+
+    def getViewProjectionMatrix(self):
+        '''projection * view, rebuilt together with the view'''
+        return self.camera.viewProjection
+
     def getCameraPosition(self):
-        return self.cameraPos
-    
+        return self.camera.eye
+
     def on_key_press(self, symbol, modifier):
-        '''Add the pressed key to the list to be later used in updateCameraPosition'''
-        if symbol not in self.pressedKeys:
-            self.pressedKeys.append(symbol)
+        '''Set the key's bit, later used in update'''
+        self.camera.press(symbol)
         if symbol == key.ESCAPE: # EXIT APPLICATION
             from pyglet import app
             app.exit()
-            
+        if self.profiler is not None: # F1 and F2
+            self.profiler.on_key_press(symbol, modifier)
+            if symbol == key.F1 and not self.profiler.overlay:
+                self.set_caption(self.title)
+
     def on_key_release(self, symbol, modifiers):
-        if symbol in self.pressedKeys:
-            self.pressedKeys.remove(symbol)
-            
+        self.camera.release(symbol)
+
     def on_mouse_motion(self, x, y, dx, dy):
-        '''Update camera target'''
-        self.yaw += dx * self.mouseSpeed
-        
-        if self.invertMouse:
-            self.pitch -= dy * self.mouseSpeed
+        '''Update camera direction'''
+        self.camera.look(dx, dy)
+
+    def update(self, clock=None):
+        '''
+        Call this method in the main loop. With a FrameClock the camera moves once per fixed step
+        and the view is interpolated between the last two steps, otherwise by 1/60 s per call
+        '''
+        if clock is None:
+            self.camera.step(1 / 60)
         else:
-            self.pitch += dy * self.mouseSpeed
-        
-        if self.pitch > 89.0: self.pitch = 89.0
-        if self.pitch < -89.0: self.pitch = -89.0
-        frontVec = Vector3()
-        frontVec.x = np.cos(np.radians(self.yaw)) * np.cos(np.radians(self.pitch))
-        frontVec.y = np.sin(np.radians(self.pitch))
-        frontVec.z = np.sin(np.radians(self.yaw)) * np.cos(np.radians(self.pitch))
-        self.cameraTarget = self.cameraPos + pyrr.vector.normalize(frontVec)
-        
-    def updateCameraPosition(self):
-        '''Check pressed keys and update camera position accordingly'''
-        if self.pressedKeys:
-            frontVec = pyrr.vector.normalize(self.cameraTarget - self.cameraPos)
-            sideVec = pyrr.vector.normalize(np.cross(frontVec, self.worldUp))
-            if key.W in self.pressedKeys:
-                self.cameraPos += frontVec * self.cameraSpeed
-                self.cameraTarget += frontVec * self.cameraSpeed
-            if key.S in self.pressedKeys:
-                self.cameraPos -= frontVec * self.cameraSpeed
-                self.cameraTarget -= frontVec * self.cameraSpeed
-            if key.A in self.pressedKeys:
-                self.cameraPos -= sideVec * self.cameraSpeed
-                self.cameraTarget -= sideVec * self.cameraSpeed
-            if key.D in self.pressedKeys:
-                self.cameraPos += sideVec * self.cameraSpeed
-                self.cameraTarget += sideVec * self.cameraSpeed
-            if key.SPACE in self.pressedKeys:
-                self.cameraPos += self.worldUp * self.cameraSpeed
-                self.cameraTarget += self.worldUp * self.cameraSpeed
-            if key.LCTRL in self.pressedKeys:
-                self.cameraPos -= self.worldUp * self.cameraSpeed
-                self.cameraTarget -= self.worldUp * self.cameraSpeed
-                          
-    def update(self):
-        '''Call this method in the main loop'''
-        self.updateCameraPosition()
-        self.view = Matrix44.look_at(self.cameraPos, self.cameraTarget, self.cameraUp)
+            for _ in range(clock.steps):
+                self.camera.step(clock.step)
+        self.camera.interpolate(1.0 if clock is None else clock.alpha)
+        self.viewChanged = self.camera.version != self.viewVersion
+        self.viewVersion = self.camera.version
+        if self.profiler is not None and self.profiler.overlay and self.profiler.frames % 30 == 0: # twice a second, captions are slow
+            self.set_caption('{} - {}'.format(self.title, self.profiler.text()))
 
 if __name__ == '__main__':
-    from pyglet import app
-    
-    window = ViewportFP()
-    app.run()
+    import sys
+
+    if '--benchmark' not in sys.argv:
+        from pyglet import app
+
+        window = ViewportFP()
+        app.run()
+        sys.exit()
+
+    import time
+    import pyrr
+    from pyrr import Vector3
+
+    class LegacyCamera():
+        '''The update of ViewportFP before CameraFP: Vector3 temporaries, a key list, look_at every frame'''
+        def __init__(self):
+            self.cameraPos = Vector3([0.0, 0.0, 0.0])
+            self.cameraTarget = Vector3([0.0, 0.0, -1.0])
+            self.cameraUp = Vector3([0.0, 1.0, 0.0])
+            self.worldUp = Vector3([0.0, 1.0, 0.0])
+            self.yaw, self.pitch, self.mouseSpeed, self.cameraSpeed = -90.0, 0.0, 0.3, 0.1
+            self.pressedKeys = []
+
+        def on_mouse_motion(self, dx, dy):
+            self.yaw += dx * self.mouseSpeed
+            self.pitch = min(max(self.pitch + dy * self.mouseSpeed, -89.0), 89.0)
+            frontVec = Vector3()
+            frontVec.x = np.cos(np.radians(self.yaw)) * np.cos(np.radians(self.pitch))
+            frontVec.y = np.sin(np.radians(self.pitch))
+            frontVec.z = np.sin(np.radians(self.yaw)) * np.cos(np.radians(self.pitch))
+            self.cameraTarget = self.cameraPos + pyrr.vector.normalize(frontVec)
+
+        def update(self):
+            if self.pressedKeys:
+                frontVec = pyrr.vector.normalize(self.cameraTarget - self.cameraPos)
+                sideVec = pyrr.vector.normalize(np.cross(frontVec, self.worldUp))
+                for symbol, vector, sign in ((key.W, frontVec, 1), (key.S, frontVec, -1), (key.A, sideVec, -1),
+                                             (key.D, sideVec, 1), (key.SPACE, self.worldUp, 1), (key.LCTRL, self.worldUp, -1)):
+                    if symbol in self.pressedKeys:
+                        self.cameraPos += vector * self.cameraSpeed * sign
+                        self.cameraTarget += vector * self.cameraSpeed * sign
+            self.view = Matrix44.look_at(self.cameraPos, self.cameraTarget, self.cameraUp)
+
+    projection = Matrix44.perspective_projection(45.0, 16 / 9, 0.1, 1000.0)
+    legacy, camera = LegacyCamera(), CameraFP(projection)
+
+    # the same input on both: turn, walk forward and right, rise, stop
+    for dx, dy, keys in ((30, 10, [key.W]), (-12, 4, [key.W, key.D]), (5, -20, [key.SPACE]), (0, 0, [])):
+        legacy.on_mouse_motion(dx, dy)
+        camera.look(dx, dy)
+        legacy.pressedKeys = list(keys)
+        camera.keys = 0
+        for symbol in keys:
+            camera.press(symbol)
+        for frame in range(30):
+            legacy.update()
+            camera.step(1 / 60)
+            camera.interpolate(1.0)
+    print('same view as before after 120 frames of input: {} (max difference {:.2e})'.format(
+        np.allclose(legacy.view, camera.view, atol=1e-4), np.abs(legacy.view - camera.view).max()))
+
+    frames = 20000
+    for label, keys, mouse in (('idle', [], 0), ('walking (W + D)', [key.W, key.D], 0), ('walking and turning', [key.W, key.D], 1)):
+        legacy.pressedKeys = list(keys)
+        camera.keys = 0
+        for symbol in keys:
+            camera.press(symbol)
+        start = time.perf_counter()
+        for frame in range(frames):
+            if mouse:
+                legacy.on_mouse_motion(mouse, 0)
+            legacy.update()
+        before = (time.perf_counter() - start) / frames * 1e6
+        start = time.perf_counter()
+        for frame in range(frames):
+            if mouse:
+                camera.look(mouse, 0)
+            camera.step(1 / 60)
+            camera.interpolate(1.0)
+        after = (time.perf_counter() - start) / frames * 1e6
+        print('{:<20} before {:6.2f} us per update, after {:6.2f} us (view and view-projection included)'.format(label, before, after))
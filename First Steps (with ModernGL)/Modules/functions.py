@@ -14,7 +14,54 @@ class Math():
         tMatrix = trans * scale * rotX * rotY * rotZ
         return tMatrix
     
+    @staticmethod
+    def buildTransMatrices(pos, rot=(0,0,0), scale=(1,1,1), out=None):
+        '''
+        Batched buildTransMatrix: (N,3) pos, rot (degrees) and scale -> (N,4,4) float32, same element layout as pyrr.
+        Any argument can also be a single (3,) vector. out - optional preallocated (N,4,4) array to write into
+        '''
+        pos, rot, scale = np.broadcast_arrays(np.asarray(pos, dtype='f8').reshape(-1, 3),
+                                              np.asarray(rot, dtype='f8').reshape(-1, 3),
+                                              np.asarray(scale, dtype='f8').reshape(-1, 3))
+        if out is None:
+            out = np.empty((len(pos), 4, 4), dtype='f4')
+        angles = np.radians(rot)
+        cx, cy, cz = np.cos(angles).T
+        sx, sy, sz = np.sin(angles).T
+        
+        # trans * scale * rotX * rotY * rotZ in pyrr's order is the row-major product Rz.Ry.Rx.S.T
+        out[:, 0, 0] = cz * cy
+        out[:, 0, 1] = cz * sy * sx - sz * cx
+        out[:, 0, 2] = cz * sy * cx + sz * sx
+        out[:, 1, 0] = sz * cy
+        out[:, 1, 1] = sz * sy * sx + cz * cx
+        out[:, 1, 2] = sz * sy * cx - cz * sx
+        out[:, 2, 0] = -sy
+        out[:, 2, 1] = cy * sx
+        out[:, 2, 2] = cy * cx
+        out[:, :3, :3] *= scale[:, None, :].astype(out.dtype) # scales the columns
+        out[:, :3, 3] = 0
+        out[:, 3, :3] = pos
+        out[:, 3, 3] = 1
+        return out
+    
 class Path():
     @staticmethod
     def local(*path):
-        return os.path.join(os.path.dirname(sys.argv[0]), *path)
\ No newline at end of file
+        return os.path.join(os.path.dirname(sys.argv[0]), *path)
+
+if __name__ == '__main__':
+    import timeit
+    
+    count = 100000
+    pos = np.random.uniform(-10, 10, size=(count, 3))
+    rot = np.random.uniform(-180, 180, size=(count, 3))
+    scale = np.random.uniform(0.1, 2, size=(count, 3))
+    batch = Math.buildTransMatrices(pos, rot, scale)
+    single = np.array([Math.buildTransMatrix(pos[i], rot[i], scale[i]) for i in range(1000)], dtype='f4')
+    print('max difference to buildTransMatrix: {:.2e}'.format(np.abs(batch[:1000] - single).max()))
+    
+    out = np.empty((count, 4, 4), dtype='f4')
+    batchTime = min(timeit.repeat(lambda: Math.buildTransMatrices(pos, rot, scale, out=out), number=1, repeat=5))
+    singleTime = min(timeit.repeat(lambda: [Math.buildTransMatrix(pos[i], rot[i], scale[i]) for i in range(1000)], number=1, repeat=3)) / 1000
+    print('buildTransMatrices: {:,.0f} matrices/s, buildTransMatrix: {:,.0f} matrices/s'.format(count / batchTime, 1 / singleTime))